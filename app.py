@@ -1,3 +1,4 @@
+from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -5,15 +6,15 @@ from telegram.ext import (
     MessageHandler,
     CallbackQueryHandler,
     ChatMemberHandler,
-    PicklePersistence,
+    TypeHandler,
 )
-from ptbcontrib.ptb_jobstores.sqlalchemy import PTBSQLAlchemyJobStore
 
 import grpc
-from opentelemetry import metrics
+from opentelemetry import metrics, trace
 from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import (
     OTLPMetricExporter,
 )
+from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 from opentelemetry.sdk import metrics as sdkmetrics
 from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.metrics.export import (
@@ -21,11 +22,36 @@ from opentelemetry.sdk.metrics.export import (
     PeriodicExportingMetricReader,
 )
 from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 
 from src.custom_filters import filter_bot_added
 from src.logging import tg_logger
+from src.instrumentation import (
+    InstrumentedHTTPXRequest,
+    instrument_engine,
+    instrument_handlers,
+)
+from src.model import engine
+from src.tracing import TracedApplication
+from src.update_processor import ChatOrderedUpdateProcessor
+from src.update_routing import accept_update, allowed_updates
+from src.job_registry import job_registry
+from src.jobstore import WriteBehindJobStore
+from src.outbound import outbound
+from src.health import health_monitor
+from src.webhook import run_webhook
+from src.router import run_router
+from src.sharding import shard_coordinator
+from src.chat_settings import chat_settings_cache
+from src.stats import db_stats, reconcile_db_stats
+from src.persistence import SQLPersistence, evict_persistence
+from src import constants
 from src import handlers
+import asyncio
 import os
+from typing import Optional
 
 
 temporality_delta = {
@@ -38,6 +64,76 @@ temporality_delta = {
 }
 
 
+async def persistent_jobstore(application) -> Optional[WriteBehindJobStore]:
+    """
+    The store of the jobs persisted before the deadlines table was introduced,
+    None if there is no database for it.
+    """
+    if "PERSISTENCE_DATABASE_URL" not in os.environ:
+        return None
+    jobstore = WriteBehindJobStore(
+        application=application,
+        url=os.environ["PERSISTENCE_DATABASE_URL"],
+    )
+    # one per join used to be scheduled, see db_metrics_reader_helper; dropped
+    # before the store is loaded into the scheduler
+    await asyncio.to_thread(jobstore.drop_jobs, ["metrics_exporter"])
+    return jobstore
+
+
+async def post_init(application):
+    outbound.start()
+    if constants.SHARD_ROLE == "worker":
+        # the owned slots are known before the sweeper claims anything
+        await shard_coordinator.start()
+        jobstore = None
+    else:
+        jobstore = await persistent_jobstore(application)
+        if jobstore is not None:
+            application.job_queue.scheduler.add_jobstore(jobstore)
+    # the overdue deadlines are claimed before the sweeper would run them all at once
+    await handlers.startup_reconciler.start(application, jobstore)
+    handlers.deadline_sweeper.start(application)
+    await health_monitor.start(application)
+
+
+async def post_stop(application):
+    await health_monitor.stop()
+    await handlers.startup_reconciler.stop()
+    await handlers.deadline_sweeper.stop()
+    await handlers.burst_coalescer.flush_all()
+    await handlers.wait_pending_sends()
+    await outbound.stop()
+    if constants.SHARD_ROLE == "worker":
+        await shard_coordinator.stop()
+
+
+def leader_duties(application):
+    """
+    The callback moving the duties which must run once across the workers to the
+    leader: exporting the DB stats and running the jobs persisted before the
+    deadlines table was introduced.
+    """
+
+    async def on_leadership(is_leader: bool) -> None:
+        db_stats.exported = is_leader
+        if is_leader:
+            await db_stats.reconcile()
+        if "PERSISTENCE_DATABASE_URL" not in os.environ:
+            return
+        scheduler = application.job_queue.scheduler
+        if is_leader:
+            jobstore = await persistent_jobstore(application)
+            # overdue, so paced like those on startup
+            await handlers.startup_reconciler.replay_legacy_jobs(application, jobstore)
+            scheduler.add_jobstore(jobstore, alias="persistent")
+        else:
+            scheduler.remove_jobstore("persistent")
+        job_registry.rebuild(application.job_queue.jobs())
+
+    return on_leadership
+
+
 def main():
     dsn = os.environ.get("UPTRACE_DSN")
 
@@ -60,22 +156,66 @@ def main():
     provider = MeterProvider(metric_readers=[reader], resource=resource)
     metrics.set_meter_provider(provider)
 
+    span_exporter = OTLPSpanExporter(
+        endpoint="otlp.uptrace.dev:4317",
+        headers=(("uptrace-dsn", dsn),),
+        timeout=5,
+        compression=grpc.Compression.Gzip,
+    )
+    tracer_provider = TracerProvider(
+        resource=resource,
+        # the children of an update follow its decision
+        sampler=ParentBased(TraceIdRatioBased(constants.TRACE_SAMPLE_RATE)),
+    )
+    tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(tracer_provider)
+
     application = (
         ApplicationBuilder()
-        .persistence(PicklePersistence(filepath="persistent_storage.pickle"))
+        .application_class(TracedApplication)
+        .persistence(SQLPersistence())
         .token(os.environ["TELEGRAM_TOKEN"])
+        # the default pool size of ApplicationBuilder
+        .request(InstrumentedHTTPXRequest(connection_pool_size=256))
+        .concurrent_updates(ChatOrderedUpdateProcessor(accept=accept_update))
+        .post_init(post_init)
+        .post_stop(post_stop)
         .build()
     )
-    if "PERSISTENCE_DATABASE_URL" in os.environ:
-        application.job_queue.scheduler.add_jobstore(
-            PTBSQLAlchemyJobStore(
-                application=application,
-                url=os.environ["PERSISTENCE_DATABASE_URL"],
-            )
-        )
+    if constants.SHARD_ROLE == "worker":
+        db_stats.exported = False
+        db_stats.worker_id = shard_coordinator.worker_id
+        handlers.deadline_sweeper.owned_slots = shard_coordinator.owned_slots
+        shard_coordinator.on_leadership(leader_duties(application))
+        # the settings may be changed from the private chat of an admin handled
+        # by another worker
+        shard_coordinator.on_heartbeat(chat_settings_cache.poll_changes)
+        shard_coordinator.on_heartbeat(db_stats.sync)
+        # an admin's menu state may be written by another worker after a failover
+        shard_coordinator.on_heartbeat(application.persistence.poll_changes)
+    job_registry.attach(application.job_queue)
+    application.job_queue.run_repeating(
+        reconcile_db_stats,
+        constants.DB_STATS_RECONCILE_INTERVAL_S,
+        first=0,
+        name="db_stats",
+        job_kwargs={"id": "db_stats", "replace_existing": True},
+    )
+    application.job_queue.run_repeating(
+        evict_persistence,
+        constants.PERSISTENCE_EVICT_INTERVAL_S,
+        name="persistence_eviction",
+        job_kwargs={"id": "persistence_eviction", "replace_existing": True},
+    )
+
+    # runs before all the other handlers, see user_profiles_handler
+    application.add_handler(
+        TypeHandler(Update, handlers.user_profiles_handler), group=-1
+    )
 
     application.add_handler(CommandHandler("help", handlers.help_handler))
     application.add_handler(CommandHandler("listjobs", handlers.list_jobs_handler))
+    application.add_handler(CommandHandler("cachestats", handlers.cache_stats_handler))
 
     # group UX
     application.add_handler(
@@ -84,12 +224,24 @@ def main():
             ChatMemberHandler.MY_CHAT_MEMBER,
         )
     )
+    application.add_handler(
+        ChatMemberHandler(
+            handlers.chat_member_handler,
+            ChatMemberHandler.CHAT_MEMBER,
+        )
+    )
     application.add_handler(
         MessageHandler(
             filters.Entity("hashtag") & filters.ChatType.GROUPS,
             handlers.on_hashtag_message,
         )
     )
+    application.add_handler(
+        MessageHandler(
+            filters.StatusUpdate.NEW_CHAT_TITLE & filters.ChatType.GROUPS,
+            handlers.new_chat_title_handler,
+        )
+    )
     application.add_handler(
         MessageHandler(
             filters.StatusUpdate.NEW_CHAT_MEMBERS & filter_bot_added,
@@ -100,11 +252,42 @@ def main():
     # admin UX
     application.add_handler(CommandHandler("start", handlers.start_handler))
     application.add_handler(CallbackQueryHandler(handlers.button_handler))
-    application.add_handler(MessageHandler(filters.TEXT, handlers.message_handler))
+    application.add_handler(
+        MessageHandler(
+            filters.TEXT & filters.ChatType.PRIVATE,
+            handlers.message_handler,
+        )
+    )
     application.add_error_handler(handlers.error_handler)
+    instrument_handlers(application)
+    instrument_engine(engine)
 
     tg_logger.info("Bot has started successfully")
-    application.run_polling()
+    # chat_member updates are only sent if asked for explicitly
+    update_types = allowed_updates(application)
+    if constants.SHARD_ROLE == "router":
+        run_router(
+            os.environ["TELEGRAM_TOKEN"],
+            url=constants.WEBHOOK_URL,
+            secret_token=constants.WEBHOOK_SECRET_TOKEN,
+            allowed_updates=update_types,
+        )
+    elif constants.SHARD_ROLE == "worker":
+        # the router sets the webhook and forwards the updates of our chats
+        run_webhook(
+            application,
+            url=None,
+            secret_token=constants.WEBHOOK_SECRET_TOKEN,
+        )
+    elif constants.WEBHOOK_URL:
+        run_webhook(
+            application,
+            url=constants.WEBHOOK_URL,
+            secret_token=constants.WEBHOOK_SECRET_TOKEN,
+            allowed_updates=update_types,
+        )
+    else:
+        application.run_polling(allowed_updates=update_types)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+"""
+Update throughput with polling and with the webhook.
+
+Runs the application against a fake Telegram, in process: in polling mode the
+fake answers getUpdates with batches of up to 100 of --updates synthetic updates,
+each after --rtt-ms; in webhook mode the fake pushes the same updates to the
+webhook server over --connections keep-alive connections, like Telegram does.
+Every update is handled by a handler sleeping --handler-ms, across --chats chats.
+Reports updates per second from the first update to the last handled one, and
+how many pushes the webhook answered with 503.
+
+    python benchmarks/webhook_benchmark.py --updates 5000 --rtt-ms 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123:benchmark")
+os.environ.setdefault("TELEGRAM_ERROR_CHAT_ID", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+from telegram.request import BaseRequest
+
+from src.update_processor import ChatOrderedUpdateProcessor
+from src.webhook import WebhookServer
+
+SECRET = "benchmark"
+
+
+def make_update(update_id, chats):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": -(update_id % chats) - 1, "type": "supergroup"},
+            "from": {"id": update_id, "is_bot": False, "first_name": "user"},
+            "text": "hello",
+        },
+    }
+
+
+class FakeTelegram(BaseRequest):
+    """
+    Answers the Bot API requests of the application, getUpdates from a list of updates.
+    """
+
+    def __init__(self, updates, rtt_s):
+        self.updates = updates
+        self.rtt_s = rtt_s
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        if endpoint == "getMe":
+            result = {"id": 123, "is_bot": True, "first_name": "bot", "username": "bot"}
+        elif endpoint == "getUpdates":
+            await asyncio.sleep(self.rtt_s)
+            offset = request_data.parameters.get("offset") or 1
+            result = self.updates[offset - 1 : offset + 99]
+            if not result:
+                # long polling with nothing to return
+                await asyncio.sleep(0.1)
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def build_application(updates, args, handled, done):
+    async def handler(update, context):
+        await asyncio.sleep(args.handler_ms / 1000)
+        handled.append(update.update_id)
+        if len(handled) == len(updates):
+            done.set()
+
+    application = (
+        ApplicationBuilder()
+        .token("123:benchmark")
+        .request(FakeTelegram(updates, args.rtt_ms / 1000))
+        .get_updates_request(FakeTelegram(updates, args.rtt_ms / 1000))
+        .concurrent_updates(
+            ChatOrderedUpdateProcessor(max_concurrent_updates=args.concurrency)
+        )
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, handler))
+    return application
+
+
+async def run_polling(updates, args):
+    handled, done = [], asyncio.Event()
+    application = build_application(updates, args, handled, done)
+    await application.initialize()
+    await application.start()
+    time_start = time.monotonic()
+    await application.updater.start_polling(poll_interval=0)
+    await done.wait()
+    elapsed = time.monotonic() - time_start
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    return elapsed, 0
+
+
+async def push(port, bodies, rejected):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for body in bodies:
+        while True:
+            writer.write(
+                (
+                    "POST /telegram HTTP/1.1\r\n"
+                    f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n"
+                ).encode()
+                + body
+            )
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            while (await reader.readline()) != b"\r\n":
+                pass
+            if status == 200:
+                break
+            # what Telegram does, with a much shorter delay
+            rejected[0] += 1
+            await asyncio.sleep(0.01)
+    writer.close()
+
+
+async def run_webhook(updates, args):
+    handled, done = [], asyncio.Event()
+    application = build_application(updates, args, handled, done)
+    server = WebhookServer(
+        application, SECRET, host="127.0.0.1", port=0, max_pending=args.max_pending
+    )
+    await application.initialize()
+    await application.start()
+    await server.start()
+    port = server.sockets[0].getsockname()[1]
+
+    bodies = [json.dumps(update).encode() for update in updates]
+    rejected = [0]
+    time_start = time.monotonic()
+    await asyncio.gather(
+        *(
+            push(port, itertools.islice(bodies, i, None, args.connections), rejected)
+            for i in range(args.connections)
+        )
+    )
+    await done.wait()
+    elapsed = time.monotonic() - time_start
+    await server.stop()
+    await application.stop()
+    await application.shutdown()
+    return elapsed, rejected[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--handler-ms", type=float, default=5)
+    parser.add_argument("--rtt-ms", type=float, default=50)
+    parser.add_argument("--connections", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-pending", type=int, default=1000)
+    args = parser.parse_args()
+
+    updates = [make_update(i, args.chats) for i in range(1, args.updates + 1)]
+    for name, run in (("polling", run_polling), ("webhook", run_webhook)):
+        elapsed, rejected = asyncio.run(run(updates, args))
+        print(
+            f"{name:8} {args.updates / elapsed:8.0f} updates/s"
+            f"  {elapsed:6.2f}s  {rejected} pushes answered 503"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""add settings_updated_at column
+
+Revision ID: a6c3e9f2d8b4
+Revises: f4b9d2a7c1e5
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a6c3e9f2d8b4"
+down_revision = "f4b9d2a7c1e5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("chats", sa.Column("settings_updated_at", sa.Float(), nullable=True))
+    op.create_index(
+        "ix_chats_settings_updated_at", "chats", ["settings_updated_at"]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_chats_settings_updated_at", table_name="chats")
+    op.drop_column("chats", "settings_updated_at")
@@ -0,0 +1,31 @@
+"""add the insert counts of the shard workers
+
+Revision ID: b2d8f5a1c7e9
+Revises: a6c3e9f2d8b4
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b2d8f5a1c7e9"
+down_revision = "a6c3e9f2d8b4"
+branch_labels = None
+depends_on = None
+
+COLUMNS = ["chats_inserted", "users_inserted", "unique_users_inserted"]
+
+
+def upgrade():
+    for name in COLUMNS:
+        op.add_column(
+            "shard_workers",
+            sa.Column(name, sa.Integer(), nullable=False, server_default="0"),
+        )
+
+
+def downgrade():
+    for name in COLUMNS:
+        op.drop_column("shard_workers", name)
@@ -0,0 +1,39 @@
+"""create deadlines table
+
+Revision ID: b7e4c1d9a2f3
+Revises: 296da7f6d724
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b7e4c1d9a2f3"
+down_revision = "296da7f6d724"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "deadlines",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("chat_id", sa.BigInteger(), nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("kind", sa.Text(), nullable=False),
+        sa.Column("due_at", sa.Float(), nullable=False),
+        sa.Column("created_at", sa.Float(), nullable=False),
+        sa.Column("claimed_until", sa.Float(), nullable=True),
+        sa.Column("payload", sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_deadlines_due_at", "deadlines", ["due_at"])
+    op.create_index("ix_deadlines_chat_id_user_id", "deadlines", ["chat_id", "user_id"])
+
+
+def downgrade():
+    op.drop_index("ix_deadlines_chat_id_user_id", table_name="deadlines")
+    op.drop_index("ix_deadlines_due_at", table_name="deadlines")
+    op.drop_table("deadlines")
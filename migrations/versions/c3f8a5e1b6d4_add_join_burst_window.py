@@ -0,0 +1,27 @@
+"""add join_burst_window column
+
+Revision ID: c3f8a5e1b6d4
+Revises: b7e4c1d9a2f3
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c3f8a5e1b6d4"
+down_revision = "b7e4c1d9a2f3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "chats",
+        sa.Column("join_burst_window", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade():
+    op.drop_column("chats", "join_burst_window")
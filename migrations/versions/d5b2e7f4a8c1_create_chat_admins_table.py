@@ -0,0 +1,34 @@
+"""create chat_admins table
+
+Revision ID: d5b2e7f4a8c1
+Revises: c3f8a5e1b6d4
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d5b2e7f4a8c1"
+down_revision = "c3f8a5e1b6d4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "chat_admins",
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("chat_id", sa.BigInteger(), nullable=False),
+        sa.Column("is_admin", sa.Boolean(), nullable=False),
+        sa.Column("title", sa.Text(), nullable=True),
+        sa.Column("verified_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("user_id", "chat_id"),
+    )
+    op.create_index("ix_chat_admins_chat_id", "chat_admins", ["chat_id"])
+
+
+def downgrade():
+    op.drop_index("ix_chat_admins_chat_id", table_name="chat_admins")
+    op.drop_table("chat_admins")
@@ -0,0 +1,33 @@
+"""create persistence table
+
+Revision ID: e8a1f6c3b9d2
+Revises: d5b2e7f4a8c1
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e8a1f6c3b9d2"
+down_revision = "d5b2e7f4a8c1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "persistence",
+        sa.Column("kind", sa.Text(), nullable=False),
+        sa.Column("key", sa.Text(), nullable=False),
+        sa.Column("data", sa.JSON(), nullable=False),
+        sa.Column("updated_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("kind", "key"),
+    )
+    op.create_index("ix_persistence_updated_at", "persistence", ["updated_at"])
+
+
+def downgrade():
+    op.drop_index("ix_persistence_updated_at", table_name="persistence")
+    op.drop_table("persistence")
@@ -0,0 +1,148 @@
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, FrozenSet, Hashable, Iterable, Optional, Tuple
+
+from opentelemetry import metrics
+from opentelemetry.metrics import CallbackOptions, Counter, Observation
+
+from src import constants
+
+
+OTHER = "other"
+
+# per-chat event kinds
+JOIN = "join"
+WHOIS = "whois"
+NOTIFY = "notify"
+KICK = "kick"
+
+
+class BoundedCounter:
+    """
+    Counter which only passes the allowed attributes on, so a stray high-cardinality
+    attribute, like a chat or user ID, can't create a time series per value.
+    """
+
+    def __init__(self, counter: Counter, allowed_attributes: Iterable[str] = ()):
+        self._counter = counter
+        self.allowed_attributes: FrozenSet[str] = frozenset(allowed_attributes)
+
+    def add(self, amount: int, attributes: Optional[dict] = None) -> None:
+        if attributes:
+            attributes = {
+                key: value
+                for key, value in attributes.items()
+                if key in self.allowed_attributes
+            }
+        self._counter.add(amount, attributes or None)
+
+
+class TopK:
+    """
+    Approximate top `k` keys by recent count, with the Space-Saving algorithm over
+    `capacity` counters.
+
+    The top set is recomputed every `refresh_s`, when all the counts are also halved
+    so that it follows the recent traffic, and is stable in between.
+    """
+
+    def __init__(self, k: int, capacity: Optional[int] = None, refresh_s: float = 300):
+        self.k = k
+        self.capacity = capacity or 10 * k
+        self.refresh_s = refresh_s
+        self._counts: Dict[Hashable, float] = {}
+        self._top: FrozenSet[Hashable] = frozenset()
+        self._refreshed_at = time.monotonic()
+
+    def add(self, key: Hashable, amount: float = 1) -> None:
+        if key in self._counts:
+            self._counts[key] += amount
+        elif len(self._counts) < self.capacity:
+            self._counts[key] = amount
+        else:
+            # the new key takes over the smallest counter, overestimating its count
+            smallest = min(self._counts, key=self._counts.get)
+            self._counts[key] = self._counts.pop(smallest) + amount
+        if time.monotonic() - self._refreshed_at >= self.refresh_s:
+            self.refresh()
+
+    def refresh(self) -> None:
+        self._top = frozenset(
+            sorted(self._counts, key=self._counts.get, reverse=True)[: self.k]
+        )
+        self._counts = {key: count / 2 for key, count in self._counts.items()}
+        self._refreshed_at = time.monotonic()
+
+    @property
+    def top(self) -> FrozenSet[Hashable]:
+        return self._top
+
+    def label(self, key: Hashable) -> str:
+        return str(key) if key in self._top else OTHER
+
+
+class ChatEventCounters:
+    """
+    Per-chat counts of events, e.g. joins and kicks, for the top chats only; the
+    rest of the chats share the "other" series.
+
+    The counts are aggregated in memory and published by an observable counter,
+    so recording an event is a dict update. A chat which drops out of the top
+    keeps its series with the counts so far, up to `k` such series; beyond that
+    the counts of the oldest are moved to "other", so no exported total goes
+    down, which the backends would take for a counter reset.
+    """
+
+    def __init__(
+        self,
+        name: str = "chat_events",
+        k: int = constants.METRICS_TOP_CHATS,
+        refresh_s: float = constants.METRICS_TOP_CHATS_REFRESH_S,
+    ):
+        self._top = TopK(k, refresh_s=refresh_s)
+        # (event, chat label) -> count since start
+        self._counts: Dict[Tuple[str, str], int] = defaultdict(int)
+        # labels of the chats which dropped out of the top, oldest first
+        self._retired: "OrderedDict[str, None]" = OrderedDict()
+        meter = metrics.get_meter(f"{name}.meter", version="2.0.0")
+        meter.create_observable_counter(
+            f"{name}_counter", callbacks=[self._observe], unit="1"
+        )
+
+    def add(self, event: str, chat_id: int, amount: int = 1) -> None:
+        """
+        Count events in a chat.
+
+        Args:
+        event (str): One of JOIN, WHOIS, NOTIFY, KICK.
+        chat_id (int): The ID of the chat.
+        amount (int): The number of events.
+
+        Returns:
+        None
+        """
+        top_before = self._top.top
+        self._top.add(chat_id, amount)
+        if self._top.top is not top_before:
+            self._retire(top_before - self._top.top)
+        self._counts[(event, self._top.label(chat_id))] += amount
+
+    def _retire(self, chat_ids: Iterable[Hashable]) -> None:
+        for chat_id in chat_ids:
+            self._retired[str(chat_id)] = None
+        for chat_id in self._top.top:
+            self._retired.pop(str(chat_id), None)
+        while len(self._retired) > self._top.k:
+            label, _ = self._retired.popitem(last=False)
+            for event, chat in [key for key in self._counts if key[1] == label]:
+                self._counts[(event, OTHER)] += self._counts.pop((event, chat))
+
+    def get(self, event: str, label: str) -> int:
+        return self._counts.get((event, label), 0)
+
+    def _observe(self, options: CallbackOptions):
+        for (event, chat), count in list(self._counts.items()):
+            yield Observation(count, {"event": event, "chat": chat})
+
+
+chat_events = ChatEventCounters()
@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+from src.logging import tg_logger
+
+
+class BurstCoalescer:
+    """
+    Collect items arriving within a time window under the same key and hand them
+    over in one go, e.g. to greet all the users of a join raid with one message.
+
+    The first item of a key opens its window; the flush function given with that
+    item is called with all the items collected until the window closes.
+    """
+
+    def __init__(self):
+        self._items: Dict[Hashable, List[Any]] = {}
+        self._flushes: Dict[Hashable, Callable[[List[Any]], Awaitable[None]]] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def add(
+        self,
+        key: Hashable,
+        item: Any,
+        window_s: float,
+        flush: Callable[[List[Any]], Awaitable[None]],
+    ) -> None:
+        """
+        Add an item to the window of a key, opening the window if needed.
+
+        Args:
+        key (Hashable): The key items are grouped by, e.g. chat and message.
+        item (Any): The item to collect.
+        window_s (float): The window length in seconds, used if the window is opened.
+        flush (Callable[[List[Any]], Awaitable[None]]): Called with the collected items when the window closes, used if the window is opened.
+
+        Returns:
+        None
+        """
+        if key in self._items:
+            self._items[key].append(item)
+            return
+        self._items[key] = [item]
+        self._flushes[key] = flush
+        self._tasks[key] = asyncio.create_task(self._flush_later(key, window_s))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    async def _flush_later(self, key: Hashable, window_s: float) -> None:
+        await asyncio.sleep(window_s)
+        self._tasks.pop(key, None)
+        await self.flush(key)
+
+    async def flush(self, key: Hashable) -> None:
+        items = self._items.pop(key, None)
+        flush = self._flushes.pop(key, None)
+        if not items:
+            return
+        try:
+            await flush(items)
+        except Exception as e:
+            tg_logger.exception(
+                f"failed to flush {len(items)} items of {key}", exc_info=e
+            )
+
+    async def flush_all(self) -> None:
+        """
+        Close all the open windows right away, e.g. on shutdown.
+        """
+        tasks, self._tasks = self._tasks, {}
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        await asyncio.gather(*(self.flush(key) for key in list(self._items)))
@@ -0,0 +1,196 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    A size-bounded mapping which evicts the least recently used entry on overflow.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, V]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable) -> Optional[V]:
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return None
+        return self._data[key]
+
+    def set(self, key: Hashable, value: V) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        return self._data.pop(key, None)
+
+    def keys(self) -> List[Hashable]:
+        return list(self._data)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class TTLCache(Generic[V]):
+    """
+    An LRU cache whose entries also expire `ttl` seconds after they were set.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.ttl = ttl
+        self._cache: LRUCache[Tuple[float, V]] = LRUCache(maxsize)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._cache.pop(key)
+            return None
+        return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        self._cache.set(key, (time.monotonic() + self.ttl, value))
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        entry = self._cache.pop(key)
+        return entry[1] if entry is not None else None
+
+    def keys(self) -> List[Hashable]:
+        # expired entries included
+        return self._cache.keys()
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+class AsyncTTLCache(Generic[V]):
+    """
+    A TTLCache which loads missing values itself. Concurrent requests for a key
+    which is being loaded wait for that load instead of starting their own.
+
+    Failed loads are not cached.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self._cache: TTLCache[V] = TTLCache(maxsize, ttl)
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        # keys invalidated while being loaded, whose loaded value must not be cached
+        self._outdated: Set[Hashable] = set()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[V]]) -> V:
+        """
+        Get a value, loading it on a miss.
+
+        Args:
+        key (Hashable): The key of the value.
+        load (Callable[[], Awaitable[V]]): Loads the value; called only if it is neither cached nor being loaded.
+
+        Returns:
+        V: The value.
+        """
+        value = self._cache.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        future = self._loading.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shielded so that a cancelled waiter doesn't cancel the load for the others
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # the exception is raised here, waiters or not
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(key, None)
+            outdated = key in self._outdated
+            self._outdated.discard(key)
+
+        future.set_result(value)
+        if not outdated:
+            self._cache.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        if key in self._loading:
+            self._outdated.add(key)
+        self._cache.set(key, value)
+
+    def invalidate(self, key: Hashable) -> None:
+        self.invalidations += 1
+        if key in self._loading:
+            self._outdated.add(key)
+        self._cache.pop(key)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        """
+        Invalidate the keys matching `predicate`, e.g. all the (chat_id, user_id)
+        keys of a chat.
+        """
+        for key in [*self._cache.keys(), *self._loading]:
+            if predicate(key):
+                self.invalidate(key)
+
+    def clear(self) -> None:
+        self._outdated.update(self._loading)
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+        }
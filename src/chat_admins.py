@@ -0,0 +1,73 @@
+import time
+from typing import List, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from telegram import ChatMember
+
+from src.model import ChatAdmin, upsert
+
+
+ADMIN_STATUSES = (ChatMember.OWNER, ChatMember.ADMINISTRATOR)
+
+
+def is_admin_status(status: Optional[str]) -> bool:
+    return status in ADMIN_STATUSES
+
+
+async def set_admin_status(
+    sess: AsyncSession,
+    chat_id: int,
+    user_id: int,
+    is_admin: bool,
+    title: Optional[str] = None,
+) -> None:
+    """
+    Record whether a user is an admin of a chat, as just confirmed by Telegram.
+
+    Args:
+    sess (AsyncSession): The session to write in.
+    chat_id (int): The ID of the chat.
+    user_id (int): The ID of the user.
+    is_admin (bool): Whether the user is an admin or the owner of the chat.
+    title (Optional[str]): The title of the chat, the known one is kept if None.
+
+    Returns:
+    None
+    """
+    await upsert(
+        sess,
+        ChatAdmin(
+            chat_id=chat_id,
+            user_id=user_id,
+            is_admin=is_admin,
+            title=title,
+            verified_at=time.time(),
+        ),
+    )
+
+
+async def set_chat_title(sess: AsyncSession, chat_id: int, title: str) -> None:
+    await sess.execute(
+        update(ChatAdmin)
+        .where(ChatAdmin.chat_id == chat_id)
+        .values(title=title)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def remove_chat(sess: AsyncSession, chat_id: int) -> None:
+    await sess.execute(
+        delete(ChatAdmin)
+        .where(ChatAdmin.chat_id == chat_id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def get_user_entries(sess: AsyncSession, user_id: int) -> List[ChatAdmin]:
+    result = await sess.execute(
+        select(ChatAdmin)
+        .where(ChatAdmin.user_id == user_id)
+        .order_by(ChatAdmin.chat_id)
+    )
+    return result.scalars().all()
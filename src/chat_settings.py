@@ -0,0 +1,138 @@
+import time
+from dataclasses import dataclass, fields
+from typing import Dict, Optional
+
+from opentelemetry import metrics
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src import constants
+from src.cache import LRUCache
+from src.model import Chat, insert_if_missing, session_scope
+from src.stats import db_stats
+
+
+@dataclass(frozen=True)
+class ChatSettings:
+    """
+    Immutable snapshot of a Chat row.
+    """
+
+    id: int
+    on_new_chat_member_message: str
+    on_known_new_chat_member_message: str
+    on_introduce_message: str
+    on_kick_message: str
+    notify_message: str
+    kick_timeout: int
+    notify_timeout: int
+    whois_length: int
+    on_introduce_message_update: str
+    join_burst_window: int
+
+    @classmethod
+    def from_chat(cls, chat: Chat) -> "ChatSettings":
+        return cls(**{field.name: getattr(chat, field.name) for field in fields(cls)})
+
+
+class ChatSettingsCache:
+    """
+    Read-through LRU cache of chat settings.
+
+    The settings only change through the admin menu, which calls `invalidate`
+    after every write. When sharded, the admin's private chat may be handled by
+    another worker than the group, so each worker also calls `poll_changes`
+    periodically to drop the settings changed elsewhere.
+    """
+
+    def __init__(self, maxsize: int):
+        self._cache: LRUCache[ChatSettings] = LRUCache(maxsize)
+        # bumped on invalidation so that a load racing with a write is not cached
+        self._generations: Dict[int, int] = {}
+        self._polled_at = time.time()
+        meter = metrics.get_meter("chat_settings_cache.meter", version="2.0.0")
+        self._hit_counter = meter.create_counter("chat_settings_cache_hit", unit="1")
+        self._miss_counter = meter.create_counter("chat_settings_cache_miss", unit="1")
+
+    async def get(
+        self, chat_id: int, create: bool = False, sess: Optional[AsyncSession] = None
+    ) -> Optional[ChatSettings]:
+        """
+        Get the settings of a chat, loading them from the DB on a miss.
+
+        Args:
+        chat_id (int): The ID of the chat.
+        create (bool): Whether to create the chat with default settings if it is not in the DB.
+        sess (Optional[AsyncSession]): The session to load the chat in, a new one is used if not given.
+
+        Returns:
+        Optional[ChatSettings]: The chat settings, or None if the chat is unknown and create is False.
+        """
+        settings = self._cache.get(chat_id)
+        if settings is not None:
+            self._hit_counter.add(1)
+            return settings
+
+        self._miss_counter.add(1)
+        generation = self._generations.get(chat_id, 0)
+        if sess is None:
+            async with session_scope() as sess:
+                settings = await self._load(sess, chat_id, create)
+        else:
+            settings = await self._load(sess, chat_id, create)
+
+        if settings is not None and self._generations.get(chat_id, 0) == generation:
+            self._cache.set(chat_id, settings)
+        return settings
+
+    async def _load(
+        self, sess: AsyncSession, chat_id: int, create: bool
+    ) -> Optional[ChatSettings]:
+        result = await sess.execute(select(Chat).where(Chat.id == chat_id))
+        chat = result.scalars().first()
+        if chat is None and create:
+            new_chat = Chat.get_new_chat(chat_id)
+            # another update may have created the chat meanwhile
+            if await insert_if_missing(sess, new_chat):
+                db_stats.chat_inserted()
+                return ChatSettings.from_chat(new_chat)
+            result = await sess.execute(select(Chat).where(Chat.id == chat_id))
+            chat = result.scalars().first()
+        if chat is None:
+            return None
+        return ChatSettings.from_chat(chat)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def invalidate(self, chat_id: int) -> None:
+        self._generations[chat_id] = self._generations.get(chat_id, 0) + 1
+        self._cache.pop(chat_id)
+
+    async def poll_changes(self) -> int:
+        """
+        Invalidate the chats whose settings were changed since the last poll,
+        by this process or another one.
+
+        Returns:
+        int: The number of chats invalidated.
+        """
+        # the clocks of the workers may be a bit apart, a chat changed around the
+        # last poll is invalidated twice rather than missed
+        since = self._polled_at - constants.CHAT_SETTINGS_POLL_MARGIN_S
+        self._polled_at = time.time()
+        async with session_scope() as sess:
+            result = await sess.execute(
+                select(Chat.id).where(Chat.settings_updated_at >= since)
+            )
+            chat_ids = result.scalars().all()
+        for chat_id in chat_ids:
+            self.invalidate(chat_id)
+        return len(chat_ids)
+
+    def clear(self) -> None:
+        self._generations.clear()
+        self._cache.clear()
+
+
+chat_settings_cache = ChatSettingsCache(constants.CHAT_SETTINGS_CACHE_SIZE)
@@ -6,6 +6,7 @@ default_kick_timeout_m = 1440  # 24h in minutes
 default_notify_timeout_m = 1380  # 23h in minutes
 default_delete_message_timeout_m = 60  # 1h in minutes
 default_whois_length = 60
+default_join_burst_window_s = 0  # disabled
 
 
 # ACTIONS
@@ -27,10 +28,118 @@ class Actions(IntEnum):
     get_current_intro_settings = auto()
     set_whois_length = auto()
     set_on_introduce_message_update = auto()
+    set_join_burst_window = auto()
 
 
 DEBUG = os.environ.get("DEBUG", "True") in ["True"]
 TEAM_TELEGRAM_IDS = json.loads(os.environ.get("TEAM_TELEGRAM_IDS", "[]"))
+CHAT_SETTINGS_CACHE_SIZE = int(os.environ.get("CHAT_SETTINGS_CACHE_SIZE", "10000"))
+# how far back each poll for the settings changed by other workers looks, on top
+# of the time since the previous poll
+CHAT_SETTINGS_POLL_MARGIN_S = float(os.environ.get("CHAT_SETTINGS_POLL_MARGIN_S", "10"))
+USER_PROFILE_CACHE_SIZE = int(os.environ.get("USER_PROFILE_CACHE_SIZE", "50000"))
+USER_PROFILE_CACHE_TTL_S = int(os.environ.get("USER_PROFILE_CACHE_TTL_S", "172800"))
+
+DEADLINE_SWEEP_INTERVAL_S = float(os.environ.get("DEADLINE_SWEEP_INTERVAL_S", "5"))
+DEADLINE_BATCH_SIZE = int(os.environ.get("DEADLINE_BATCH_SIZE", "200"))
+DEADLINE_CONCURRENCY = int(os.environ.get("DEADLINE_CONCURRENCY", "20"))
+DEADLINE_LEASE_S = float(os.environ.get("DEADLINE_LEASE_S", "300"))
+DELETE_MESSAGE_BUCKET_S = float(os.environ.get("DELETE_MESSAGE_BUCKET_S", "60"))
+# full recount of the chats and users, which are otherwise counted incrementally
+DB_STATS_RECONCILE_INTERVAL_S = float(
+    os.environ.get("DB_STATS_RECONCILE_INTERVAL_S", "86400")
+)
+# how long an entry of the chat admins index is trusted without asking Telegram
+CHAT_ADMINS_VERIFY_TTL_S = float(os.environ.get("CHAT_ADMINS_VERIFY_TTL_S", "86400"))
+# bounds of the Telegram lookups made to build the /start chats list
+ADMIN_LOOKUP_CONCURRENCY = int(os.environ.get("ADMIN_LOOKUP_CONCURRENCY", "10"))
+ADMIN_LOOKUP_TIMEOUT_S = float(os.environ.get("ADMIN_LOOKUP_TIMEOUT_S", "5"))
+# Bot API lookups made by the admin menu; kept up to date by chat_member and new_chat_title updates
+CHAT_TITLE_CACHE_SIZE = int(os.environ.get("CHAT_TITLE_CACHE_SIZE", "10000"))
+CHAT_TITLE_CACHE_TTL_S = float(os.environ.get("CHAT_TITLE_CACHE_TTL_S", "3600"))
+ADMIN_STATUS_CACHE_SIZE = int(os.environ.get("ADMIN_STATUS_CACHE_SIZE", "10000"))
+ADMIN_STATUS_CACHE_TTL_S = float(os.environ.get("ADMIN_STATUS_CACHE_TTL_S", "300"))
+# user_data and chat_data entries not used for this long are dropped
+PERSISTENCE_TTL_S = float(os.environ.get("PERSISTENCE_TTL_S", "604800"))
+PERSISTENCE_EVICT_INTERVAL_S = float(
+    os.environ.get("PERSISTENCE_EVICT_INTERVAL_S", "3600")
+)
+# how far back each poll for the entries written by other workers looks, on top
+# of the time since the previous poll
+PERSISTENCE_POLL_MARGIN_S = float(os.environ.get("PERSISTENCE_POLL_MARGIN_S", "10"))
+# job store changes made within this long of each other are written in one transaction
+JOBSTORE_BATCH_LINGER_S = float(os.environ.get("JOBSTORE_BATCH_LINGER_S", "0.05"))
+# tg_logger: records below LOG_LEVEL are dropped right away, LOG_SAMPLE_RATES is e.g. "DEBUG=0.01,INFO=0.5"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# forwarding to the error chat: one record per call site per window, then at most this many per minute
+LOG_TELEGRAM_DEDUP_WINDOW_S = float(
+    os.environ.get("LOG_TELEGRAM_DEDUP_WINDOW_S", "300")
+)
+LOG_TELEGRAM_RATE_PER_MIN = float(os.environ.get("LOG_TELEGRAM_RATE_PER_MIN", "10"))
+LOG_TELEGRAM_RATE_BURST = int(os.environ.get("LOG_TELEGRAM_RATE_BURST", "5"))
+# share of the updates traced, the spans they cause are sampled along with them
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))
+# per-chat metrics are broken down for this many of the busiest chats, the rest are "other"
+METRICS_TOP_CHATS = int(os.environ.get("METRICS_TOP_CHATS", "20"))
+METRICS_TOP_CHATS_REFRESH_S = float(
+    os.environ.get("METRICS_TOP_CHATS_REFRESH_S", "300")
+)
+# local HTTP server with /healthz and /metrics, a port of 0 disables it
+HEALTH_HOST = os.environ.get("HEALTH_HOST", "127.0.0.1")
+HEALTH_PORT = int(os.environ.get("HEALTH_PORT", "8080"))
+HEALTH_SAMPLE_INTERVAL_S = float(os.environ.get("HEALTH_SAMPLE_INTERVAL_S", "5"))
+# /healthz fails when the event loop gets this late
+HEALTH_MAX_LOOP_LAG_S = float(os.environ.get("HEALTH_MAX_LOOP_LAG_S", "2"))
+# updates of different chats handled concurrently, see ChatOrderedUpdateProcessor
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "32"))
+UPDATE_MAX_PENDING = int(os.environ.get("UPDATE_MAX_PENDING", "10000"))
+# webhook mode, used instead of polling when WEBHOOK_URL is set, see src/webhook.py
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+# connections Telegram opens to the webhook at once
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+# updates queued or handled at once before the webhook answers 503
+WEBHOOK_MAX_PENDING = int(os.environ.get("WEBHOOK_MAX_PENDING", "1000"))
+WEBHOOK_IDLE_TIMEOUT_S = float(os.environ.get("WEBHOOK_IDLE_TIMEOUT_S", "60"))
+# sharded deployment: "" for a single process, or "worker" / "router", see src/sharding.py
+SHARD_ROLE = os.environ.get("SHARD_ROLE", "")
+# defaults to host name and pid
+SHARD_WORKER_ID = os.environ.get("SHARD_WORKER_ID", "")
+# the webhook of this worker as the router reaches it, e.g. http://worker-1:8443/telegram
+SHARD_WORKER_URL = os.environ.get("SHARD_WORKER_URL", "")
+SHARD_HEARTBEAT_S = float(os.environ.get("SHARD_HEARTBEAT_S", "5"))
+# a worker not heartbeating for this long is dead and its chats move to the others
+SHARD_WORKER_TTL_S = float(os.environ.get("SHARD_WORKER_TTL_S", "20"))
+# chats are hashed into this many slots, must be the same for all the processes
+SHARD_SLOTS = int(os.environ.get("SHARD_SLOTS", "1024"))
+SHARD_VNODES = int(os.environ.get("SHARD_VNODES", "64"))
+# replay of the deadlines overdue on startup, see StartupReconciler
+# Bot API calls per second it may spend, the rest of OUTBOUND_GLOBAL_RATE is left
+# to the live traffic
+RECONCILE_API_BUDGET_PER_S = float(os.environ.get("RECONCILE_API_BUDGET_PER_S", "5"))
+# the updates queued while the bot was down are handled first, e.g. the #whois of
+# the users to be kicked
+RECONCILE_DELAY_S = float(os.environ.get("RECONCILE_DELAY_S", "15"))
+RECONCILE_PROGRESS_INTERVAL_S = float(
+    os.environ.get("RECONCILE_PROGRESS_INTERVAL_S", "30")
+)
+# max number of joined users greeted concurrently
+JOIN_FANOUT_CONCURRENCY = int(os.environ.get("JOIN_FANOUT_CONCURRENCY", "10"))
+# max number of users mentioned in one merged join burst message
+MAX_MENTIONS_PER_MESSAGE = int(os.environ.get("MAX_MENTIONS_PER_MESSAGE", "50"))
+
+# Telegram limits: ~30 messages per second overall, 20 per minute in a group, 1 per second in a private chat
+OUTBOUND_GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", "25"))
+OUTBOUND_GROUP_RATE_PER_MIN = float(os.environ.get("OUTBOUND_GROUP_RATE_PER_MIN", "20"))
+OUTBOUND_PRIVATE_RATE = float(os.environ.get("OUTBOUND_PRIVATE_RATE", "1"))
+OUTBOUND_WORKERS = int(os.environ.get("OUTBOUND_WORKERS", "8"))
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", "3"))
+OUTBOUND_MAX_TRACKED_CHATS = 10000
 
 
 def get_uri():
@@ -0,0 +1,379 @@
+import asyncio
+import math
+import time
+from collections import defaultdict
+from typing import Callable, Collection, Dict, List, Optional, Set
+
+from sqlalchemy import case, delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from telegram.ext import Application, Job
+
+from src import constants
+from src.logging import tg_logger
+from src.model import Deadline, session_scope
+from src.sharding import slot_expression
+from src.tracing import TRACEPARENT, current_traceparent, links_from, tracer
+
+
+# deadline kinds
+KICK = "kick"
+NOTIFY = "notify"
+DELETE_MESSAGE = "delete_message"
+
+
+def new_deadline(
+    chat_id: int,
+    user_id: int,
+    kind: str,
+    delay_s: float,
+    payload: Optional[dict] = None,
+    created_at: Optional[float] = None,
+    bucket_s: float = 0,
+) -> Deadline:
+    """
+    Build a deadline to be added to a session.
+
+    Args:
+    chat_id (int): The ID of the chat.
+    user_id (int): The ID of the user.
+    kind (str): One of KICK, NOTIFY, DELETE_MESSAGE.
+    delay_s (float): The number of seconds from created_at after which the deadline is due.
+    payload (Optional[dict]): Extra data passed to the callback, e.g. message_id.
+    created_at (Optional[float]): Unix timestamp the delay is counted from, defaults to now.
+    bucket_s (float): If set, the due time is rounded up to a multiple of it, so that deadlines
+        created close to each other come due together and can be processed in one batch.
+
+    Returns:
+    Deadline: The new, not yet persisted, deadline.
+    """
+    if created_at is None:
+        created_at = time.time()
+    traceparent = current_traceparent()
+    if traceparent:
+        # the span of the callback is linked to the one scheduling it
+        payload = {**(payload or {}), TRACEPARENT: traceparent}
+    due_at = created_at + delay_s
+    if bucket_s:
+        due_at = math.ceil(due_at / bucket_s) * bucket_s
+    return Deadline(
+        chat_id=chat_id,
+        user_id=user_id,
+        kind=kind,
+        due_at=due_at,
+        created_at=created_at,
+        payload=payload,
+    )
+
+
+async def schedule_deadline(
+    chat_id: int,
+    user_id: int,
+    kind: str,
+    delay_s: float,
+    payload: Optional[dict] = None,
+    bucket_s: float = 0,
+) -> None:
+    async with session_scope() as sess:
+        sess.add(
+            new_deadline(chat_id, user_id, kind, delay_s, payload, bucket_s=bucket_s)
+        )
+
+
+async def cancel_user_deadlines(chat_id: int, user_id: int) -> List:
+    """
+    Delete all the pending deadlines of a user in a chat.
+
+    Args:
+    chat_id (int): The ID of the chat.
+    user_id (int): The ID of the user.
+
+    Returns:
+    List: The deleted rows, with kind and payload columns.
+    """
+    async with session_scope() as sess:
+        return await cancel_users_deadlines(sess, chat_id, [user_id])
+
+
+async def cancel_users_deadlines(
+    sess: AsyncSession, chat_id: int, user_ids: List[int]
+) -> List:
+    """
+    Delete all the pending deadlines of several users in a chat with one statement.
+
+    Args:
+    sess (AsyncSession): The session to execute the statement in.
+    chat_id (int): The ID of the chat.
+    user_ids (List[int]): The IDs of the users.
+
+    Returns:
+    List: The deleted rows, with user_id, kind and payload columns.
+    """
+    result = await sess.execute(
+        delete(Deadline)
+        .where(Deadline.chat_id == chat_id, Deadline.user_id.in_(user_ids))
+        .returning(Deadline.user_id, Deadline.kind, Deadline.payload)
+        .execution_options(synchronize_session=False)
+    )
+    return result.all()
+
+
+async def cancel_chat_deadlines(chat_id: int, kind: str) -> None:
+    async with session_scope() as sess:
+        await sess.execute(
+            delete(Deadline)
+            .where(Deadline.chat_id == chat_id, Deadline.kind == kind)
+            .execution_options(synchronize_session=False)
+        )
+
+
+async def reschedule_chat_deadlines(chat_id: int, kind: str, timeout_s: float) -> None:
+    """
+    Move all the deadlines of a kind in a chat to `timeout_s` after their creation,
+    or to now if that is already in the past.
+
+    Args:
+    chat_id (int): The ID of the chat.
+    kind (str): One of KICK, NOTIFY.
+    timeout_s (float): The new timeout in seconds.
+
+    Returns:
+    None
+    """
+    now = time.time()
+    new_due_at = Deadline.created_at + timeout_s
+    async with session_scope() as sess:
+        await sess.execute(
+            update(Deadline)
+            .where(Deadline.chat_id == chat_id, Deadline.kind == kind)
+            .values(due_at=case((new_due_at < now, now), else_=new_due_at))
+            .execution_options(synchronize_session=False)
+        )
+
+
+# the columns of the claimed rows passed to the callbacks
+CLAIMED_COLUMNS = (
+    Deadline.id,
+    Deadline.chat_id,
+    Deadline.user_id,
+    Deadline.kind,
+    Deadline.created_at,
+    Deadline.payload,
+)
+
+
+class DeadlineSweeper:
+    """
+    A single background task which claims due deadlines in batches and runs their
+    callbacks concurrently.
+
+    Callbacks are regular job callbacks: they get a CallbackContext whose `job.data`
+    holds chat_id, user_id, creation_time and the deadline payload. Batch callbacks
+    get the application, a chat_id and all the claimed deadlines of their kind in
+    that chat, e.g. to delete many messages with one API call.
+
+    Each deadline is deleted right before its callback runs, so one cancelled after
+    the claim, e.g. by a #whois, doesn't run; the lease only matters for the
+    deadlines of a sweeper which died before getting to them.
+
+    With `owned_slots` set, only the deadlines of the chats in those slots are
+    claimed, see ShardCoordinator.
+    """
+
+    def __init__(
+        self,
+        callbacks: Dict[str, Callable],
+        batch_callbacks: Optional[Dict[str, Callable]] = None,
+        batch_size: int = constants.DEADLINE_BATCH_SIZE,
+        interval_s: float = constants.DEADLINE_SWEEP_INTERVAL_S,
+        concurrency: int = constants.DEADLINE_CONCURRENCY,
+        lease_s: float = constants.DEADLINE_LEASE_S,
+        owned_slots: Optional[Callable[[], Collection[int]]] = None,
+    ):
+        self.callbacks = callbacks
+        self.batch_callbacks = batch_callbacks or {}
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self.concurrency = concurrency
+        self.lease_s = lease_s
+        self.owned_slots = owned_slots
+        self._take_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def claimable(self, now: float):
+        """
+        The query selecting the IDs of the due, unclaimed deadlines of the owned slots.
+
+        Args:
+        now (float): The current unix timestamp.
+
+        Returns:
+        Optional[Select]: The query, None if no slot is owned.
+        """
+        claimable = select(Deadline.id).where(
+            Deadline.due_at <= now,
+            or_(Deadline.claimed_until.is_(None), Deadline.claimed_until < now),
+        )
+        if self.owned_slots is not None:
+            slots = self.owned_slots()
+            if not slots:
+                return None
+            claimable = claimable.where(
+                slot_expression(Deadline.chat_id).in_(sorted(slots))
+            )
+        return claimable
+
+    async def claim(self) -> List:
+        """
+        Mark a batch of due, unclaimed deadlines as claimed for the lease duration.
+
+        Returns:
+        List: The claimed rows.
+        """
+        now = time.time()
+        claimable = self.claimable(now)
+        if claimable is None:
+            return []
+        claimable = (
+            claimable.order_by(Deadline.due_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with session_scope() as sess:
+            result = await sess.execute(
+                update(Deadline)
+                .where(Deadline.id.in_(claimable))
+                .values(claimed_until=now + self.lease_s)
+                .returning(*CLAIMED_COLUMNS)
+                .execution_options(synchronize_session=False)
+            )
+            return result.all()
+
+    async def take(self, ids: List[int]) -> Set[int]:
+        """
+        Delete claimed deadlines right before they run. The ones already deleted,
+        e.g. cancelled by a #whois after the claim, are not returned and must not run.
+
+        Args:
+        ids (List[int]): The IDs of the claimed deadlines.
+
+        Returns:
+        Set[int]: The IDs of the deadlines which are still to run.
+        """
+        # one at a time: the statements are short, and the concurrent callbacks
+        # don't hold several connections for them
+        async with self._take_lock, session_scope() as sess:
+            result = await sess.execute(
+                delete(Deadline)
+                .where(Deadline.id.in_(ids))
+                .returning(Deadline.id)
+                .execution_options(synchronize_session=False)
+            )
+            return set(result.scalars().all())
+
+    async def dispatch(self, application: Application, deadline) -> None:
+        if not await self.take([deadline.id]):
+            return
+        callback = self.callbacks.get(deadline.kind)
+        if callback is None:
+            tg_logger.warning(f"no callback for deadline kind {deadline.kind}")
+            return
+        payload = dict(deadline.payload or {})
+        traceparent = payload.pop(TRACEPARENT, None)
+        data = {
+            "chat_id": deadline.chat_id,
+            "user_id": deadline.user_id,
+            "creation_time": deadline.created_at,
+            **payload,
+        }
+        job = Job(
+            callback,
+            data=data,
+            name=callback.__name__,
+            chat_id=deadline.chat_id,
+            user_id=deadline.user_id,
+        )
+        context = application.context_types.context.from_job(job, application)
+        with tracer.start_as_current_span(
+            f"deadline {deadline.kind}", links=links_from([traceparent])
+        ):
+            try:
+                await callback(context)
+            except Exception as e:
+                tg_logger.exception(
+                    f"deadline {deadline.kind} failed for {data}", exc_info=e
+                )
+
+    async def dispatch_batch(
+        self, application: Application, kind: str, chat_id: int, deadlines: List
+    ) -> None:
+        taken = await self.take([deadline.id for deadline in deadlines])
+        deadlines = [deadline for deadline in deadlines if deadline.id in taken]
+        if not deadlines:
+            return
+        links = links_from(
+            (deadline.payload or {}).get(TRACEPARENT) for deadline in deadlines
+        )
+        try:
+            with tracer.start_as_current_span(f"deadline {kind}", links=links):
+                await self.batch_callbacks[kind](application, chat_id, deadlines)
+        except Exception as e:
+            tg_logger.exception(
+                f"deadline batch {kind} failed for chat {chat_id}", exc_info=e
+            )
+
+    async def sweep(self, application: Application) -> int:
+        """
+        Claim one batch of due deadlines and run them, each deleted right before.
+
+        Args:
+        application (Application): The application the callbacks are run for.
+
+        Returns:
+        int: The number of deadlines processed.
+        """
+        deadlines = await self.claim()
+        if not deadlines:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(coro):
+            async with semaphore:
+                await coro
+
+        batches = defaultdict(list)
+        coros = []
+        for deadline in deadlines:
+            if deadline.kind in self.batch_callbacks:
+                batches[(deadline.kind, deadline.chat_id)].append(deadline)
+            else:
+                coros.append(self.dispatch(application, deadline))
+        for (kind, chat_id), batch in batches.items():
+            coros.append(self.dispatch_batch(application, kind, chat_id, batch))
+
+        await asyncio.gather(*(bounded(coro) for coro in coros))
+        return len(deadlines)
+
+    async def run(self, application: Application) -> None:
+        while True:
+            try:
+                processed = await self.sweep(application)
+            except Exception as e:
+                tg_logger.exception("deadline sweep failed", exc_info=e)
+                processed = 0
+            # keep draining without a pause while there is a backlog
+            if processed < self.batch_size:
+                await asyncio.sleep(self.interval_s)
+
+    def start(self, application: Application) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(application))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
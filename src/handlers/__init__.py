@@ -4,6 +4,7 @@ Module with all the telegram handlers.
 
 from .help_handler import help_handler
 from .error_handler import error_handler
+from .user_profiles_handler import user_profiles_handler
 
 from .admin import *
 from .debug import *
@@ -8,7 +8,15 @@ from typing import Callable, Optional
 from sqlalchemy import select
 
 from src import constants
-from src.model import Chat, session_scope
+from src.model import Chat, session_scope, upsert_chat
+from src.job_registry import job_registry
+from src.chat_settings import chat_settings_cache
+from src.deadlines import (
+    KICK,
+    NOTIFY,
+    cancel_chat_deadlines,
+    reschedule_chat_deadlines,
+)
 from src.texts import _
 
 from src.handlers.group.group_handler import on_kick_timeout, on_notify_timeout
@@ -28,7 +36,7 @@ async def _job_rescheduling_helper(
     job_func: Callable, timeout: int, context: ContextTypes.DEFAULT_TYPE, chat_id: int
 ) -> None:
     """
-    This function helps in rescheduling a job in the Telegram bot's job queue.
+    This function helps in rescheduling the pending kick or notify deadlines of a chat after its timeout has changed.
 
     Args:
     job_func (Callable): The function that is to be scheduled as a job. This is the callback function that is executed when the job runs.
@@ -39,41 +47,43 @@ async def _job_rescheduling_helper(
     Returns:
     None: This function does not return anything.
     """
-    # Iterating through all the jobs currently in the job queue
-    for job in context.job_queue.jobs():
-        # If the job's name matches the name of the job function provided
-        if job.name == job_func.__name__ and chat_id == job.data.get('chat_id'):
-            # Extracting the job context and calculating the new timeout
-            job_data = job.data
-            job_creation_time = datetime.fromtimestamp(job_data.get("creation_time"))
-            new_timeout = job_creation_time + timedelta(seconds=timeout * 60)
-
-            # If the new timeout is in the past, set it to now
-            if new_timeout < datetime.now():
-                new_timeout = datetime.now()
-
-            # Schedule the current job for removal
-            job.schedule_removal()
-
-            # If the job is a notification timeout, perform additional checks
-            if job_func == on_notify_timeout:
-                # Querying the database to get the chat's kick timeout setting
-                async with session_scope() as sess:
-                    result = await sess.execute(select(Chat).filter(Chat.id == chat_id))
-                    chat: Optional[Chat] = result.scalars().first()
-                    kick_timeout = chat.kick_timeout if chat else 0
-
-                # If the new timeout is greater than the kick timeout, skip to the next job
-                if (
-                    job_creation_time + timedelta(seconds=kick_timeout * 60)
-                ) > new_timeout:
-                    continue
-
-            # Update the job context with the new timeout
-            job_data["timeout"] = new_timeout
-
-            # Schedule the new job with the updated context and timeout
-            job = context.job_queue.run_once(job_func, new_timeout, data=job_data)
+    if job_func == on_kick_timeout:
+        kind = KICK
+        cancel = timeout == 0
+    else:
+        kind = NOTIFY
+        chat = await chat_settings_cache.get(chat_id)
+        kick_timeout = chat.kick_timeout if chat else 0
+        # kick and notify deadlines of a user share their creation time,
+        # so a notification later than the kick is never sent
+        cancel = timeout == 0 or 0 < kick_timeout <= timeout
+    if cancel:
+        await cancel_chat_deadlines(chat_id, kind)
+    else:
+        await reschedule_chat_deadlines(chat_id, kind, timeout * 60)
+
+    # The jobs scheduled before the deadlines table was introduced follow the same rules
+    for job in job_registry.get_chat_jobs(chat_id, job_func.__name__):
+        # Schedule the current job for removal
+        job_registry.remove(job)
+        if cancel:
+            continue
+
+        # Extracting the job context and calculating the new timeout
+        job_data = job.data
+        job_creation_time = datetime.fromtimestamp(job_data.get("creation_time"))
+        new_timeout = job_creation_time + timedelta(seconds=timeout * 60)
+
+        # If the new timeout is in the past, set it to now
+        if new_timeout < datetime.now():
+            new_timeout = datetime.now()
+
+        # Update the job context with the new timeout
+        job_data["timeout"] = new_timeout
+
+        # Schedule the new job with the updated context and timeout
+        job = context.job_queue.run_once(job_func, new_timeout, data=job_data)
+        job_registry.add(job)
 
 
 async def _get_current_settings_helper(
@@ -131,7 +141,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.message.reply_text(_("msg__no_chats_available"))
             return
         reply_markup = InlineKeyboardMarkup(
-            await create_chats_list_keyboard(user_chats, context, user_id)
+            await create_chats_list_keyboard(user_chats)
         )
         await context.bot.edit_message_text(
             _("msg__start_command"),
@@ -216,6 +226,12 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     "action": constants.Actions.set_on_introduce_message_update,
                 }
             ],
+            [
+                {
+                    "text": _("btn__change_join_burst_window"),
+                    "action": constants.Actions.set_join_burst_window,
+                }
+            ],
             [{"text": _("btn__back"), "action": constants.Actions.select_chat}],
         ]
         reply_markup = new_keyboard_layout(button_configs, selected_chat_id)
@@ -259,7 +275,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         user_id = query.message.chat_id
         user_chats = await get_chats_list(user_id, context)
         reply_markup = InlineKeyboardMarkup(
-            await create_chats_list_keyboard(user_chats, context, user_id)
+            await create_chats_list_keyboard(user_chats)
         )
         await context.bot.edit_message_text(
             _("msg__start_command"),
@@ -339,6 +355,15 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data["chat_id"] = data["chat_id"]
         context.user_data["action"] = data["action"]
 
+    elif data["action"] == constants.Actions.set_join_burst_window:
+        await context.bot.edit_message_text(
+            text=_("msg__set_new_join_burst_window"),
+            chat_id=query.message.chat_id,
+            message_id=query.message.message_id,
+        )
+        context.user_data["chat_id"] = data["chat_id"]
+        context.user_data["action"] = data["action"]
+
     elif data["action"] == constants.Actions.set_on_kick_message:
         await context.bot.edit_message_text(
             text=_("msg__set_new_kick_message"),
@@ -452,7 +477,8 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 return
             async with session_scope() as sess:
                 chat = Chat(id=chat_id, kick_timeout=timeout)
-                await sess.merge(chat)
+                await upsert_chat(sess, chat)
+            chat_settings_cache.invalidate(chat_id)
             context.user_data["action"] = None
             await _job_rescheduling_helper(on_kick_timeout, timeout, context, chat_id)
 
@@ -477,11 +503,14 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 timeout = int(message)
                 assert timeout >= 0
             except:
-                await update.effective_message.reply_text(_("msg__failed_kick_response"))
+                await update.effective_message.reply_text(
+                    _("msg__failed_kick_response")
+                )
                 return
             async with session_scope() as sess:
                 chat = Chat(id=chat_id, notify_timeout=timeout)
-                await sess.merge(chat)
+                await upsert_chat(sess, chat)
+            chat_settings_cache.invalidate(chat_id)
             context.user_data["action"] = None
             await _job_rescheduling_helper(on_notify_timeout, timeout, context, chat_id)
 
@@ -506,6 +535,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             constants.Actions.set_on_kick_message,
             constants.Actions.set_whois_length,
             constants.Actions.set_on_introduce_message_update,
+            constants.Actions.set_join_burst_window,
         ]:
             message = update.effective_message.text_markdown
             reply_message = _("msg__set_new_message")
@@ -530,20 +560,36 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                         chat = Chat(id=chat_id, whois_length=whois_length)
                         reply_message = _("msg__sucess_whois_length")
                     except:
-                        await update.effective_message.reply_text(_("msg__failed_whois_response"))
+                        await update.effective_message.reply_text(
+                            _("msg__failed_whois_response")
+                        )
+                        return
+                if action == constants.Actions.set_join_burst_window:
+                    try:
+                        join_burst_window = int(message)
+                        assert join_burst_window >= 0
+                        chat = Chat(id=chat_id, join_burst_window=join_burst_window)
+                        reply_message = _("msg__sucess_join_burst_window")
+                    except:
+                        await update.effective_message.reply_text(
+                            _("msg__failed_join_burst_window_response")
+                        )
                         return
 
                 if action == constants.Actions.set_on_introduce_message_update:
                     if (
                         "#update"
-                        not in update.effective_message.parse_entities(types=["hashtag"]).values()
+                        not in update.effective_message.parse_entities(
+                            types=["hashtag"]
+                        ).values()
                     ):
                         await update.effective_message.reply_text(
                             _("msg__need_hashtag_update_response")
                         )
                         return
                     chat = Chat(id=chat_id, on_introduce_message_update=message)
-                await sess.merge(chat)
+                await upsert_chat(sess, chat)
+            chat_settings_cache.invalidate(chat_id)
 
             if action in [
                 constants.Actions.set_on_kick_message,
@@ -571,4 +617,6 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             context.user_data["action"] = None
 
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.effective_message.reply_text(reply_message, reply_markup=reply_markup)
+            await update.effective_message.reply_text(
+                reply_message, reply_markup=reply_markup
+            )
@@ -33,9 +33,7 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
 
     # Create an inline keyboard with the list of available chats
-    reply_markup = InlineKeyboardMarkup(
-        await create_chats_list_keyboard(user_chats, context, user_id)
-    )
+    reply_markup = InlineKeyboardMarkup(await create_chats_list_keyboard(user_chats))
 
     # Send a message to the user with the inline keyboard
     await update.message.reply_text(_("msg__start_command"), reply_markup=reply_markup)
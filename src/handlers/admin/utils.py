@@ -1,3 +1,4 @@
+import asyncio
 import json
 import time
 from typing import Iterator, Dict, List
@@ -8,13 +9,24 @@ from telegram.ext import CallbackContext
 from sqlalchemy import select
 
 from src.logging import tg_logger
-from src.model import User, session_scope
+from src.model import ChatAdmin, User, session_scope
+from src.chat_admins import get_user_entries, set_admin_status
+from src.telegram_cache import admin_status_cache, chat_title_cache
 from src import constants
+from src.handlers.utils import setup_histogram
+
+
+get_chats_list_histogram = setup_histogram(
+    "get_chats_list.meter", "get_chats_list_latency"
+)
 
 
 async def get_chat_name(bot, chat_id):
-    chat = await bot.get_chat(chat_id)
-    return chat.title or str(chat_id)
+    async def load():
+        chat = await bot.get_chat(chat_id)
+        return chat.title or str(chat_id)
+
+    return await chat_title_cache.get(chat_id, load)
 
 
 def new_button(text: str, chat_id: int, action) -> InlineKeyboardButton:
@@ -65,25 +77,38 @@ async def authorize_user(bot: Bot, chat_id: int, user_id: int) -> bool:
     Returns:
     bool: True if the user is an administrator or creator of the chat, False otherwise.
     """
-    try:
+
+    # failures are not cached, so they are retried on the next call
+    async def load():
         chat_member = await bot.get_chat_member(chat_id, user_id)
         return chat_member.status in ["creator", "administrator"]
+
+    try:
+        return await admin_status_cache.get((chat_id, user_id), load)
     except Exception as e:
         print(f"Failed to check if user {user_id} is admin in chat {chat_id}: {e}")
         return False
 
 
+def _size_bucket(n: int) -> str:
+    # keeps the number of distinct attribute values small
+    for bound in (0, 1, 5, 20, 100):
+        if n <= bound:
+            return str(bound)
+    return "100+"
+
+
 async def get_chats_list(
     user_id: int, context: CallbackContext
 ) -> List[Dict[str, int]]:
     """
     Retrieve a list of chats where the user is an administrator or creator.
 
-    This function queries the database for User instances associated with the provided
-    user_id. For each User instance found, it checks whether the provided user_id
-    is an authorized user of the associated chat. If so, the function retrieves the
-    chat's title and id, and adds them to a list which is returned after all
-    authorized chats have been processed.
+    The chats are taken from the chat admins index. Only the entries which haven't
+    been confirmed for CHAT_ADMINS_VERIFY_TTL_S, and the chats the user has a #whois
+    in but which are not indexed yet, are checked with Telegram; these checks run
+    concurrently, at most ADMIN_LOOKUP_CONCURRENCY at a time and each within
+    ADMIN_LOOKUP_TIMEOUT_S, and their results are written back to the index.
 
     Args:
         user_id (int): The ID of the user.
@@ -94,33 +119,88 @@ async def get_chats_list(
         of a chat where the user has administrative or creator rights.
     """
     time_start = time.time()
-    async with session_scope() as session:  # Ensure this yields an AsyncSession object.
-        result = await session.execute(select(User).filter(User.user_id == user_id))
-        users = result.scalars().all()
-    chats_list = []
-    for user in users:
-        try:
-            if await authorize_user(context.bot, user.chat_id, user_id):
-                chat_name = await get_chat_name(context.bot, user.chat_id)
-                chats_list.append({"title": chat_name, "id": user.chat_id})
-        except Exception as e:
-            context.bot.logger.exception(
-                e
-            )  # Ensure your CallbackContext has a logger configured.
-    tg_logger.info(f'get_chats_list time elapsed {time.time() - time_start}s')
-    return chats_list
+    async with session_scope() as sess:
+        entries = await get_user_entries(sess, user_id)
+        result = await sess.execute(
+            select(User.chat_id).where(
+                User.user_id == user_id,
+                User.chat_id.is_not(None),
+                User.chat_id.not_in(
+                    select(ChatAdmin.chat_id).where(ChatAdmin.user_id == user_id)
+                ),
+            )
+        )
+        unindexed_chat_ids = result.scalars().all()
+
+    stale_after = time.time() - constants.CHAT_ADMINS_VERIFY_TTL_S
+    chats = {}
+    titles = {}
+    admin_chat_ids = {}
+    stale_chat_ids = list(unindexed_chat_ids)
+    for entry in entries:
+        titles[entry.chat_id] = entry.title
+        admin_chat_ids[entry.chat_id] = entry.is_admin
+        if entry.verified_at < stale_after:
+            stale_chat_ids.append(entry.chat_id)
+        elif entry.is_admin:
+            chats[entry.chat_id] = entry.title
+
+    semaphore = asyncio.Semaphore(constants.ADMIN_LOOKUP_CONCURRENCY)
+    timeout = constants.ADMIN_LOOKUP_TIMEOUT_S
+
+    async def verify(chat_id):
+        async with semaphore:
+            is_admin = await asyncio.wait_for(
+                authorize_user(context.bot, chat_id, user_id), timeout
+            )
+            title = titles.get(chat_id)
+            if is_admin and title is None:
+                title = await asyncio.wait_for(
+                    get_chat_name(context.bot, chat_id), timeout
+                )
+            return is_admin, title
+
+    results = await asyncio.gather(
+        *(verify(chat_id) for chat_id in stale_chat_ids), return_exceptions=True
+    )
+    async with session_scope() as sess:
+        for chat_id, result in zip(stale_chat_ids, results):
+            if isinstance(result, Exception):
+                tg_logger.warning(
+                    f"Failed to check if user {user_id} is admin in chat {chat_id}",
+                    exc_info=result,
+                )
+                # fall back to what the index says until the next attempt
+                if admin_chat_ids.get(chat_id):
+                    chats[chat_id] = titles[chat_id]
+                continue
+            is_admin, title = result
+            await set_admin_status(sess, chat_id, user_id, is_admin, title=title)
+            if is_admin:
+                chats[chat_id] = title
+
+    get_chats_list_histogram.record(
+        time.time() - time_start,
+        {
+            "chats": _size_bucket(len(entries) + len(unindexed_chat_ids)),
+            "verified": _size_bucket(len(stale_chat_ids)),
+        },
+    )
+    return [
+        {"title": title or str(chat_id), "id": chat_id}
+        for chat_id, title in sorted(chats.items())
+    ]
 
 
 async def create_chats_list_keyboard(
-    user_chats: Iterator[Dict[str, int]], context: CallbackContext, user_id: int
+    user_chats: Iterator[Dict[str, int]]
 ) -> List[List[InlineKeyboardButton]]:
     """
     Create a keyboard layout for the list of chats where the user is an administrator or creator.
 
     Args:
-    user_chats (Iterator[Dict[str, int]]): An iterator over dictionaries containing chat information.
-    context (CallbackContext): The callback context as provided by the Telegram API.
-    user_id (int): The ID of the user.
+    user_chats (Iterator[Dict[str, int]]): An iterator over dictionaries containing chat information,
+        as returned by get_chats_list, so already authorized.
 
     Returns:
     List[List[InlineKeyboardButton]]: The created keyboard layout.
@@ -128,5 +208,4 @@ async def create_chats_list_keyboard(
     return [
         [new_button(chat["title"], chat["id"], constants.Actions.select_chat)]
         for chat in user_chats
-        if await authorize_user(context.bot, chat["id"], user_id)
     ]
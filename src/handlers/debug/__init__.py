@@ -3,3 +3,4 @@ Module with all the telegram handlers used for debugging.
 """
 
 from .list_jobs_handler import list_jobs_handler
+from .cache_stats_handler import cache_stats_handler
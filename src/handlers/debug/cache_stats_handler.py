@@ -0,0 +1,24 @@
+import html
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.ext import CallbackContext
+
+from src.telegram_cache import admin_status_cache, chat_title_cache
+from src.user_profiles import user_profile_cache
+from src.chat_settings import chat_settings_cache
+from src.handlers.utils import debug
+
+
+@debug
+async def cache_stats_handler(update: Update, context: CallbackContext) -> None:
+    lines = [
+        f"<i>{html.escape(cache.name)}</i>: "
+        + ", ".join(f"{key} {value}" for key, value in cache.stats().items())
+        for cache in (chat_title_cache, admin_status_cache)
+    ]
+    lines.append(f"<i>chat_settings</i>: size {len(chat_settings_cache)}")
+    lines.append(f"<i>user_profile</i>: size {len(user_profile_cache)}")
+    await update.message.reply_text(
+        "<b>Caches</b>\n\n" + "\n".join(lines),
+        parse_mode=ParseMode.HTML,
+    )
@@ -4,6 +4,7 @@ from telegram.constants import ParseMode
 from telegram.ext import CallbackContext
 
 from src import constants
+from src.job_registry import job_registry
 from src.handlers.utils import debug
 
 
@@ -11,7 +12,11 @@ from src.handlers.utils import debug
 async def list_jobs_handler(update: Update, context: CallbackContext) -> None:
     args = update.effective_message.text.split()
     chat_id = int(args[1]) if len(args) > 1 else None
-    jobs = [job for job in context.job_queue.jobs() if chat_id is None or job.data.get("chat_id") == chat_id]
+    jobs = (
+        context.job_queue.jobs()
+        if chat_id is None
+        else job_registry.get_chat_jobs(chat_id)
+    )
     await update.message.reply_text(
         f"<b>Jobs: {len(jobs)} items</b>\n\n"
         + "\n\n".join(
@@ -2,5 +2,14 @@
 Module with all the telegram handlers related to group chat flow.
 """
 
-from .group_handler import on_hashtag_message, on_new_chat_members
+from .group_handler import (
+    on_hashtag_message,
+    on_new_chat_members,
+    deadline_sweeper,
+    startup_reconciler,
+    burst_coalescer,
+    wait_pending_sends,
+)
 from .my_chat_member_handler import my_chat_member_handler
+from .chat_member_handler import chat_member_handler
+from .chat_title_handler import new_chat_title_handler
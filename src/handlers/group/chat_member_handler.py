@@ -0,0 +1,35 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from src.chat_admins import is_admin_status, set_admin_status
+from src.model import session_scope
+from src.telegram_cache import admin_status_cache, chat_title_cache
+
+
+async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Keep the chat admins index and the admin menu caches up to date with promotions and demotions.
+
+    Args:
+    update (Update): The update object that represents the incoming update.
+    context (CallbackContext): The context object that contains information about the current state of the bot.
+
+    Returns:
+    None
+    """
+    chat_id = update.effective_chat.id
+    chat_member = update.chat_member
+    user_id = chat_member.new_chat_member.user.id
+    was_admin = is_admin_status(chat_member.old_chat_member.status)
+    is_admin = is_admin_status(chat_member.new_chat_member.status)
+    admin_status_cache.set((chat_id, user_id), is_admin)
+    if update.effective_chat.title:
+        chat_title_cache.set(chat_id, update.effective_chat.title)
+    # ordinary members joining and leaving are of no interest here
+    if was_admin == is_admin:
+        return
+
+    async with session_scope() as sess:
+        await set_admin_status(
+            sess, chat_id, user_id, is_admin, title=update.effective_chat.title
+        )
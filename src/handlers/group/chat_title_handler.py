@@ -0,0 +1,24 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from src.chat_admins import set_chat_title
+from src.model import session_scope
+from src.telegram_cache import chat_title_cache
+
+
+async def new_chat_title_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Update the cached and indexed title of a chat when it is renamed.
+
+    Args:
+    update (Update): The update object that represents the incoming update.
+    context (CallbackContext): The context object that contains information about the current state of the bot.
+
+    Returns:
+    None
+    """
+    chat_id = update.effective_chat.id
+    title = update.effective_message.new_chat_title
+    chat_title_cache.set(chat_id, title)
+    async with session_scope() as sess:
+        await set_chat_title(sess, chat_id, title)
@@ -1,17 +1,43 @@
+import asyncio
 from datetime import datetime, timedelta
 from telegram import Bot, Message, Update
-from telegram.constants import ParseMode
-from telegram.ext import ContextTypes
-from typing import Optional
+from telegram import User as TelegramUser
+from telegram.constants import BulkRequestLimit, ParseMode
+from telegram.ext import Application, ContextTypes
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
 
-from sqlalchemy import select, func
+from sqlalchemy import select
 
 from src.logging import tg_logger
 from src import constants
 from src.texts import _
-from src.model import Chat, User, session_scope
-from src.handlers.utils import setup_counter, setup_histogram
-
+from src.model import Chat, User, session_scope, upsert
+from src.job_registry import job_registry
+from src.chat_settings import ChatSettings, chat_settings_cache
+from src.user_profiles import get_user
+from src.outbound import Priority, outbound
+from src.burst import BurstCoalescer
+from src.reconciliation import StartupReconciler
+from src.deadlines import (
+    DELETE_MESSAGE,
+    KICK,
+    NOTIFY,
+    DeadlineSweeper,
+    cancel_user_deadlines,
+    cancel_users_deadlines,
+    new_deadline,
+    schedule_deadline,
+)
+from src.stats import db_stats, reconcile_db_stats
+from src.handlers.utils import setup_counter
+from src import bounded_metrics
+from src.bounded_metrics import chat_events
+
+
+# merges the messages sent to users within a chat's join_burst_window
+burst_coalescer = BurstCoalescer()
+# the messages waiting in the outbound queue, see _send_markdown_with_deletion
+_pending_sends: Set[asyncio.Task] = set()
 
 new_member_counter = setup_counter("new_member.meter", "new_member_counter")
 whois_counter = setup_counter("new_whois.meter", "new_whois_counter")
@@ -19,24 +45,8 @@ ban_counter = setup_counter("ban.meter", "ban_counter")
 
 
 async def db_metrics_reader_helper(context: ContextTypes.DEFAULT_TYPE):
-    chats_histogram = setup_histogram("chats.meter", "chats_counter")
-    users_histogram = setup_histogram("users.meter", "users_counter")
-    unique_users_histogram = setup_histogram(
-        "unique_users.meter", "unique_users_counter"
-    )
-    async with session_scope() as sess:
-        # Number of chats
-        result = await sess.execute(select(func.count(Chat.id)))
-        chat_count = result.scalar()
-        chats_histogram.record(chat_count)
-        # Total number of users
-        result = await sess.execute(select(func.count()).select_from(User))
-        users_count = result.scalar()
-        users_histogram.record(users_count)
-        # Number of unique users
-        result = await sess.execute(select(func.count(func.distinct(User.user_id))))
-        unique_users_count = result.scalar()
-        unique_users_histogram.record(unique_users_count)
+    # callback of the persisted "metrics_exporter" jobs, removed on startup; see src.stats
+    await reconcile_db_stats(context)
 
 
 async def on_new_chat_members(
@@ -53,87 +63,72 @@ async def on_new_chat_members(
     None
     """
     chat_id = update.message.chat_id
-    new_member_counter.add(1, {"chat_id": chat_id})
-    context.job_queue.run_repeating(
-        db_metrics_reader_helper, 3600, name="metrics_exporter"
-    )
-    user_ids = [
-        new_chat_member.id for new_chat_member in update.message.new_chat_members
-    ]
+    new_chat_members = update.message.new_chat_members
+    new_member_counter.add(1)
+    chat_events.add(bounded_metrics.JOIN, chat_id, len(new_chat_members))
+    user_ids = [new_chat_member.id for new_chat_member in new_chat_members]
 
     for user_id in user_ids:
-        for job in context.job_queue.jobs():
-            if (
-                job.data
-                and job.data.get("user_id") == user_id
-                and job.data.get("chat_id") == chat_id
-            ):
-                job.schedule_removal()
+        # jobs scheduled before the deadlines table was introduced
+        for job in job_registry.get_user_jobs(chat_id, user_id):
+            job_registry.remove(job)
 
-        async with session_scope() as sess:
-            result = await sess.execute(
-                select(User).where(User.chat_id == chat_id, User.user_id == user_id)
+    async with session_scope() as sess:
+        chat = await chat_settings_cache.get(chat_id, create=True, sess=sess)
+        await cancel_users_deadlines(sess, chat_id, user_ids)
+        result = await sess.execute(
+            select(User.user_id).where(
+                User.chat_id == chat_id, User.user_id.in_(user_ids)
             )
-            user = result.scalars().first()
-            chat_result = await sess.execute(select(Chat).where(Chat.id == chat_id))
-            chat = chat_result.scalars().first()
-
-            if chat is None:
-                chat = Chat.get_new_chat(chat_id)
-                sess.add(chat)
-                await sess.commit()
-
-            if user is not None:
-                await _send_message_with_deletion(
-                    context,
-                    chat_id,
-                    user_id,
-                    chat.on_known_new_chat_member_message,
-                    reply_to=update.message,
-                )
-                continue
+        )
+        known_user_ids = set(result.scalars())
 
-            message = chat.on_new_chat_member_message
-            kick_timeout = chat.kick_timeout
-            notify_timeout = chat.notify_timeout
+        skip_new = chat.on_new_chat_member_message == _("msg__skip_new_chat_member")
+        deadlines = []
+        for user_id in user_ids:
+            if user_id in known_user_ids or skip_new:
+                continue
+            if chat.kick_timeout != 0:
+                deadlines.append(
+                    new_deadline(chat_id, user_id, KICK, chat.kick_timeout * 60)
+                )
+            if chat.notify_timeout != 0:
+                deadlines.append(
+                    new_deadline(chat_id, user_id, NOTIFY, chat.notify_timeout * 60)
+                )
+        sess.add_all(deadlines)
 
-        if message == _("msg__skip_new_chat_member"):
-            continue
+    semaphore = asyncio.Semaphore(constants.JOIN_FANOUT_CONCURRENCY)
 
-        await _send_message_with_deletion(
-            context,
-            chat_id,
-            user_id,
-            message,
+    async def greet(new_chat_member: TelegramUser) -> None:
+        if new_chat_member.id in known_user_ids:
+            message = chat.on_known_new_chat_member_message
+            timeout_m = constants.default_delete_message_timeout_m
+        elif not skip_new:
+            message = chat.on_new_chat_member_message
             # 36 hours which is considered infinity; bots can't delete messages older than 48h
-            timeout_m=constants.default_delete_message_timeout_m * 24 * 1.5,
-            reply_to=update.message,
-        )
-
-        if kick_timeout != 0:
-            job = context.job_queue.run_once(
-                on_kick_timeout,
-                kick_timeout * 60,
-                chat_id=chat_id,
-                user_id=user_id,
-                data={
-                    "chat_id": chat_id,
-                    "user_id": user_id,
-                    "creation_time": datetime.now().timestamp(),
-                },
+            timeout_m = constants.default_delete_message_timeout_m * 24 * 1.5
+        else:
+            return
+        async with semaphore:
+            await _send_or_coalesce(
+                context,
+                chat,
+                new_chat_member.id,
+                message,
+                timeout_m=timeout_m,
+                reply_to=update.message,
+                user=new_chat_member,
             )
 
-        if notify_timeout != 0:
-            job = context.job_queue.run_once(
-                on_notify_timeout,
-                notify_timeout * 60,
-                chat_id=chat_id,
-                user_id=user_id,
-                data={
-                    "chat_id": chat_id,
-                    "user_id": user_id,
-                    "creation_time": datetime.now().timestamp(),
-                },
+    results = await asyncio.gather(
+        *(greet(new_chat_member) for new_chat_member in new_chat_members),
+        return_exceptions=True,
+    )
+    for new_chat_member, result in zip(new_chat_members, results):
+        if isinstance(result, Exception):
+            tg_logger.exception(
+                f"failed to greet {new_chat_member.id} in {chat_id}", exc_info=result
             )
 
 
@@ -157,20 +152,27 @@ async def remove_user_jobs_from_queue(context, user_id, chat_id):
     bool: True if at least one job was removed, False otherwise.
     """
     removed = False
-    for job in context.job_queue.jobs():
-        if job.data and job.data.get("user_id") == user_id and job.data.get("chat_id") == chat_id:
-            if "message_id" in job.data:
-                try:
-                    await context.bot.delete_message(
-                        job.data.get("chat_id"), job.data["message_id"]
-                    )
-                except Exception as e:
-                    tg_logger.warning(
-                        f"can't delete {job.data['message_id']} from {job.data['chat_id']}",
-                        exc_info=e,
-                    )
-            job.schedule_removal()
-            removed = True
+    message_ids = []
+    for deadline in await cancel_user_deadlines(chat_id, user_id):
+        if deadline.kind == DELETE_MESSAGE:
+            message_ids.append(deadline.payload["message_id"])
+        removed = True
+    await delete_messages(context.bot, chat_id, message_ids)
+
+    # jobs scheduled before the deadlines table was introduced
+    for job in job_registry.get_user_jobs(chat_id, user_id):
+        if "message_id" in job.data:
+            try:
+                await context.bot.delete_message(
+                    job.data.get("chat_id"), job.data["message_id"]
+                )
+            except Exception as e:
+                tg_logger.warning(
+                    f"can't delete {job.data['message_id']} from {job.data['chat_id']}",
+                    exc_info=e,
+                )
+        job_registry.remove(job)
+        removed = True
     return removed
 
 
@@ -192,33 +194,30 @@ async def on_hashtag_message(
     if is_whois(update, chat_id):
         user_id = update.effective_message.from_user.id
         whois_counter.add(1)
+        chat_events.add(bounded_metrics.WHOIS, chat_id)
 
-        async with session_scope() as sess:
-            chat_result = await sess.execute(select(Chat).where(Chat.id == chat_id))
-            chat = chat_result.scalars().first()
-            if chat is None:
-                chat = Chat.get_new_chat(chat_id)
-                sess.add(chat)
-                await sess.commit()
-
-            if len(update.effective_message.text) <= chat.whois_length:
-                await _send_message_with_deletion(
-                    context,
-                    chat_id,
-                    user_id,
-                    # TODO move to chat DB
-                    _("msg__short_whois").format(whois_length=chat.whois_length),
-                    reply_to=update.effective_message,
-                )
-                return
+        chat = await chat_settings_cache.get(chat_id, create=True)
+
+        if len(update.effective_message.text) <= chat.whois_length:
+            await _send_message_with_deletion(
+                context,
+                chat_id,
+                user_id,
+                # TODO move to chat DB
+                _("msg__short_whois").format(whois_length=chat.whois_length),
+                reply_to=update.effective_message,
+                user=update.effective_message.from_user,
+            )
+            return
 
-            message = chat.on_introduce_message
+        message = chat.on_introduce_message
 
         async with session_scope() as sess:
             user = User(
                 chat_id=chat_id, user_id=user_id, whois=update.effective_message.text
             )
-            await sess.merge(user)
+            if await upsert(sess, user, return_inserted=True):
+                await db_stats.user_inserted(sess, user_id, chat_id)
 
         removed = False
         removed = await remove_user_jobs_from_queue(context, user_id, chat_id)
@@ -230,6 +229,7 @@ async def on_hashtag_message(
                 user_id,
                 message,
                 reply_to=update.effective_message,
+                user=update.effective_message.from_user,
             )
 
 
@@ -244,19 +244,16 @@ async def on_notify_timeout(context: ContextTypes.DEFAULT_TYPE):
     None
     """
     bot, job = context.bot, context.job
-    async with session_scope() as sess:
-        chat_result = await sess.execute(
-            select(Chat).filter(Chat.id == job.data["chat_id"])
-        )
-        chat = chat_result.scalar_one_or_none()
-
-        await _send_message_with_deletion(
-            context,
-            job.data.get("chat_id"),
-            job.data.get("user_id"),
-            chat.notify_message,
-            timeout_m=chat.kick_timeout - chat.notify_timeout,
-        )
+    chat = await chat_settings_cache.get(job.data["chat_id"])
+    chat_events.add(bounded_metrics.NOTIFY, job.data["chat_id"])
+
+    await _send_or_coalesce(
+        context,
+        chat,
+        job.data.get("user_id"),
+        chat.notify_message,
+        timeout_m=chat.kick_timeout - chat.notify_timeout,
+    )
 
 
 async def on_kick_timeout(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -272,26 +269,28 @@ async def on_kick_timeout(context: ContextTypes.DEFAULT_TYPE) -> None:
     bot, job = context.bot, context.job
 
     try:
-        await bot.ban_chat_member(
+        await outbound.submit(
             job.data.get("chat_id"),
-            job.data.get("user_id"),
-            until_date=datetime.now() + timedelta(seconds=60),
+            Priority.kick,
+            lambda: bot.ban_chat_member(
+                job.data.get("chat_id"),
+                job.data.get("user_id"),
+                until_date=datetime.now() + timedelta(seconds=60),
+            ),
+            per_chat_limit=False,
         )
         ban_counter.add(1)
+        chat_events.add(bounded_metrics.KICK, job.data["chat_id"])
 
-        async with session_scope() as sess:
-            chat_result = await sess.execute(
-                select(Chat).where(Chat.id == job.data["chat_id"])
+        chat = await chat_settings_cache.get(job.data["chat_id"])
+
+        if chat.on_kick_message.lower() not in ["false", "0"]:
+            await _send_or_coalesce(
+                context,
+                chat,
+                job.data.get("user_id"),
+                chat.on_kick_message,
             )
-            chat = chat_result.scalar_one_or_none()
-
-            if chat.on_kick_message.lower() not in ["false", "0"]:
-                await _send_message_with_deletion(
-                    context,
-                    job.data.get("chat_id"),
-                    job.data.get("user_id"),
-                    chat.on_kick_message,
-                )
     except Exception as e:
         tg_logger.exception(
             f"Failed to kick {job.data['user_id']} from {job.data['chat_id']}",
@@ -325,7 +324,80 @@ async def delete_message(context: ContextTypes.DEFAULT_TYPE) -> None:
         )
 
 
-async def _mention_markdown(bot: Bot, chat_id: int, user_id: int, message: str) -> str:
+async def delete_messages(bot: Bot, chat_id: int, message_ids: List[int]) -> None:
+    """
+    Delete messages from a chat with as few API calls as possible.
+
+    Messages are deleted in batches of up to 100 with deleteMessages, and only
+    if a batch fails are its messages deleted one by one.
+
+    Args:
+    bot (Bot): The Telegram bot instance.
+    chat_id (int): The ID of the chat.
+    message_ids (List[int]): The IDs of the messages to delete.
+
+    Returns:
+    None
+    """
+    batch_size = BulkRequestLimit.MAX_LIMIT
+    for i in range(0, len(message_ids), batch_size):
+        batch = message_ids[i : i + batch_size]
+        try:
+            await outbound.submit(
+                chat_id,
+                Priority.delete,
+                lambda: bot.delete_messages(chat_id, batch),
+                per_chat_limit=False,
+            )
+            continue
+        except Exception as e:
+            tg_logger.warning(
+                f"can't delete {len(batch)} messages from {chat_id}, retrying one by one",
+                exc_info=e,
+            )
+        for message_id in batch:
+            try:
+                await outbound.submit(
+                    chat_id,
+                    Priority.delete,
+                    lambda: bot.delete_message(chat_id, message_id),
+                    per_chat_limit=False,
+                )
+            except Exception as e:
+                tg_logger.warning(
+                    f"can't delete {message_id} from {chat_id}",
+                    exc_info=e,
+                )
+
+
+async def on_delete_messages_timeout(
+    application: Application, chat_id: int, deadlines: List
+) -> None:
+    """
+    Delete the messages of all the due deletion deadlines of a chat at once.
+
+    Args:
+    application (Application): The application the deadlines are run for.
+    chat_id (int): The ID of the chat.
+    deadlines (List): The claimed deletion deadlines of the chat.
+
+    Returns:
+    None
+    """
+    await delete_messages(
+        application.bot,
+        chat_id,
+        [deadline.payload["message_id"] for deadline in deadlines],
+    )
+
+
+async def _mention_markdown(
+    bot: Bot,
+    chat_id: int,
+    user_id: int,
+    message: str,
+    user: Optional[TelegramUser] = None,
+) -> str:
     """
     Format a message to include a markdown mention of a user.
 
@@ -334,12 +406,13 @@ async def _mention_markdown(bot: Bot, chat_id: int, user_id: int, message: str)
     chat_id (int): The ID of the chat.
     user_id (int): The ID of the user to mention.
     message (str): The message to format.
+    user (Optional[TelegramUser]): The user to mention, if already known from the update.
 
     Returns:
     str: The formatted message with the user mention.
     """
-    chat_member = await bot.get_chat_member(chat_id, user_id)
-    user = chat_member.user
+    if user is None:
+        user = await get_user(bot, chat_id, user_id)
     #    if not user.name:
     #        # если пользователь удален, у него пропадает имя и markdown выглядит так: (tg://user?id=666)
     #        user_mention_markdown = ""
@@ -347,18 +420,47 @@ async def _mention_markdown(bot: Bot, chat_id: int, user_id: int, message: str)
     user_mention_markdown = user.mention_markdown_v2()
 
     # \ нужен из-за формата сообщений в маркдауне
-    tg_logger.warning(user_mention_markdown)
-    #user_mention_markdown = user_mention_markdown.replace("/[", "[")
-    #user_mention_markdown = user_mention_markdown.replace("]", "\]")
-    # wtf
-    tg_logger.warning(message.replace("%USER\\\\\\_MENTION%", user_mention_markdown))
-    message_mention = message.replace("%USER\\\\\\_MENTION%", user_mention_markdown)
-    message_mention = message_mention.replace("%USER\\\\_MENTION%", user_mention_markdown)
-    message_mention = message_mention.replace("%USER\\_MENTION%", user_mention_markdown)
-    message_mention = message_mention.replace("%USER_MENTION%", user_mention_markdown)
+    # on the path of every greeting, so only formatted if debug logging is on
+    tg_logger.debug("Mention %s in %r", user_mention_markdown, message)
+    # user_mention_markdown = user_mention_markdown.replace("/[", "[")
+    # user_mention_markdown = user_mention_markdown.replace("]", "\]")
+    return _replace_mention(message, user_mention_markdown)
+
+
+def _replace_mention(message: str, mention_markdown: str) -> str:
+    message_mention = message.replace("%USER\\\\\\_MENTION%", mention_markdown)
+    message_mention = message_mention.replace("%USER\\\\_MENTION%", mention_markdown)
+    message_mention = message_mention.replace("%USER\\_MENTION%", mention_markdown)
+    message_mention = message_mention.replace("%USER_MENTION%", mention_markdown)
     return message_mention
 
 
+async def _mentions_markdown(
+    bot: Bot,
+    chat_id: int,
+    users: List[Tuple[int, Optional[TelegramUser]]],
+    message: str,
+) -> str:
+    """
+    Format a message to include markdown mentions of several users.
+
+    Args:
+    bot (Bot): The Telegram bot instance.
+    chat_id (int): The ID of the chat.
+    users (List[Tuple[int, Optional[TelegramUser]]]): The IDs of the users to mention, with the users if already known.
+    message (str): The message to format.
+
+    Returns:
+    str: The formatted message with the user mentions separated by commas.
+    """
+    mentions = []
+    for user_id, user in users:
+        if user is None:
+            user = await get_user(bot, chat_id, user_id)
+        mentions.append(user.mention_markdown_v2())
+    return _replace_mention(message, ", ".join(mentions))
+
+
 async def _send_message_with_deletion(
     context: ContextTypes.DEFAULT_TYPE,
     chat_id: int,
@@ -366,29 +468,133 @@ async def _send_message_with_deletion(
     message: str,
     timeout_m: int = constants.default_delete_message_timeout_m,
     reply_to: Optional[Message] = None,
+    user: Optional[TelegramUser] = None,
 ):
-    message_markdown = await _mention_markdown(context.bot, chat_id, user_id, message)
+    message_markdown = await _mention_markdown(
+        context.bot, chat_id, user_id, message, user=user
+    )
+    await _send_markdown_with_deletion(
+        context.bot, chat_id, user_id, message_markdown, timeout_m, reply_to
+    )
 
+
+async def _send_markdown_with_deletion(
+    bot: Bot,
+    chat_id: int,
+    user_id: int,
+    message_markdown: str,
+    timeout_m: int = constants.default_delete_message_timeout_m,
+    reply_to: Optional[Message] = None,
+):
     if reply_to is not None:
-        sent_message = await reply_to.reply_text(
+        send = lambda: reply_to.reply_text(
             text=message_markdown, parse_mode=ParseMode.MARKDOWN_V2
         )
     else:
-        sent_message = await context.bot.send_message(
+        send = lambda: bot.send_message(
             chat_id, text=message_markdown, parse_mode=ParseMode.MARKDOWN_V2
         )
+    # the update isn't held while the message waits for the chat's rate limit,
+    # e.g. behind the greetings of a join raid, so the #whois sent meanwhile
+    # cancels the kick right away
+    task = asyncio.create_task(
+        _send_and_schedule_deletion(chat_id, user_id, send, timeout_m)
+    )
+    _pending_sends.add(task)
+    task.add_done_callback(_pending_sends.discard)
 
-    # correctly handle negative timeouts
-    timeout_m = max(timeout_m, constants.default_delete_message_timeout_m)
-
-    context.job_queue.run_once(
-        delete_message,
-        timeout_m * 60,
-        chat_id=chat_id,
-        user_id=user_id,
-        data={
-            "chat_id": chat_id,
-            "user_id": user_id,
-            "message_id": sent_message.message_id,
-        },
+
+async def _send_and_schedule_deletion(
+    chat_id: int,
+    user_id: int,
+    send: Callable[[], Awaitable[Message]],
+    timeout_m: int,
+) -> None:
+    try:
+        sent_message = await outbound.submit(chat_id, Priority.message, send)
+
+        # correctly handle negative timeouts
+        timeout_m = max(timeout_m, constants.default_delete_message_timeout_m)
+
+        await schedule_deadline(
+            chat_id,
+            user_id,
+            DELETE_MESSAGE,
+            timeout_m * 60,
+            {"message_id": sent_message.message_id},
+            bucket_s=constants.DELETE_MESSAGE_BUCKET_S,
+        )
+    except Exception as e:
+        tg_logger.exception(f"failed to send a message to chat {chat_id}", exc_info=e)
+
+
+async def wait_pending_sends() -> None:
+    """
+    Wait for the messages queued by the handlers to be sent and their deletion
+    scheduled, e.g. on shutdown before the outbound queue stops.
+    """
+    await asyncio.gather(*_pending_sends, return_exceptions=True)
+
+
+async def _send_or_coalesce(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat: ChatSettings,
+    user_id: int,
+    message: str,
+    timeout_m: int = constants.default_delete_message_timeout_m,
+    reply_to: Optional[Message] = None,
+    user: Optional[TelegramUser] = None,
+):
+    """
+    Send a message to a user, or, if the chat has a join burst window, merge it with
+    the same message sent to other users within the window.
+
+    Args:
+    context (CallbackContext): The context object containing the bot instance.
+    chat (ChatSettings): The settings of the chat.
+    user_id (int): The ID of the user to mention.
+    message (str): The message with a %USER_MENTION% placeholder.
+    timeout_m (int): The number of minutes after which the message is deleted.
+    reply_to (Optional[Message]): The message to reply to if the message is not merged.
+    user (Optional[TelegramUser]): The user to mention, if already known from the update.
+
+    Returns:
+    None
+    """
+    if chat.join_burst_window <= 0:
+        await _send_message_with_deletion(
+            context, chat.id, user_id, message, timeout_m, reply_to, user
+        )
+        return
+
+    bot = context.bot
+
+    async def flush(users):
+        batch_size = constants.MAX_MENTIONS_PER_MESSAGE
+        for i in range(0, len(users), batch_size):
+            message_markdown = await _mentions_markdown(
+                bot, chat.id, users[i : i + batch_size], message
+            )
+            # the message is shared, so no single user's #whois may delete it
+            await _send_markdown_with_deletion(
+                bot, chat.id, 0, message_markdown, timeout_m
+            )
+
+    burst_coalescer.add(
+        (chat.id, message, timeout_m),
+        (user_id, user),
+        chat.join_burst_window,
+        flush,
     )
+
+
+deadline_sweeper = DeadlineSweeper(
+    {
+        KICK: on_kick_timeout,
+        NOTIFY: on_notify_timeout,
+    },
+    batch_callbacks={
+        DELETE_MESSAGE: on_delete_messages_timeout,
+    },
+)
+startup_reconciler = StartupReconciler(deadline_sweeper)
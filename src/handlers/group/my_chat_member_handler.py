@@ -1,16 +1,19 @@
 from telegram import ChatMember, Update
 from telegram.ext import ContextTypes
 
-from sqlalchemy import select
-
 from src import constants
-from src.model import Chat, User, session_scope
+from src.model import Chat, User, insert_if_missing, session_scope
+from src.stats import db_stats
+from src.chat_admins import remove_chat, set_admin_status
+from src.telegram_cache import admin_status_cache, chat_title_cache
 from src.handlers.admin.utils import new_keyboard_layout
 from src.texts import _
 
 
 async def my_chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    old_status, new_status = update.my_chat_member.difference().get("status", (None, None))
+    old_status, new_status = update.my_chat_member.difference().get(
+        "status", (None, None)
+    )
 
     if old_status == ChatMember.LEFT and new_status == ChatMember.MEMBER:
         # which means the bot was added to the chat
@@ -19,20 +22,37 @@ async def my_chat_member_handler(update: Update, context: ContextTypes.DEFAULT_T
         )
         return
 
+    if new_status in (ChatMember.LEFT, ChatMember.BANNED):
+        # which means the bot was removed from the chat
+        chat_id = update.effective_chat.id
+        async with session_scope() as sess:
+            await remove_chat(sess, chat_id)
+        # so the admin menu stops offering the chat right away
+        chat_title_cache.invalidate(chat_id)
+        admin_status_cache.invalidate_where(lambda key: key[0] == chat_id)
+        return
+
     if (
         old_status != ChatMember.ADMINISTRATOR
         and new_status == ChatMember.ADMINISTRATOR
     ):
         # which means the bot is now admin and can be used
         async with session_scope() as sess:
-            result = await sess.execute(
-                select(Chat).filter_by(id=update.effective_chat.id)
+            # only an admin could have promoted the bot
+            admin_status_cache.set(
+                (update.effective_chat.id, update.effective_user.id), True
+            )
+            await set_admin_status(
+                sess,
+                update.effective_chat.id,
+                update.effective_user.id,
+                True,
+                title=update.effective_chat.title,
             )
-            chat = result.scalars().first()
+            chat = Chat.get_new_chat(update.effective_chat.id)
 
-            if chat is None:
-                chat = Chat.get_new_chat(update.effective_chat.id)
-                sess.add(chat)
+            if await insert_if_missing(sess, chat):
+                db_stats.chat_inserted()
                 # hack with adding an empty #whois to prevent slow /start cmd
                 # TODO after v1.0: rework the DB schema
                 user = User(
@@ -40,7 +60,10 @@ async def my_chat_member_handler(update: Update, context: ContextTypes.DEFAULT_T
                     user_id=update.effective_user.id,
                     whois="",
                 )
-                await sess.merge(user)
+                if await insert_if_missing(sess, user):
+                    await db_stats.user_inserted(
+                        sess, update.effective_user.id, update.effective_chat.id
+                    )
                 # notify the admin about a new chat
                 button_configs = [
                     [
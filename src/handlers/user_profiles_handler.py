@@ -0,0 +1,25 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from src.user_profiles import remember_user
+
+
+async def user_profiles_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """
+    Remember the profiles of the users seen in an update, so that mentions can be
+    rendered later without calling get_chat_member.
+
+    Args:
+    update (Update): The update object that represents the incoming update.
+    context (CallbackContext): The context object that contains information about the current state of the bot.
+
+    Returns:
+    None
+    """
+    remember_user(update.effective_user)
+    message = update.effective_message
+    if message is not None and message.new_chat_members:
+        for new_chat_member in message.new_chat_members:
+            remember_user(new_chat_member)
@@ -4,16 +4,22 @@ from telegram import Update
 from telegram.ext import CallbackContext
 from opentelemetry import metrics
 
+from src.bounded_metrics import BoundedCounter
 from src.constants import DEBUG, TEAM_TELEGRAM_IDS
 from src.model import Chat, User, session_scope
 
 
-def setup_counter(meter_name, counter_name, version="2.0.0"):
+def setup_counter(meter_name, counter_name, version="2.0.0", allowed_attributes=()):
     """
     A helper function to remove duplication of code for counters creation.
+
+    Only the `allowed_attributes` are exported, see BoundedCounter; per-chat counts go to chat_events.
     """
     meter = metrics.get_meter(meter_name, version=version)
-    return meter.create_counter(counter_name, unit="1")
+    return BoundedCounter(
+        meter.create_counter(counter_name, unit="1"), allowed_attributes
+    )
+
 
 def setup_histogram(meter_name, histogram_name, version="2.0.0"):
     meter = metrics.get_meter(meter_name, version=version)
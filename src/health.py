@@ -0,0 +1,231 @@
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+
+from opentelemetry import metrics
+from opentelemetry.metrics import CallbackOptions, Observation
+from sqlalchemy import func, select
+from telegram.ext import Application
+
+from src import constants
+from src.logging import tg_logger
+from src.model import Deadline, engine, session_scope
+from src.outbound import outbound
+from src.update_processor import ChatOrderedUpdateProcessor
+
+
+# name -> help, all of them gauges; the names must not be taken by the other
+# instruments, e.g. those of ChatOrderedUpdateProcessor
+GAUGES = {
+    "event_loop_lag_seconds": "Max delay of the event loop over the last sample interval",
+    "pending_updates": "Updates received but not picked up by the application yet",
+    "health_updates_in_flight": "Updates being handled",
+    "health_updates_waiting": "Updates waiting for their chat or for a free slot",
+    "outbound_pending": "Bot API requests waiting in the outbound queue",
+    "deadlines_due": "Kicks, notifies and deletions past their due time",
+    "jobs_due": "Job queue jobs past their run time",
+    "db_pool_checked_out": "Database connections in use",
+    "db_pool_size": "Database connections the pool keeps",
+    "db_up": "Whether the last database query succeeded",
+}
+
+
+class HealthMonitor:
+    """
+    Measures how far behind the bot is: event loop lag, pending updates, the
+    scheduler backlog and database pool use. The values are exported as gauges
+    and served on a small local HTTP server, with /healthz for a container
+    healthcheck and /metrics in the Prometheus text format.
+
+    The lag is probed every `probe_interval_s`, everything else is sampled every
+    `sample_interval_s`. The bot is healthy while the lag and the age of the last
+    sample stay under their limits and the database answers.
+    """
+
+    def __init__(
+        self,
+        host: str = constants.HEALTH_HOST,
+        port: int = constants.HEALTH_PORT,
+        probe_interval_s: float = 0.5,
+        sample_interval_s: float = constants.HEALTH_SAMPLE_INTERVAL_S,
+        max_lag_s: float = constants.HEALTH_MAX_LOOP_LAG_S,
+    ):
+        self.host = host
+        self.port = port
+        self.probe_interval_s = probe_interval_s
+        self.sample_interval_s = sample_interval_s
+        self.max_lag_s = max_lag_s
+        self.values: Dict[str, float] = {}
+        self._max_lag = 0.0
+        self._sampled_at: Optional[float] = None
+        self._tasks: List[asyncio.Task] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        meter = metrics.get_meter("health.meter", version="2.0.0")
+        for name, description in GAUGES.items():
+            meter.create_observable_gauge(
+                name, callbacks=[self._observer(name)], description=description
+            )
+
+    def _observer(self, name: str):
+        def observe(options: CallbackOptions):
+            if name in self.values:
+                yield Observation(self.values[name])
+
+        return observe
+
+    async def start(self, application: Application) -> None:
+        self._tasks = [
+            asyncio.create_task(self._probe_lag()),
+            asyncio.create_task(self._sample_loop(application)),
+        ]
+        if self.port:
+            self._server = await asyncio.start_server(
+                self._handle_connection, self.host, self.port
+            )
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _probe_lag(self) -> None:
+        while True:
+            expected = time.monotonic() + self.probe_interval_s
+            await asyncio.sleep(self.probe_interval_s)
+            self._max_lag = max(self._max_lag, time.monotonic() - expected)
+
+    async def _sample_loop(self, application: Application) -> None:
+        while True:
+            try:
+                await self.sample(application)
+            except Exception as e:
+                tg_logger.exception("health sample failed", exc_info=e)
+            await asyncio.sleep(self.sample_interval_s)
+
+    async def sample(self, application: Application) -> None:
+        """
+        Collect all the values but the lag, and the max lag since the last sample.
+
+        Args:
+        application (Application): The running application.
+
+        Returns:
+        None
+        """
+        values = {
+            "event_loop_lag_seconds": self._max_lag,
+            "pending_updates": application.update_queue.qsize(),
+            "outbound_pending": outbound.pending,
+        }
+        self._max_lag = 0.0
+        processor = application.update_processor
+        if isinstance(processor, ChatOrderedUpdateProcessor):
+            values["health_updates_in_flight"] = processor.in_flight
+            values["health_updates_waiting"] = processor.waiting
+
+        now = time.time()
+        values["jobs_due"] = sum(
+            1
+            for job in application.job_queue.jobs()
+            if job.next_t is not None and job.next_t.timestamp() <= now
+        )
+
+        pool = engine.pool
+        if hasattr(pool, "checkedout"):
+            values["db_pool_checked_out"] = pool.checkedout()
+            values["db_pool_size"] = pool.size()
+
+        try:
+            async with session_scope() as sess:
+                result = await asyncio.wait_for(
+                    sess.execute(
+                        select(func.count())
+                        .select_from(Deadline)
+                        .where(Deadline.due_at <= now)
+                    ),
+                    self.sample_interval_s,
+                )
+                values["deadlines_due"] = result.scalar()
+            values["db_up"] = 1
+        except Exception:
+            values["db_up"] = 0
+
+        self.values = values
+        self._sampled_at = time.monotonic()
+
+    def problems(self) -> List[str]:
+        """
+        The reasons the bot is not healthy, none if it is.
+        """
+        if self._sampled_at is None:
+            return ["not sampled yet"]
+        problems = []
+        age = time.monotonic() - self._sampled_at
+        if age > 3 * self.sample_interval_s:
+            problems.append(f"last sample {age:.1f}s ago")
+        lag = max(self.values.get("event_loop_lag_seconds", 0), self._max_lag)
+        if lag > self.max_lag_s:
+            problems.append(f"event loop lag {lag:.2f}s")
+        if not self.values.get("db_up"):
+            problems.append("database is down")
+        return problems
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name, description in GAUGES.items():
+            if name not in self.values:
+                continue
+            lines.append(f"# HELP wachter_{name} {description}")
+            lines.append(f"# TYPE wachter_{name} gauge")
+            lines.append(f"wachter_{name} {self.values[name]}")
+        return "\n".join(lines) + "\n"
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            parts = request_line.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else ""
+            if path == "/healthz":
+                problems = self.problems()
+                status = "503 Service Unavailable" if problems else "200 OK"
+                content_type = "application/json"
+                body = json.dumps(
+                    {"ok": not problems, "problems": problems, **self.values}
+                )
+            elif path == "/metrics":
+                status = "200 OK"
+                content_type = "text/plain; version=0.0.4"
+                body = self.render_prometheus()
+            else:
+                status, content_type, body = (
+                    "404 Not Found",
+                    "text/plain",
+                    "not found\n",
+                )
+            payload = body.encode()
+            writer.write(
+                (
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode()
+                + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+health_monitor = HealthMonitor()
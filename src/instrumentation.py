@@ -0,0 +1,164 @@
+import inspect
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from opentelemetry import metrics
+from opentelemetry.trace import SpanKind
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+from src.tracing import tracer
+
+
+meter = metrics.get_meter("handlers.meter", version="2.0.0")
+handler_latency = meter.create_histogram(
+    "handler_latency", unit="s", description="Wall time of a handler"
+)
+handler_sql_statements = meter.create_histogram(
+    "handler_sql_statements", unit="1", description="SQL statements run by a handler"
+)
+handler_sql_time = meter.create_histogram(
+    "handler_sql_time",
+    unit="s",
+    description="Time spent in SQL statements by a handler",
+)
+handler_api_calls = meter.create_histogram(
+    "handler_api_calls", unit="1", description="Bot API calls made by a handler"
+)
+handler_api_time = meter.create_histogram(
+    "handler_api_time", unit="s", description="Time spent in Bot API calls by a handler"
+)
+bot_api_latency = meter.create_histogram(
+    "bot_api_latency", unit="s", description="Latency of a Bot API call"
+)
+
+
+class HandlerStats:
+    """
+    What a handler has spent on the database and on the Bot API so far.
+    """
+
+    __slots__ = ("sql_statements", "sql_time", "api_calls", "api_time")
+
+    def __init__(self):
+        self.sql_statements = 0
+        self.sql_time = 0.0
+        self.api_calls = 0
+        self.api_time = 0.0
+
+
+# set while a handler runs; the tasks it starts inherit it, and the outbound workers
+# run its queued Bot API calls in its context
+current_stats: ContextVar[Optional[HandlerStats]] = ContextVar(
+    "current_stats", default=None
+)
+
+
+def instrumented(callback, name: Optional[str] = None):
+    """
+    Wrap a handler callback to record its wall time, SQL statements and Bot API calls.
+
+    Args:
+    callback (Callable): The handler callback, async or a sync one returning a coroutine.
+    name (Optional[str]): The value of the handler attribute, the callback name by default.
+
+    Returns:
+    Callable: The wrapped callback.
+    """
+    name = name or callback.__name__
+
+    @wraps(callback)
+    async def wrapper(update, context, *args, **kwargs):
+        stats = HandlerStats()
+        token = current_stats.set(stats)
+        outcome = "error"
+        time_start = time.perf_counter()
+        try:
+            with tracer.start_as_current_span(f"handler {name}"):
+                result = callback(update, context, *args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+            outcome = "ok"
+            return result
+        finally:
+            current_stats.reset(token)
+            attributes = {"handler": name, "outcome": outcome}
+            handler_latency.record(time.perf_counter() - time_start, attributes)
+            handler_sql_statements.record(stats.sql_statements, attributes)
+            handler_sql_time.record(stats.sql_time, attributes)
+            handler_api_calls.record(stats.api_calls, attributes)
+            handler_api_time.record(stats.api_time, attributes)
+
+    return wrapper
+
+
+def instrument_handlers(application: Application) -> None:
+    """
+    Wrap the callbacks of all the handlers registered so far with `instrumented`.
+
+    Args:
+    application (Application): The application, with all its handlers added.
+
+    Returns:
+    None
+    """
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = instrumented(handler.callback)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Count the SQL statements and their time towards the handler running them.
+
+    Args:
+    engine (AsyncEngine): The engine of the bot database.
+
+    Returns:
+    None
+    """
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = current_stats.get()
+        if stats is not None:
+            stats.sql_statements += 1
+            stats.sql_time += elapsed
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest which records the latency of each Bot API call in a histogram and
+    a span, and counts it towards the handler making it.
+    """
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        # the last part of the URL is the API method, the token comes before it
+        api_method = url.rsplit("/", 1)[-1]
+        time_start = time.perf_counter()
+        outcome = "error"
+        try:
+            with tracer.start_as_current_span(
+                f"telegram {api_method}", kind=SpanKind.CLIENT
+            ):
+                result = await super().do_request(url, method, *args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            elapsed = time.perf_counter() - time_start
+            bot_api_latency.record(elapsed, {"method": api_method, "outcome": outcome})
+            stats = current_stats.get()
+            if stats is not None:
+                stats.api_calls += 1
+                stats.api_time += elapsed
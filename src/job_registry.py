@@ -0,0 +1,160 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from apscheduler.events import (
+    EVENT_ALL_JOBS_REMOVED,
+    EVENT_JOB_REMOVED,
+    EVENT_SCHEDULER_STARTED,
+)
+from telegram.ext import Job, JobQueue
+
+
+class JobRegistry:
+    """
+    In-process index over the jobs of the job queue.
+
+    Jobs are indexed by (chat_id, user_id), by chat_id and by name, so handlers
+    don't have to scan `job_queue.jobs()` for every user. Removal (both explicit
+    and after a one-off job has run) is tracked through APScheduler events, and
+    the whole index is rebuilt from the job stores when the scheduler starts.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        # dicts are used as insertion-ordered sets of job ids
+        self._by_user: Dict[Tuple[int, int], Dict[str, None]] = defaultdict(dict)
+        self._by_chat: Dict[int, Dict[str, None]] = defaultdict(dict)
+        self._by_name: Dict[str, Dict[str, None]] = defaultdict(dict)
+        self._job_queue: Optional[JobQueue] = None
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def attach(self, job_queue: JobQueue) -> None:
+        """
+        Subscribe to the scheduler events of the job queue.
+
+        Args:
+        job_queue (JobQueue): The job queue of the application.
+
+        Returns:
+        None
+        """
+        self._job_queue = job_queue
+        job_queue.scheduler.add_listener(
+            self._on_scheduler_event,
+            EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED | EVENT_SCHEDULER_STARTED,
+        )
+
+    def add(self, job: Job) -> Job:
+        """
+        Index a job which was just scheduled.
+
+        Args:
+        job (Job): The job returned by `job_queue.run_*`.
+
+        Returns:
+        Job: The same job, for chaining.
+        """
+        job_id = job.job.id
+        self.discard(job_id)
+        self._jobs[job_id] = job
+        self._by_name[job.name][job_id] = None
+        if isinstance(job.data, dict):
+            chat_id, user_id = job.data.get("chat_id"), job.data.get("user_id")
+            if chat_id is not None:
+                self._by_chat[chat_id][job_id] = None
+                if user_id is not None:
+                    self._by_user[(chat_id, user_id)][job_id] = None
+        return job
+
+    def discard(self, job_id: str) -> None:
+        """
+        Drop a job from the index, if present.
+
+        Args:
+        job_id (str): The APScheduler id of the job.
+
+        Returns:
+        None
+        """
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return
+        self._discard_from(self._by_name, job.name, job_id)
+        if isinstance(job.data, dict):
+            chat_id, user_id = job.data.get("chat_id"), job.data.get("user_id")
+            self._discard_from(self._by_chat, chat_id, job_id)
+            self._discard_from(self._by_user, (chat_id, user_id), job_id)
+
+    def remove(self, job: Job) -> None:
+        """
+        Schedule a job for removal from the job queue and drop it from the index.
+
+        Args:
+        job (Job): The job to remove.
+
+        Returns:
+        None
+        """
+        job.schedule_removal()
+        self.discard(job.job.id)
+
+    def rebuild(self, jobs: Iterable[Job]) -> None:
+        """
+        Replace the index contents with the given jobs.
+
+        Args:
+        jobs (Iterable[Job]): All the jobs currently in the job queue.
+
+        Returns:
+        None
+        """
+        self.clear()
+        for job in jobs:
+            self.add(job)
+
+    def clear(self) -> None:
+        self._jobs.clear()
+        self._by_user.clear()
+        self._by_chat.clear()
+        self._by_name.clear()
+
+    def get_user_jobs(self, chat_id: int, user_id: int) -> List[Job]:
+        return self._lookup(self._by_user, (chat_id, user_id))
+
+    def get_chat_jobs(self, chat_id: int, name: Optional[str] = None) -> List[Job]:
+        jobs = self._lookup(self._by_chat, chat_id)
+        if name is None:
+            return jobs
+        return [job for job in jobs if job.name == name]
+
+    def get_jobs_by_name(self, name: str) -> List[Job]:
+        return self._lookup(self._by_name, name)
+
+    def _lookup(self, index: dict, key) -> List[Job]:
+        job_ids = index.get(key)
+        if not job_ids:
+            return []
+        return [self._jobs[job_id] for job_id in job_ids]
+
+    @staticmethod
+    def _discard_from(index: dict, key, job_id: str) -> None:
+        job_ids = index.get(key)
+        if job_ids is None:
+            return
+        job_ids.pop(job_id, None)
+        if not job_ids:
+            del index[key]
+
+    def _on_scheduler_event(self, event) -> None:
+        if event.code == EVENT_JOB_REMOVED:
+            self.discard(event.job_id)
+        elif event.code == EVENT_ALL_JOBS_REMOVED:
+            self.clear()
+        elif event.code == EVENT_SCHEDULER_STARTED and self._job_queue is not None:
+            # jobs restored from the persistent job store are not announced one by one
+            self.rebuild(self._job_queue.jobs())
+
+
+job_registry = JobRegistry()
@@ -0,0 +1,294 @@
+import pickle
+import queue
+import threading
+import time
+from typing import Collection, Dict, List, Optional, Tuple
+
+from apscheduler.job import Job as APSJob
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.util import datetime_to_utc_timestamp
+from opentelemetry import metrics
+from sqlalchemy import (
+    Column,
+    Float,
+    LargeBinary,
+    MetaData,
+    Table,
+    Unicode,
+    create_engine,
+    delete,
+    select,
+)
+from telegram.ext import Application, Job
+
+from src import constants
+from src.logging import tg_logger
+
+
+meter = metrics.get_meter("jobstore.meter", version="2.0.0")
+write_histogram = meter.create_histogram(
+    "jobstore_write_latency", unit="s", description="Time of one job store transaction"
+)
+batch_histogram = meter.create_histogram(
+    "jobstore_write_batch_size", unit="1", description="Jobs written in one transaction"
+)
+
+_STOP = object()
+_CLEAR = object()
+
+# job id -> (next_run_time, job_state), None if the job is to be deleted
+_Changes = Dict[str, Optional[Tuple[Optional[float], bytes]]]
+
+
+class WriteBehindJobStore(MemoryJobStore):
+    """
+    APScheduler job store which serves the scheduler from memory and writes the
+    changes to the database from a dedicated thread, so the event loop never
+    waits for the database.
+
+    The rows have the same layout as the ones of ptbcontrib's PTBSQLAlchemyJobStore,
+    which this store replaces, so the jobs it left behind are picked up as they are.
+    The store assumes it is the only one using the table; the rows are read once, on
+    start.
+
+    The changes made within `linger_s` of each other, e.g. the jobs rescheduled while
+    handling one update, are written in one transaction, and only the last change
+    of each job is written. A failed transaction is retried together with the
+    changes made in the meantime.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        url: str,
+        tablename: str = "apscheduler_jobs",
+        linger_s: float = constants.JOBSTORE_BATCH_LINGER_S,
+        retry_interval_s: float = 1,
+    ):
+        super().__init__()
+        self.application = application
+        self.engine = create_engine(url)
+        self.jobs_t = Table(
+            tablename,
+            MetaData(),
+            Column("id", Unicode(191), primary_key=True),
+            Column("next_run_time", Float(25), index=True),
+            Column("job_state", LargeBinary, nullable=False),
+        )
+        self.linger_s = linger_s
+        self.retry_interval_s = retry_interval_s
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        # once on startup, before any update is handled
+        self.jobs_t.create(self.engine, checkfirst=True)
+        with self.engine.begin() as connection:
+            rows = connection.execute(
+                select(self.jobs_t.c.id, self.jobs_t.c.job_state)
+            ).all()
+        for job_id, job_state in rows:
+            try:
+                job = self._reconstitute_job(job_state)
+            except Exception:
+                tg_logger.exception(f"Unable to restore job {job_id}, dropping it")
+                self._queue.put((job_id, None))
+                continue
+            super().add_job(job)
+        self._writer = threading.Thread(
+            target=self._write_loop, name="jobstore-writer", daemon=True
+        )
+        self._writer.start()
+
+    def pop_due_jobs(
+        self, now: float, names: Collection[str]
+    ) -> List[Tuple[float, Job]]:
+        """
+        Delete the rows of the jobs named `names` due by `now` and return the jobs,
+        to be handled some other way than all at once on start. Blocking; called
+        before the store is started.
+
+        Args:
+        now (float): The unix timestamp.
+        names (Collection[str]): The names of the jobs, i.e. of their callbacks.
+
+        Returns:
+        List[Tuple[float, Job]]: The due time and the job, data included, of each.
+        """
+        return self._pop_jobs(names, now)
+
+    def drop_jobs(self, names: Collection[str]) -> int:
+        """
+        Delete the rows of the jobs named `names`, e.g. of a callback no longer
+        scheduled. Blocking; called before the store is started.
+
+        Args:
+        names (Collection[str]): The names of the jobs, i.e. of their callbacks.
+
+        Returns:
+        int: The number of jobs deleted.
+        """
+        return len(self._pop_jobs(names))
+
+    def _pop_jobs(
+        self, names: Collection[str], due_by: Optional[float] = None
+    ) -> List[Tuple[float, Job]]:
+        self.jobs_t.create(self.engine, checkfirst=True)
+        query = select(
+            self.jobs_t.c.id,
+            self.jobs_t.c.next_run_time,
+            self.jobs_t.c.job_state,
+        )
+        if due_by is not None:
+            query = query.where(self.jobs_t.c.next_run_time <= due_by)
+        jobs = []
+        with self.engine.begin() as connection:
+            rows = connection.execute(query).all()
+            job_ids = []
+            for job_id, next_run_time, job_state in rows:
+                try:
+                    args = pickle.loads(job_state)["args"]
+                    name, data, chat_id, user_id, callback = args
+                except Exception:
+                    # dropped on start
+                    continue
+                if name not in names:
+                    continue
+                job = Job(
+                    callback=callback,
+                    data=data,
+                    name=name,
+                    chat_id=chat_id,
+                    user_id=user_id,
+                )
+                jobs.append((next_run_time, job))
+                job_ids.append(job_id)
+            for i in range(0, len(job_ids), 500):
+                connection.execute(
+                    delete(self.jobs_t).where(
+                        self.jobs_t.c.id.in_(job_ids[i : i + 500])
+                    )
+                )
+        return jobs
+
+    def shutdown(self):
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        # unlike MemoryJobStore.remove_all_jobs, this must not reach the database
+        self._jobs = []
+        self._jobs_index = {}
+
+    def add_job(self, job):
+        super().add_job(job)
+        self._queue.put((job.id, self._serialize(job)))
+
+    def update_job(self, job):
+        super().update_job(job)
+        self._queue.put((job.id, self._serialize(job)))
+
+    def remove_job(self, job_id):
+        super().remove_job(job_id)
+        self._queue.put((job_id, None))
+
+    def remove_all_jobs(self):
+        super().remove_all_jobs()
+        self._queue.put(_CLEAR)
+
+    def _serialize(self, job: APSJob) -> Tuple[Optional[float], bytes]:
+        # pickled right away, the job may change before the writer gets to it
+        state = job.__getstate__()
+        tg_job = Job.from_aps_job(job)
+        # the job queue and the application can't be pickled, see _reconstitute_job
+        state["args"] = (
+            tg_job.name,
+            tg_job.data,
+            tg_job.chat_id,
+            tg_job.user_id,
+            tg_job.callback,
+        )
+        return (
+            datetime_to_utc_timestamp(job.next_run_time),
+            pickle.dumps(state, pickle.HIGHEST_PROTOCOL),
+        )
+
+    def _reconstitute_job(self, job_state: bytes) -> APSJob:
+        state = pickle.loads(job_state)
+        name, data, chat_id, user_id, callback = state["args"]
+        tg_job = Job(
+            callback=callback, data=data, name=name, chat_id=chat_id, user_id=user_id
+        )
+        state["args"] = (self.application.job_queue, tg_job)
+        state["jobstore"] = self
+        job = APSJob.__new__(APSJob)
+        job.__setstate__(state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _write_loop(self) -> None:
+        clear_all = False
+        changes: _Changes = {}
+        stopping = False
+        while True:
+            if not (clear_all or changes):
+                if stopping:
+                    return
+                item = self._queue.get()
+                if item is _STOP:
+                    return
+                clear_all, changes = self._apply(item, clear_all, changes)
+                time.sleep(self.linger_s)
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    # write what's left before stopping
+                    stopping = True
+                    continue
+                clear_all, changes = self._apply(item, clear_all, changes)
+            try:
+                self._write(clear_all, changes)
+            except Exception:
+                tg_logger.exception(
+                    f"Failed to write {len(changes)} jobs to the job store, retrying"
+                )
+                if stopping:
+                    return
+                time.sleep(self.retry_interval_s)
+                continue
+            clear_all, changes = False, {}
+
+    @staticmethod
+    def _apply(item, clear_all: bool, changes: _Changes) -> Tuple[bool, _Changes]:
+        if item is _CLEAR:
+            return True, {}
+        job_id, row = item
+        changes[job_id] = row
+        return clear_all, changes
+
+    def _write(self, clear_all: bool, changes: _Changes) -> None:
+        time_start = time.time()
+        with self.engine.begin() as connection:
+            if clear_all:
+                connection.execute(delete(self.jobs_t))
+            job_ids = list(changes)
+            for i in range(0, len(job_ids), 500):
+                connection.execute(
+                    delete(self.jobs_t).where(
+                        self.jobs_t.c.id.in_(job_ids[i : i + 500])
+                    )
+                )
+            rows = [
+                {"id": job_id, "next_run_time": row[0], "job_state": row[1]}
+                for job_id, row in changes.items()
+                if row is not None
+            ]
+            if rows:
+                connection.execute(self.jobs_t.insert(), rows)
+        write_histogram.record(time.time() - time_start)
+        batch_histogram.record(len(changes))
@@ -1,8 +1,15 @@
+import atexit
+import copy
 import logging
-from logging import config
 import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Hashable, Optional
 
 import grpc
+from opentelemetry import metrics
 from opentelemetry._logs import set_logger_provider
 from opentelemetry.exporter.otlp.proto.grpc._log_exporter import (
     OTLPLogExporter,
@@ -10,11 +17,18 @@ from opentelemetry.exporter.otlp.proto.grpc._log_exporter import (
 from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
 from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
 from opentelemetry.sdk.resources import Resource
+from telegram_handler import TelegramHandler
+
+from src import constants
 
 dsn = os.environ.get("UPTRACE_DSN")
 
 resource = Resource(
-    attributes={"service.name": "wachter-bot", "service.version": "1.1.0", "deployment.environment": os.environ.get("DEPLOYMENT_ENVIRONMENT")}
+    attributes={
+        "service.name": "wachter-bot",
+        "service.version": "1.1.0",
+        "deployment.environment": os.environ.get("DEPLOYMENT_ENVIRONMENT"),
+    }
 )
 logger_provider = LoggerProvider(resource=resource)
 set_logger_provider(logger_provider)
@@ -27,31 +41,205 @@ exporter = OTLPLogExporter(
 )
 logger_provider.add_log_record_processor(BatchLogRecordProcessor(exporter))
 
-log_config = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "handlers": {
-        "wachter_telegram": {
-            "class": "telegram_handler.TelegramHandler",
-            "token": os.environ["TELEGRAM_TOKEN"],
-            "chat_id": os.environ["TELEGRAM_ERROR_CHAT_ID"],
-        },
-        "wachter_oltp": {
-            "class": "opentelemetry.sdk._logs.LoggingHandler",
-            "level": logging.INFO,
-            "logger_provider": logger_provider,
-        },
-    },
-    "loggers": {
-        "wachter_telegram_logger": {
-            "level": "INFO",
-            "handlers": [
-                "wachter_telegram",
-                "wachter_oltp",
-            ],
-        }
-    },
-}
-
-config.dictConfig(log_config)
+meter = metrics.get_meter("logging.meter", version="2.0.0")
+dropped_counter = meter.create_counter(
+    "log_records_dropped", unit="1", description="Log records not forwarded"
+)
+
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    """
+    Parse per-level sampling rates, e.g. "DEBUG=0.01,INFO=0.5".
+
+    Args:
+    spec (str): Comma-separated LEVEL=rate pairs, the levels not listed are not sampled.
+
+    Returns:
+    Dict[int, float]: The rates by level number.
+    """
+    rates = {}
+    for pair in filter(None, spec.split(",")):
+        level, rate = pair.split("=")
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only the given share of the records of each level.
+    """
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        dropped_counter.add(1, {"reason": "sampled"})
+        return False
+
+
+class DedupFilter(logging.Filter):
+    """
+    Lets one record per call site and exception through every `window_s`; the next
+    one to get through tells how many were suppressed in between.
+    """
+
+    def __init__(self, window_s: float, max_keys: int = 1000):
+        super().__init__()
+        self.window_s = window_s
+        self.max_keys = max_keys
+        # key -> (time of the last record let through, records suppressed since)
+        self._seen: Dict[Hashable, list] = {}
+
+    @staticmethod
+    def _key(record: logging.LogRecord) -> Hashable:
+        key = (record.levelno, record.pathname, record.lineno)
+        if record.exc_info and record.exc_info[1] is not None:
+            tb = record.exc_info[2]
+            while tb is not None and tb.tb_next is not None:
+                tb = tb.tb_next
+            key += (
+                type(record.exc_info[1]).__name__,
+                tb.tb_frame.f_code.co_filename if tb else None,
+                tb.tb_lineno if tb else None,
+            )
+        return key
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = self._key(record)
+        now = time.monotonic()
+        seen = self._seen.get(key)
+        if seen is not None and now - seen[0] < self.window_s:
+            seen[1] += 1
+            dropped_counter.add(1, {"reason": "duplicate"})
+            return False
+        if seen is not None and seen[1]:
+            record.msg = f"{record.msg}\n({seen[1]} similar records suppressed)"
+        if len(self._seen) >= self.max_keys:
+            self._seen = {
+                k: v for k, v in self._seen.items() if now - v[0] < self.window_s
+            }
+        self._seen[key] = [now, 0]
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket of `rate_per_min` records per minute, with bursts of up to `burst`.
+    """
+
+    def __init__(self, rate_per_min: float, burst: int):
+        super().__init__()
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+        if self._tokens < 1:
+            self._suppressed += 1
+            dropped_counter.add(1, {"reason": "rate_limited"})
+            return False
+        self._tokens -= 1
+        if self._suppressed:
+            record.msg = (
+                f"{record.msg}\n({self._suppressed} records dropped by the rate limit)"
+            )
+            self._suppressed = 0
+        return True
+
+
+class AlertHandler(TelegramHandler):
+    """
+    TelegramHandler whose filters get a copy of the record: they annotate it with the
+    suppressed records, which is only meant for Telegram, and the other handlers get
+    the same record.
+    """
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        return super().handle(logging.makeLogRecord(record.__dict__))
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands the records over to the listener thread, dropping them if the queue is full
+    rather than blocking the caller.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the args may change after the call, but unlike QueueHandler.prepare the
+        # exception info is kept for the handlers, the queue never leaves the process
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_counter.add(1, {"reason": "queue_full"})
+
+
+def setup_logger(
+    name: str,
+    handlers: list,
+    level: str = constants.LOG_LEVEL,
+    queue_size: int = constants.LOG_QUEUE_SIZE,
+    sample_rates: Optional[Dict[int, float]] = None,
+) -> QueueListener:
+    """
+    Attach the handlers to the logger through a queue served by a background thread.
+
+    Args:
+    name (str): The name of the logger.
+    handlers (list): The handlers doing the actual, possibly blocking, output.
+    level (str): The level of the logger, records below it cost one comparison.
+    queue_size (int): The max number of records waiting for the handlers.
+    sample_rates (Optional[Dict[int, float]]): The share of the records to keep, by level.
+
+    Returns:
+    QueueListener: The started listener, to be stopped on exit.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    records = queue.Queue(maxsize=queue_size)
+    queue_handler = NonBlockingQueueHandler(records)
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+    logger.addHandler(queue_handler)
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+telegram_handler = AlertHandler(
+    token=os.environ["TELEGRAM_TOKEN"],
+    chat_id=os.environ["TELEGRAM_ERROR_CHAT_ID"],
+)
+# checked in this order, so duplicates don't use up the rate limit
+telegram_handler.addFilter(DedupFilter(constants.LOG_TELEGRAM_DEDUP_WINDOW_S))
+telegram_handler.addFilter(
+    RateLimitFilter(
+        constants.LOG_TELEGRAM_RATE_PER_MIN, constants.LOG_TELEGRAM_RATE_BURST
+    )
+)
+oltp_handler = LoggingHandler(level=logging.INFO, logger_provider=logger_provider)
+
+listener = setup_logger(
+    "wachter_telegram_logger",
+    [telegram_handler, oltp_handler],
+    sample_rates=parse_sample_rates(constants.LOG_SAMPLE_RATES),
+)
+# flushes the records still in the queue
+atexit.register(listener.stop)
 tg_logger = logging.getLogger("wachter_telegram_logger")
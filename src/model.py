@@ -1,12 +1,18 @@
 from sqlalchemy import create_engine
-from sqlalchemy import Column, Integer, Text, Boolean, BigInteger
+from sqlalchemy import Column, Integer, Text, Boolean, BigInteger, Float, JSON, Index
+from sqlalchemy import literal, literal_column, select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm.session import sessionmaker
 from contextlib import asynccontextmanager
+import time
+from typing import Iterable, Optional
+from opentelemetry.trace import SpanKind
 
 from src import constants
 from src.texts import _
+from src.tracing import tracer
 
 Base = declarative_base()
 
@@ -56,10 +62,18 @@ class Chat(Base):
         Text,
         nullable=False,
     )
+    join_burst_window = Column(
+        Integer,
+        nullable=False,
+        default=constants.default_join_burst_window_s,
+        server_default="0",
+    )
+    # when the settings were last changed in the admin menu, see ChatSettingsCache
+    settings_updated_at = Column(Float, nullable=True, index=True)
 
     def __repr__(self):
         return f"<Chat(id={self.id})>"
-    
+
     @classmethod
     def get_new_chat(cls, chat_id: int):
         chat = cls(id=chat_id)
@@ -74,6 +88,7 @@ class Chat(Base):
         chat.kick_timeout = constants.default_kick_timeout_m
         chat.notify_timeout = constants.default_notify_timeout_m
         chat.whois_length = constants.default_whois_length
+        chat.join_burst_window = constants.default_join_burst_window_s
         return chat
 
 
@@ -86,22 +101,239 @@ class User(Base):
     whois = Column(Text, nullable=False)
 
 
+class ChatAdmin(Base):
+    """
+    Index of the chats a user administers, so /start doesn't have to ask Telegram
+    about every chat the user has ever posted a #whois in.
+    """
+
+    __tablename__ = "chat_admins"
+
+    user_id = Column(BigInteger, primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
+
+    # negative entries are kept too, so that chats where the user is not an admin aren't probed again
+    is_admin = Column(Boolean, nullable=False)
+    title = Column(Text, nullable=True)
+    # unix timestamp of the last time the status was confirmed by Telegram
+    verified_at = Column(Float, nullable=False)
+
+    __table_args__ = (Index("ix_chat_admins_chat_id", "chat_id"),)
+
+    def __repr__(self):
+        return f"<ChatAdmin(chat_id={self.chat_id}, user_id={self.user_id}, is_admin={self.is_admin})>"
+
+
+class PersistenceEntry(Base):
+    """
+    One user_data, chat_data or conversation entry of the bot persistence, see src.persistence.
+    """
+
+    __tablename__ = "persistence"
+
+    kind = Column(Text, primary_key=True)
+    key = Column(Text, primary_key=True)
+    data = Column(JSON, nullable=False)
+    # unix timestamp
+    updated_at = Column(Float, nullable=False)
+
+    __table_args__ = (Index("ix_persistence_updated_at", "updated_at"),)
+
+    def __repr__(self):
+        return f"<PersistenceEntry(kind={self.kind}, key={self.key})>"
+
+
+class Deadline(Base):
+    __tablename__ = "deadlines"
+
+    id = Column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+        autoincrement=True,
+    )
+    chat_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    kind = Column(Text, nullable=False)
+
+    # unix timestamps
+    due_at = Column(Float, nullable=False)
+    created_at = Column(Float, nullable=False)
+    # set while a sweeper is processing the deadline, so it can be retried if the sweeper dies
+    claimed_until = Column(Float, nullable=True)
+
+    payload = Column(JSON, nullable=True)
+
+    __table_args__ = (
+        Index("ix_deadlines_due_at", "due_at"),
+        Index("ix_deadlines_chat_id_user_id", "chat_id", "user_id"),
+    )
+
+    def __repr__(self):
+        return f"<Deadline(id={self.id}, kind={self.kind}, chat_id={self.chat_id}, user_id={self.user_id})>"
+
+
+class ShardWorker(Base):
+    """
+    A worker process of a sharded deployment, alive while it keeps heartbeating, see src.sharding.
+    """
+
+    __tablename__ = "shard_workers"
+
+    id = Column(Text, primary_key=True)
+    # where the router forwards the updates of the chats of the worker
+    url = Column(Text, nullable=True)
+    # unix timestamp
+    heartbeat_at = Column(Float, nullable=False)
+    # rows inserted by the worker since it started, added up by the leader, see src.stats
+    chats_inserted = Column(Integer, nullable=False, server_default="0")
+    users_inserted = Column(Integer, nullable=False, server_default="0")
+    unique_users_inserted = Column(Integer, nullable=False, server_default="0")
+
+    def __repr__(self):
+        return f"<ShardWorker(id={self.id}, url={self.url})>"
+
+
+class ShardLease(Base):
+    """
+    A named duty held by one worker until expires_at, where advisory locks are not available.
+    """
+
+    __tablename__ = "shard_leases"
+
+    name = Column(Text, primary_key=True)
+    holder = Column(Text, nullable=False)
+    # unix timestamp
+    expires_at = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f"<ShardLease(name={self.name}, holder={self.holder})>"
+
+
 engine = create_async_engine(constants.get_uri(), echo=False)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
 @asynccontextmanager
 async def session_scope():
-    async with AsyncSessionLocal() as session:
-        try:
-            yield session
-            await session.commit()
-        except:
-            await session.rollback()
-            raise
-        finally:
-            await session.close()
+    with tracer.start_as_current_span("session_scope", kind=SpanKind.CLIENT):
+        async with AsyncSessionLocal() as session:
+            try:
+                yield session
+                await session.commit()
+            except:
+                await session.rollback()
+                raise
+            finally:
+                await session.close()
 
 
 def orm_to_dict(obj):
     return obj._asdict()
+
+
+def column_values(obj) -> dict:
+    """
+    Get the non-null column values of a mapped object, e.g. to insert it with a Core statement.
+    """
+    return {
+        column.name: getattr(obj, column.name)
+        for column in obj.__table__.columns
+        if getattr(obj, column.name) is not None
+    }
+
+
+def _insert(sess: AsyncSession, model):
+    # ON CONFLICT is dialect specific; only PostgreSQL and SQLite are used
+    if sess.bind.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+async def upsert(
+    sess: AsyncSession,
+    obj,
+    update_columns: Optional[Iterable[str]] = None,
+    return_inserted: bool = False,
+) -> Optional[bool]:
+    """
+    Insert a mapped object, or update the existing row with the same primary key,
+    with an INSERT ... ON CONFLICT DO UPDATE statement.
+
+    Args:
+    sess (AsyncSession): The session to execute the statement in.
+    obj: The mapped object to write; it is not added to the session.
+    update_columns (Optional[Iterable[str]]): The columns to update if the row exists,
+        all the non-null non-key columns of obj by default. If empty, an existing row is left as is.
+    return_inserted (bool): Whether to find out if the row was inserted, which costs
+        an extra statement on SQLite. Always done if update_columns is empty.
+
+    Returns:
+    Optional[bool]: True if a new row was inserted, False if an existing row was updated
+        or left as is, None if not asked for.
+    """
+    values = column_values(obj)
+    primary_key = [column.name for column in obj.__table__.primary_key.columns]
+    if update_columns is None:
+        update_columns = [name for name in values if name not in primary_key]
+    stmt = _insert(sess, type(obj)).values(**values)
+    if not update_columns:
+        result = await sess.execute(
+            stmt.on_conflict_do_nothing(index_elements=primary_key)
+        )
+        return result.rowcount > 0
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=primary_key,
+        set_={name: stmt.excluded[name] for name in update_columns},
+    )
+    if not return_inserted:
+        await sess.execute(stmt)
+        return None
+    if sess.bind.dialect.name == "postgresql":
+        # xmax is 0 only for a row version created by an insert
+        result = await sess.execute(stmt.returning(literal_column("xmax = 0")))
+        return result.scalar()
+    # SQLite can't tell an insert from an update
+    key = [getattr(type(obj), name) == values[name] for name in primary_key]
+    result = await sess.execute(select(literal(1)).where(*key))
+    existed = result.first() is not None
+    await sess.execute(stmt)
+    return not existed
+
+
+async def insert_if_missing(sess: AsyncSession, obj) -> bool:
+    """
+    Insert a mapped object with INSERT ... ON CONFLICT DO NOTHING.
+
+    Args:
+    sess (AsyncSession): The session to execute the statement in.
+    obj: The mapped object to insert; it is not added to the session.
+
+    Returns:
+    bool: True if the row was inserted, False if it already existed.
+    """
+    return await upsert(sess, obj, update_columns=())
+
+
+async def upsert_chat(sess: AsyncSession, chat: Chat) -> None:
+    """
+    Write the settings set on a partial Chat, e.g. Chat(id=1, kick_timeout=5).
+
+    The other settings of an existing chat are left as is, a missing chat is
+    created with the default settings.
+
+    Args:
+    sess (AsyncSession): The session to execute the statement in.
+    chat (Chat): The chat with only the changed settings set.
+
+    Returns:
+    None
+    """
+    changed = column_values(chat)
+    changed["settings_updated_at"] = time.time()
+    new_chat = Chat.get_new_chat(chat.id)
+    for name, value in changed.items():
+        setattr(new_chat, name, value)
+    await upsert(
+        sess, new_chat, update_columns=[name for name in changed if name != "id"]
+    )
@@ -0,0 +1,217 @@
+import asyncio
+import contextvars
+import itertools
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List
+
+from opentelemetry import metrics
+from telegram.error import RetryAfter
+
+from src import constants
+from src.logging import tg_logger
+
+
+class Priority(IntEnum):
+    # lower values are sent first
+    kick = 0
+    message = 1
+    delete = 2
+
+
+@dataclass
+class _Request:
+    chat_id: int
+    priority: Priority
+    call: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    per_chat_limit: bool
+    sequence: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+    retries: int = 0
+    # of the caller, so the call counts towards its handler and traces under its span
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+
+class OutboundDispatcher:
+    """
+    A single queue for the Bot API calls made by the handlers.
+
+    Requests are served by priority (kicks before messages before deletions) by a
+    pool of workers which keep to Telegram's global and per-chat rate limits and
+    retry after RetryAfter errors, pausing all the traffic meanwhile.
+
+    Until `start` is called requests are executed directly, e.g. in tests.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = constants.OUTBOUND_GLOBAL_RATE,
+        group_rate_per_min: float = constants.OUTBOUND_GROUP_RATE_PER_MIN,
+        private_rate: float = constants.OUTBOUND_PRIVATE_RATE,
+        workers: int = constants.OUTBOUND_WORKERS,
+        max_retries: int = constants.OUTBOUND_MAX_RETRIES,
+    ):
+        self.global_interval = 1 / global_rate
+        self.group_interval = 60 / group_rate_per_min
+        self.private_interval = 1 / private_rate
+        self.workers = workers
+        self.max_retries = max_retries
+
+        self._queue: asyncio.PriorityQueue = None
+        self._tasks: List[asyncio.Task] = []
+        self._sequence = itertools.count()
+        self._next_global_slot = 0.0
+        self._next_chat_slot: Dict[int, float] = {}
+        self._paused_until = 0.0
+        self._pending = 0
+
+        meter = metrics.get_meter("outbound.meter", version="2.0.0")
+        self._depth = meter.create_up_down_counter("outbound_queue_depth", unit="1")
+        self._wait_time = meter.create_histogram("outbound_wait_time", unit="s")
+        self._retry_counter = meter.create_counter("outbound_retry_after", unit="1")
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._queue is not None and not self._queue.empty():
+            *_, request = self._queue.get_nowait()
+            request.future.cancel()
+
+    @property
+    def pending(self) -> int:
+        """
+        The number of requests waiting to be sent, including the rate limited ones.
+        """
+        return self._pending
+
+    async def submit(
+        self,
+        chat_id: int,
+        priority: Priority,
+        call: Callable[[], Awaitable[Any]],
+        per_chat_limit: bool = True,
+    ) -> Any:
+        """
+        Queue a Bot API call and wait for its result.
+
+        Args:
+        chat_id (int): The ID of the chat the call is about, used for the per-chat limit.
+        priority (Priority): The priority of the call.
+        call (Callable[[], Awaitable[Any]]): A function making the actual API call.
+        per_chat_limit (bool): Whether the call counts against the per-chat message limit.
+
+        Returns:
+        Any: The result of the call.
+        """
+        if not self._tasks:
+            return await call()
+        request = _Request(
+            chat_id=chat_id,
+            priority=priority,
+            call=call,
+            future=asyncio.get_running_loop().create_future(),
+            per_chat_limit=per_chat_limit,
+            sequence=next(self._sequence),
+        )
+        self._track(request, 1)
+        self._enqueue(request)
+        return await request.future
+
+    def _track(self, request: _Request, delta: int) -> None:
+        self._pending += delta
+        self._depth.add(delta, {"priority": request.priority.name})
+
+    def _enqueue(self, request: _Request) -> None:
+        # the original sequence number keeps the order of requests within a chat
+        self._queue.put_nowait((request.priority, request.sequence, request))
+
+    def _reserve(self, request: _Request) -> float:
+        """
+        Reserve the next free global and per-chat slots for a request.
+
+        Returns:
+        float: The number of seconds to wait before the request may be sent.
+        """
+        now = time.monotonic()
+        slot = max(now, self._next_global_slot, self._paused_until)
+        if request.per_chat_limit:
+            interval = (
+                self.group_interval if request.chat_id < 0 else self.private_interval
+            )
+            self._next_chat_slot[request.chat_id] = slot + interval
+        self._next_global_slot = slot + self.global_interval
+        if len(self._next_chat_slot) > constants.OUTBOUND_MAX_TRACKED_CHATS:
+            self._next_chat_slot = {
+                chat_id: t for chat_id, t in self._next_chat_slot.items() if t > now
+            }
+        return slot - now
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            *_, request = await self._queue.get()
+            if request.future.cancelled():
+                self._track(request, -1)
+                continue
+            now = time.monotonic()
+            chat_slot = self._next_chat_slot.get(request.chat_id, 0.0)
+            if request.per_chat_limit and chat_slot > now:
+                # don't hold a worker while the chat is rate limited
+                loop.call_later(chat_slot - now, self._enqueue, request)
+                continue
+            self._track(request, -1)
+            delay = self._reserve(request)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._wait_time.record(
+                time.monotonic() - request.enqueued_at,
+                {"priority": request.priority.name},
+            )
+            await self._execute(request)
+
+    async def _call(self, request: _Request) -> Any:
+        # a task copies the context current when it's created; cancelling the worker
+        # cancels it too
+        return await request.context.run(lambda: asyncio.ensure_future(request.call()))
+
+    async def _execute(self, request: _Request) -> None:
+        try:
+            result = await self._call(request)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            self._retry_counter.add(1, {"priority": request.priority.name})
+            if request.retries >= self.max_retries:
+                if not request.future.cancelled():
+                    request.future.set_exception(e)
+                return
+            # flood control applies to the whole bot, so hold everything back
+            backoff = retry_after * (1 + request.retries)
+            self._paused_until = max(self._paused_until, time.monotonic() + backoff)
+            tg_logger.warning(
+                f"flood control for chat {request.chat_id}, retrying in {backoff}s"
+            )
+            request.retries += 1
+            self._track(request, 1)
+            self._enqueue(request)
+        except Exception as e:
+            if not request.future.cancelled():
+                request.future.set_exception(e)
+        else:
+            if not request.future.cancelled():
+                request.future.set_result(result)
+
+
+outbound = OutboundDispatcher()
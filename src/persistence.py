@@ -0,0 +1,281 @@
+import asyncio
+import json
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import delete, select
+from telegram.ext import Application, BasePersistence, ContextTypes, PersistenceInput
+
+from src import constants
+from src.model import PersistenceEntry, session_scope, upsert
+
+
+USER = "user"
+CHAT = "chat"
+
+_Key = Tuple[str, str]
+
+
+class SQLPersistence(BasePersistence):
+    """
+    Persistence of user_data, chat_data and conversations in the bot database,
+    one row per user, chat or conversation key.
+
+    PTB asks for all the data once on startup, so lazy loading is done in the
+    refresh hooks instead, which PTB calls before handling an update or running
+    a job: on startup only the keys which have stored data are read, and the data
+    of a key is read the first time its user or chat shows up.
+
+    Only entries whose data has changed since they were loaded or written are
+    written, all in one transaction per persistence update. Entries not used for
+    `ttl_s` are dropped from memory and from the database by `evict`.
+
+    With several workers a user or chat may be handled by another worker
+    meanwhile, so each worker calls `poll_changes` to read the entries written
+    elsewhere again on their next use, before they could be overwritten.
+    """
+
+    def __init__(
+        self, ttl_s: float = constants.PERSISTENCE_TTL_S, update_interval: float = 60
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.ttl_s = ttl_s
+        # keys with stored data which hasn't been read yet
+        self._unloaded: Dict[str, Set[str]] = defaultdict(set)
+        # hashes of the data as last read or written, to skip writing unchanged data
+        self._hashes: Dict[_Key, int] = {}
+        self._last_access: Dict[_Key, float] = {}
+        # None means the entry is to be deleted
+        self._pending: Dict[_Key, Optional[dict]] = {}
+        self._write_lock = asyncio.Lock()
+        self._polled_at = time.time()
+
+    async def _load_keys(self, kind: str) -> None:
+        async with session_scope() as sess:
+            result = await sess.execute(
+                select(PersistenceEntry.key).where(PersistenceEntry.kind == kind)
+            )
+            self._unloaded[kind] = set(result.scalars())
+
+    async def _refresh(self, kind: str, key: str, data: dict) -> None:
+        self._last_access[(kind, key)] = time.time()
+        if key not in self._unloaded[kind]:
+            return
+        async with session_scope() as sess:
+            result = await sess.execute(
+                select(PersistenceEntry.data).where(
+                    PersistenceEntry.kind == kind, PersistenceEntry.key == key
+                )
+            )
+            stored = result.scalar()
+        self._unloaded[kind].discard(key)
+        # what was loaded before is outdated, see poll_changes
+        data.clear()
+        if stored:
+            data.update(stored)
+            self._hashes[(kind, key)] = hash(json.dumps(stored, sort_keys=True))
+        else:
+            self._hashes.pop((kind, key), None)
+
+    async def _update(self, kind: str, key: str, data: Optional[dict]) -> None:
+        if key in self._unloaded[kind]:
+            # never read, so it can't have changed
+            return
+        data_hash = hash(json.dumps(data, sort_keys=True)) if data else None
+        if self._hashes.get((kind, key)) == data_hash:
+            return
+        self._pending[(kind, key)] = data or None
+        # PTB updates all the changed entries at once, let them all queue up
+        await asyncio.sleep(0)
+        await self._write_pending()
+
+    async def _write_pending(self) -> None:
+        async with self._write_lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            now = time.time()
+            try:
+                async with session_scope() as sess:
+                    for (kind, key), data in pending.items():
+                        if data is None:
+                            await sess.execute(
+                                delete(PersistenceEntry).where(
+                                    PersistenceEntry.kind == kind,
+                                    PersistenceEntry.key == key,
+                                )
+                            )
+                        else:
+                            await upsert(
+                                sess,
+                                PersistenceEntry(
+                                    kind=kind, key=key, data=data, updated_at=now
+                                ),
+                            )
+            except Exception:
+                for key, data in pending.items():
+                    self._pending.setdefault(key, data)
+                raise
+            for (kind, key), data in pending.items():
+                if data is None:
+                    self._hashes.pop((kind, key), None)
+                else:
+                    self._hashes[(kind, key)] = hash(json.dumps(data, sort_keys=True))
+
+    async def poll_changes(self) -> int:
+        """
+        Mark the user and chat entries written by another process since the last
+        poll to be read again on their next use.
+
+        Returns:
+        int: The number of entries marked.
+        """
+        # the clocks of the workers may be a bit apart
+        since = self._polled_at - constants.PERSISTENCE_POLL_MARGIN_S
+        self._polled_at = time.time()
+        async with session_scope() as sess:
+            result = await sess.execute(
+                select(
+                    PersistenceEntry.kind, PersistenceEntry.key, PersistenceEntry.data
+                ).where(
+                    PersistenceEntry.kind.in_([USER, CHAT]),
+                    PersistenceEntry.updated_at >= since,
+                )
+            )
+            rows = result.all()
+        marked = 0
+        for kind, key, data in rows:
+            if (kind, key) in self._pending:
+                continue
+            # written by this process
+            if self._hashes.get((kind, key)) == hash(json.dumps(data, sort_keys=True)):
+                continue
+            self._unloaded[kind].add(key)
+            marked += 1
+        return marked
+
+    def _drop(self, kind: str, key: str) -> None:
+        stored = key in self._unloaded[kind] or (kind, key) in self._hashes
+        self._unloaded[kind].discard(key)
+        self._last_access.pop((kind, key), None)
+        self._hashes.pop((kind, key), None)
+        # most of the users never had any data to store
+        if stored:
+            self._pending[(kind, key)] = None
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        await self._load_keys(USER)
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        await self._load_keys(CHAT)
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        async with session_scope() as sess:
+            result = await sess.execute(
+                select(PersistenceEntry.key, PersistenceEntry.data).where(
+                    PersistenceEntry.kind == f"conversation:{name}"
+                )
+            )
+            rows = result.all()
+        for key, data in rows:
+            self._hashes[(f"conversation:{name}", key)] = hash(
+                json.dumps(data, sort_keys=True)
+            )
+        return {tuple(json.loads(key)): data["state"] for key, data in rows}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._refresh(USER, str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._refresh(CHAT, str(chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self._update(USER, str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self._update(CHAT, str(chat_id), data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        await self._update(
+            f"conversation:{name}",
+            json.dumps(key),
+            {"state": new_state} if new_state is not None else None,
+        )
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._drop(USER, str(user_id))
+        await self._write_pending()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._drop(CHAT, str(chat_id))
+        await self._write_pending()
+
+    async def flush(self) -> None:
+        await self._write_pending()
+
+    async def evict(self, application: Application) -> None:
+        """
+        Drop the user and chat data not used for `ttl_s`, from memory and from the database.
+
+        Args:
+        application (Application): The application holding the data in memory.
+
+        Returns:
+        None
+        """
+        cutoff = time.time() - self.ttl_s
+        for (kind, key), last_access in list(self._last_access.items()):
+            if last_access >= cutoff:
+                continue
+            del self._last_access[(kind, key)]
+            # also deletes the stored data on the next persistence update
+            if kind == USER:
+                application.drop_user_data(int(key))
+            elif kind == CHAT:
+                application.drop_chat_data(int(key))
+
+        async with session_scope() as sess:
+            result = await sess.execute(
+                delete(PersistenceEntry)
+                .where(PersistenceEntry.updated_at < cutoff)
+                .returning(PersistenceEntry.kind, PersistenceEntry.key)
+                .execution_options(synchronize_session=False)
+            )
+            evicted = result.all()
+        for kind, key in evicted:
+            self._unloaded[kind].discard(key)
+            self._hashes.pop((kind, key), None)
+            if (kind, key) not in self._last_access:
+                continue
+            # written long ago but still in use, so write it back
+            data = (
+                application.user_data if kind == USER else application.chat_data
+            ).get(int(key))
+            if data:
+                self._pending[(kind, key)] = dict(data)
+        await self._write_pending()
+
+
+async def evict_persistence(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await context.application.persistence.evict(context.application)
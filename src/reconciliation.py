@@ -0,0 +1,382 @@
+import asyncio
+import itertools
+import math
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from opentelemetry import metrics
+from opentelemetry.metrics import CallbackOptions, Observation
+from sqlalchemy import delete, select, tuple_, update
+from telegram.ext import Application
+
+from src import constants
+from src.deadlines import (
+    CLAIMED_COLUMNS,
+    DELETE_MESSAGE,
+    KICK,
+    NOTIFY,
+    DeadlineSweeper,
+)
+from src.jobstore import WriteBehindJobStore
+from src.logging import tg_logger
+from src.model import Deadline, User, session_scope
+
+
+# the callbacks of the jobs scheduled before the deadlines table -> deadline kind
+LEGACY_JOBS = {
+    "on_kick_timeout": KICK,
+    "on_notify_timeout": NOTIFY,
+    "delete_message": DELETE_MESSAGE,
+}
+
+# Bot API calls per deadline: a kick bans, posts the kick message and may need
+# get_chat_member for the mention, a notification the last two
+API_CALLS = {KICK: 3, NOTIFY: 2}
+# delete_messages takes up to 100 messages
+DELETE_MESSAGES_PER_CALL = 100
+
+# (kind, chat_id, rows) run with one callback
+_Unit = Tuple[str, int, List]
+
+
+class StartupReconciler:
+    """
+    Replays the deadlines which came due while the bot was down without firing them
+    all at once: the overdue set is claimed on startup, before the sweeper starts,
+    and after `delay_s`, which leaves time to handle the updates queued meanwhile,
+    the kicks and notifications of the users with a recorded #whois are dropped
+    and the rest run through the sweeper's callbacks, interleaved across the chats
+    and paced to `api_budget_per_s` Bot API calls, the deletions of a chat batched.
+
+    Each batch is checked against the table before it's paced, so no budget is
+    spent on the deadlines cancelled while waiting, e.g. by a #whois, and the
+    sweeper skips those cancelled later, right before running them. The claim is renewed
+    while the replay lasts; if the bot stops, the rest is claimed again on the
+    next start once the lease runs out.
+
+    The overdue jobs of the job store from before the deadlines table are imported
+    as claimed deadlines and replayed the same way, on startup or, with several
+    workers, by `replay_legacy_jobs` when a worker becomes the leader.
+    """
+
+    def __init__(
+        self,
+        sweeper: DeadlineSweeper,
+        api_budget_per_s: float = constants.RECONCILE_API_BUDGET_PER_S,
+        delay_s: float = constants.RECONCILE_DELAY_S,
+        progress_interval_s: float = constants.RECONCILE_PROGRESS_INTERVAL_S,
+    ):
+        self.sweeper = sweeper
+        self.api_budget_per_s = api_budget_per_s
+        self.delay_s = delay_s
+        self.progress_interval_s = progress_interval_s
+        self.total = 0
+        self.replayed = 0
+        self.dropped = 0
+        self._next_call_at = 0.0
+        self._tasks: List[asyncio.Task] = []
+
+        meter = metrics.get_meter("reconciliation.meter", version="2.0.0")
+        self._counter = meter.create_counter("reconciled_deadlines", unit="1")
+        meter.create_observable_gauge(
+            "reconcile_pending", callbacks=[self._observe_pending], unit="1"
+        )
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.replayed - self.dropped
+
+    def _observe_pending(self, options: CallbackOptions):
+        if self._tasks:
+            yield Observation(self.pending)
+
+    async def import_legacy_jobs(self, store: WriteBehindJobStore) -> List[Deadline]:
+        """
+        Turn the overdue jobs of the job store into deadlines, claimed for the
+        replay, instead of letting them all fire on start.
+
+        Args:
+        store (WriteBehindJobStore): The job store, not started yet.
+
+        Returns:
+        List[Deadline]: The claimed deadlines.
+        """
+        now = time.time()
+        due = await asyncio.to_thread(store.pop_due_jobs, now, LEGACY_JOBS)
+        deadlines = []
+        for due_at, job in due:
+            data = job.data if isinstance(job.data, dict) else {}
+            if data.get("chat_id") is None:
+                continue
+            kind = LEGACY_JOBS[job.name]
+            if kind == DELETE_MESSAGE:
+                payload = {"message_id": data["message_id"]}
+            else:
+                payload = None
+            deadlines.append(
+                Deadline(
+                    chat_id=data["chat_id"],
+                    user_id=data.get("user_id") or 0,
+                    kind=kind,
+                    due_at=due_at,
+                    created_at=data.get("creation_time") or due_at,
+                    payload=payload,
+                    claimed_until=now + self.sweeper.lease_s,
+                )
+            )
+        if deadlines:
+            async with session_scope() as sess:
+                sess.add_all(deadlines)
+            tg_logger.info(f"Imported {len(deadlines)} overdue jobs as deadlines")
+        return deadlines
+
+    async def claim_overdue(self) -> List:
+        """
+        Claim all the deadlines due by now, so the sweeper leaves them to the replay.
+
+        Returns:
+        List: The claimed rows, with due_at.
+        """
+        now = time.time()
+        claimable = self.sweeper.claimable(now)
+        if claimable is None:
+            return []
+        async with session_scope() as sess:
+            result = await sess.execute(
+                update(Deadline)
+                .where(Deadline.id.in_(claimable))
+                .values(claimed_until=now + self.sweeper.lease_s)
+                .returning(*CLAIMED_COLUMNS, Deadline.due_at)
+                .execution_options(synchronize_session=False)
+            )
+            return result.all()
+
+    async def drop_obsolete(self, rows: List) -> List:
+        """
+        Delete the kicks and notifications of the users who introduced themselves.
+
+        Args:
+        rows (List): The claimed rows.
+
+        Returns:
+        List: The rows left to replay.
+        """
+        pairs = list(
+            {(row.chat_id, row.user_id) for row in rows if row.kind in (KICK, NOTIFY)}
+        )
+        introduced = set()
+        async with session_scope() as sess:
+            for i in range(0, len(pairs), 500):
+                result = await sess.execute(
+                    select(User.chat_id, User.user_id).where(
+                        tuple_(User.chat_id, User.user_id).in_(pairs[i : i + 500])
+                    )
+                )
+                introduced.update(tuple(pair) for pair in result.all())
+            obsolete = [
+                row.id
+                for row in rows
+                if row.kind in (KICK, NOTIFY)
+                and (row.chat_id, row.user_id) in introduced
+            ]
+            await self._delete(sess, obsolete)
+        self._count_dropped(len(obsolete))
+        obsolete = set(obsolete)
+        return [row for row in rows if row.id not in obsolete]
+
+    def interleave(self, rows: List) -> List[_Unit]:
+        """
+        Order the rows for the replay: each chat's in their due order, the chats
+        taking turns, so a chat with a long backlog doesn't hold the others back,
+        and the deletions of a chat together.
+
+        Args:
+        rows (List): The rows to replay.
+
+        Returns:
+        List[_Unit]: The units to run one after another.
+        """
+        by_chat: Dict[int, List[_Unit]] = defaultdict(list)
+        batches: Dict[Tuple[str, int], List] = {}
+        for row in sorted(rows, key=lambda row: row.due_at):
+            if row.kind in self.sweeper.batch_callbacks:
+                batch = batches.get((row.kind, row.chat_id))
+                if batch is None:
+                    batch = batches[(row.kind, row.chat_id)] = []
+                    by_chat[row.chat_id].append((row.kind, row.chat_id, batch))
+                batch.append(row)
+            else:
+                by_chat[row.chat_id].append((row.kind, row.chat_id, [row]))
+        return [
+            unit
+            for turn in itertools.zip_longest(*by_chat.values())
+            for unit in turn
+            if unit is not None
+        ]
+
+    @staticmethod
+    def api_calls(unit: _Unit) -> int:
+        kind, _, rows = unit
+        if kind == DELETE_MESSAGE:
+            return math.ceil(len(rows) / DELETE_MESSAGES_PER_CALL)
+        return API_CALLS.get(kind, 1) * len(rows)
+
+    async def _spend(self, calls: int) -> None:
+        # the calls are spread evenly, one unit at a time
+        now = time.monotonic()
+        start = max(now, self._next_call_at)
+        self._next_call_at = start + calls / self.api_budget_per_s
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    @staticmethod
+    async def _delete(sess, ids: List[int]) -> None:
+        for i in range(0, len(ids), 500):
+            await sess.execute(
+                delete(Deadline)
+                .where(Deadline.id.in_(ids[i : i + 500]))
+                .execution_options(synchronize_session=False)
+            )
+
+    async def _existing(self, ids: List[int]) -> set:
+        async with session_scope() as sess:
+            result = await sess.execute(select(Deadline.id).where(Deadline.id.in_(ids)))
+            return set(result.scalars().all())
+
+    async def _renew(self, ids: List[int]) -> None:
+        claimed_until = time.time() + self.sweeper.lease_s
+        async with session_scope() as sess:
+            for i in range(0, len(ids), 500):
+                await sess.execute(
+                    update(Deadline)
+                    .where(Deadline.id.in_(ids[i : i + 500]))
+                    .values(claimed_until=claimed_until)
+                    .execution_options(synchronize_session=False)
+                )
+
+    def _count_dropped(self, count: int) -> None:
+        if count:
+            self.dropped += count
+            self._counter.add(count, {"outcome": "obsolete"})
+
+    def _report(self) -> None:
+        eta_s = max(self._next_call_at - time.monotonic(), 0)
+        tg_logger.info(
+            f"Overdue deadlines: {self.replayed} replayed, {self.dropped} obsolete, "
+            f"{self.pending} of {self.total} left, ~{eta_s:.0f}s to go"
+        )
+
+    async def replay(self, application: Application, units: List[_Unit]) -> None:
+        """
+        Run the units in order within the API budget, a batch at a time.
+
+        Args:
+        application (Application): The application the callbacks are run for.
+        units (List[_Unit]): The units, see interleave.
+
+        Returns:
+        None
+        """
+        semaphore = asyncio.Semaphore(self.sweeper.concurrency)
+        renewed_at = reported_at = time.monotonic()
+
+        async def run(unit: _Unit) -> None:
+            kind, chat_id, rows = unit
+            async with semaphore:
+                if kind in self.sweeper.batch_callbacks:
+                    await self.sweeper.dispatch_batch(application, kind, chat_id, rows)
+                else:
+                    await self.sweeper.dispatch(application, rows[0])
+
+        for i in range(0, len(units), self.sweeper.batch_size):
+            if time.monotonic() - renewed_at > self.sweeper.lease_s / 2:
+                await self._renew([row.id for _, _, rows in units[i:] for row in rows])
+                renewed_at = time.monotonic()
+
+            batch = units[i : i + self.sweeper.batch_size]
+            claimed = [row.id for _, _, rows in batch for row in rows]
+            existing = await self._existing(claimed)
+            tasks = []
+            replayed = []
+            for kind, chat_id, rows in batch:
+                # cancelled since the claim
+                rows = [row for row in rows if row.id in existing]
+                if not rows:
+                    continue
+                unit = (kind, chat_id, rows)
+                await self._spend(self.api_calls(unit))
+                tasks.append(asyncio.create_task(run(unit)))
+                replayed.extend(row.id for row in rows)
+            # the sweeper deletes each deadline right before running it
+            await asyncio.gather(*tasks)
+
+            self._count_dropped(len(claimed) - len(replayed))
+            if replayed:
+                self.replayed += len(replayed)
+                self._counter.add(len(replayed), {"outcome": "replayed"})
+
+            if time.monotonic() - reported_at >= self.progress_interval_s:
+                self._report()
+                reported_at = time.monotonic()
+
+    async def run(self, application: Application, rows: List) -> None:
+        await asyncio.sleep(self.delay_s)
+        try:
+            rows = await self.drop_obsolete(rows)
+            await self.replay(application, self.interleave(rows))
+            self._report()
+        except Exception as e:
+            tg_logger.exception("replay of the overdue deadlines failed", exc_info=e)
+
+    def _begin(self, application: Application, rows: List) -> None:
+        if not rows:
+            return
+        self.total += len(rows)
+        tg_logger.info(
+            f"{len(rows)} deadlines are overdue, replaying them from "
+            f"{self.delay_s:.0f}s on at {self.api_budget_per_s} API calls/s"
+        )
+        self._tasks.append(asyncio.create_task(self.run(application, rows)))
+
+    async def start(
+        self, application: Application, store: Optional[WriteBehindJobStore] = None
+    ) -> None:
+        """
+        Claim the overdue deadlines, and the overdue jobs of `store`, and start
+        replaying them in the background. Must be awaited before the sweeper starts.
+
+        Args:
+        application (Application): The application the callbacks are run for.
+        store (Optional[WriteBehindJobStore]): The job store, not started yet.
+
+        Returns:
+        None
+        """
+        rows = []
+        if store is not None:
+            rows += await self.import_legacy_jobs(store)
+        rows += await self.claim_overdue()
+        self._begin(application, rows)
+
+    async def replay_legacy_jobs(
+        self, application: Application, store: WriteBehindJobStore
+    ) -> None:
+        """
+        Import the overdue jobs of `store` and replay them in the background within
+        the same budget, e.g. when a worker becomes the leader.
+
+        Args:
+        application (Application): The application the callbacks are run for.
+        store (WriteBehindJobStore): The job store, not started yet.
+
+        Returns:
+        None
+        """
+        self._begin(application, await self.import_legacy_jobs(store))
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
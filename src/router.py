@@ -0,0 +1,192 @@
+import asyncio
+import json
+import signal
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+from opentelemetry import metrics
+from telegram import Bot
+
+from src import constants
+from src.logging import tg_logger
+from src.sharding import HashRing, live_workers
+from src.webhook import SECRET_TOKEN_HEADER, STATUS_TEXTS, BaseWebhookServer
+
+
+# the updates with a chat, the others are ordered by their user
+CHAT_UPDATE_TYPES = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+
+
+def update_chat_id(data: dict) -> Optional[int]:
+    """
+    The ID the update is sharded by, the same as ordering_key but from the raw
+    JSON: the chat, or the user for the updates without one.
+
+    Args:
+    data (dict): The update as sent by Telegram.
+
+    Returns:
+    Optional[int]: The ID, None for the updates with neither.
+    """
+    for update_type in CHAT_UPDATE_TYPES:
+        if update_type in data:
+            return data[update_type]["chat"]["id"]
+    callback_query = data.get("callback_query")
+    if callback_query is not None:
+        if callback_query.get("message"):
+            return callback_query["message"]["chat"]["id"]
+        return callback_query["from"]["id"]
+    for value in data.values():
+        if isinstance(value, dict) and "from" in value:
+            return value["from"]["id"]
+    return None
+
+
+class UpdateRouter(BaseWebhookServer):
+    """
+    The webhook of a sharded deployment: forwards each update to the webhook of
+    the worker owning its chat, with the same secret token, and answers Telegram
+    with the status of the worker, so a worker's backpressure reaches Telegram.
+    While the owner is unreachable, e.g. until its row expires and the ring moves
+    its chats, the update is answered with 503 and Telegram retries it.
+    """
+
+    def __init__(
+        self,
+        secret_token: str,
+        host: str = constants.WEBHOOK_LISTEN,
+        port: int = constants.WEBHOOK_PORT,
+        path: str = constants.WEBHOOK_PATH,
+        refresh_s: float = constants.SHARD_HEARTBEAT_S,
+    ):
+        super().__init__(secret_token, host, port, path)
+        self.refresh_s = refresh_s
+        self.ring = HashRing([])
+        self.urls: Dict[str, str] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+        meter = metrics.get_meter("router.meter", version="2.0.0")
+        self._requests_counter = meter.create_counter("router_requests", unit="1")
+
+    async def refresh(self) -> None:
+        workers = await live_workers()
+        if set(workers) != self.ring.workers:
+            self.ring = HashRing(workers)
+            tg_logger.info(f"router: {len(workers)} workers")
+        self.urls = workers
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                tg_logger.exception("router refresh failed", exc_info=e)
+            await asyncio.sleep(self.refresh_s)
+
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(
+            timeout=constants.WEBHOOK_IDLE_TIMEOUT_S,
+            limits=httpx.Limits(max_connections=constants.WEBHOOK_MAX_CONNECTIONS),
+        )
+        await self.refresh()
+        self._task = asyncio.create_task(self._refresh_loop())
+        await super().start()
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def worker_url(self, data: dict) -> Optional[str]:
+        chat_id = update_chat_id(data)
+        if chat_id is None:
+            # no order to keep, any worker will do
+            return next(iter(self.urls.values()), None)
+        return self.urls.get(self.ring.owner(chat_id))
+
+    async def respond(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        status = self.check_request(method, path, headers)
+        if status is not None:
+            return status
+        try:
+            url = self.worker_url(json.loads(body))
+        except Exception:
+            self._requests_counter.add(1, {"outcome": "invalid"})
+            return 400
+        if url is None:
+            self._requests_counter.add(1, {"outcome": "no_worker"})
+            return 503
+        try:
+            response = await self._client.post(
+                url,
+                content=body,
+                headers={
+                    "Content-Type": "application/json",
+                    SECRET_TOKEN_HEADER: self.secret_token.decode(),
+                },
+            )
+        except httpx.HTTPError:
+            self._requests_counter.add(1, {"outcome": "unreachable"})
+            return 503
+        status = response.status_code
+        self._requests_counter.add(1, {"outcome": str(status)})
+        return status if status in STATUS_TEXTS else 503
+
+
+def run_router(
+    token: str,
+    url: str,
+    secret_token: str,
+    allowed_updates: Optional[List[str]] = None,
+    stop_signals: Sequence[int] = (signal.SIGINT, signal.SIGTERM),
+) -> None:
+    """
+    Set the webhook and route the updates to the workers until a stop signal.
+
+    Args:
+    token (str): The bot token.
+    url (str): The public URL Telegram sends the updates to.
+    secret_token (str): The token Telegram sends along with each update.
+    allowed_updates (Optional[List[str]]): The update types to subscribe to.
+    stop_signals (Sequence[int]): The signals which stop the router.
+
+    Returns:
+    None
+    """
+    router = UpdateRouter(secret_token)
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in stop_signals:
+            loop.add_signal_handler(sig, stop.set)
+
+        async with Bot(token) as bot:
+            await router.start()
+            try:
+                await bot.set_webhook(
+                    url,
+                    secret_token=secret_token,
+                    allowed_updates=allowed_updates,
+                    max_connections=constants.WEBHOOK_MAX_CONNECTIONS,
+                )
+                tg_logger.info(f"Routing updates from {router.host}:{router.port}")
+                await stop.wait()
+            finally:
+                await router.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,322 @@
+import asyncio
+import bisect
+import hashlib
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional
+
+from opentelemetry import metrics
+from opentelemetry.metrics import CallbackOptions, Observation
+from sqlalchemy import delete, func, or_, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src import constants
+from src.logging import tg_logger
+from src.model import ShardLease, ShardWorker, engine, session_scope, upsert
+
+
+LEADER = "leader"
+# pg_try_advisory_lock key of the leader, "wachter" in ASCII
+LEADER_LOCK_KEY = 0x77616368746572
+
+
+def chat_slot(chat_id: int) -> int:
+    """
+    The slot of a chat; slots, not chats, are assigned to the workers.
+
+    Args:
+    chat_id (int): The ID of the chat, or of the user for the updates without one.
+
+    Returns:
+    int: The slot, from 0 to SHARD_SLOTS - 1.
+    """
+    return abs(chat_id) % constants.SHARD_SLOTS
+
+
+def slot_expression(column):
+    """
+    chat_slot as an SQL expression, the same in PostgreSQL and SQLite.
+    """
+    return func.abs(column) % constants.SHARD_SLOTS
+
+
+def _hash(key: str) -> int:
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of the slots over the workers, each placed on the ring
+    `vnodes` times. When a worker joins or leaves, only the slots it takes or
+    leaves move, so the other workers keep their chats, caches and locks.
+    """
+
+    def __init__(self, workers: Iterable[str], vnodes: int = constants.SHARD_VNODES):
+        self.workers = frozenset(workers)
+        points = sorted(
+            (_hash(f"{worker}#{i}"), worker)
+            for worker in self.workers
+            for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+        self.slot_owners = [self._owner(slot) for slot in range(constants.SHARD_SLOTS)]
+
+    def _owner(self, slot: int) -> Optional[str]:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(str(slot))) % len(self._hashes)
+        return self._owners[i]
+
+    def owner(self, chat_id: int) -> Optional[str]:
+        return self.slot_owners[chat_slot(chat_id)]
+
+    def slots_of(self, worker: str) -> FrozenSet[int]:
+        return frozenset(
+            slot for slot, owner in enumerate(self.slot_owners) if owner == worker
+        )
+
+
+async def live_workers(ttl_s: float = constants.SHARD_WORKER_TTL_S) -> Dict[str, str]:
+    """
+    The workers which heartbeated within `ttl_s`. The workers and the router build
+    their rings from the same set: a worker the router can't reach owns nothing.
+
+    Returns:
+    Dict[str, str]: The URLs of the workers by their IDs.
+    """
+    async with session_scope() as sess:
+        result = await sess.execute(
+            select(ShardWorker.id, ShardWorker.url).where(
+                ShardWorker.heartbeat_at >= time.time() - ttl_s,
+                ShardWorker.url.is_not(None),
+                ShardWorker.url != "",
+            )
+        )
+        return {worker_id: url for worker_id, url in result.all()}
+
+
+class ShardCoordinator:
+    """
+    Membership and leadership of a worker of a sharded deployment.
+
+    Every `heartbeat_s` the worker refreshes its row in shard_workers, reads the
+    live workers and rebuilds the ring, and the slots of a worker that stopped
+    heartbeating move to the others once its row is `ttl_s` old: that's how the
+    deadlines of its chats fail over, as DeadlineSweeper claims only the deadlines
+    of `owned_slots`.
+
+    One worker is the leader, for the duties which must run once: on PostgreSQL
+    it's the one holding an advisory lock on a connection it keeps open, released
+    as soon as the worker dies; elsewhere, e.g. SQLite in local runs, a row in
+    shard_leases renewed with each heartbeat.
+    """
+
+    def __init__(
+        self,
+        worker_id: str = constants.SHARD_WORKER_ID,
+        url: str = constants.SHARD_WORKER_URL,
+        heartbeat_s: float = constants.SHARD_HEARTBEAT_S,
+        ttl_s: float = constants.SHARD_WORKER_TTL_S,
+    ):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.url = url
+        self.heartbeat_s = heartbeat_s
+        self.ttl_s = ttl_s
+        self.ring = HashRing([])
+        self.slots: FrozenSet[int] = frozenset()
+        self.is_leader = False
+        self._lock_connection: Optional[AsyncConnection] = None
+        self._leadership_callbacks: List[Callable[[bool], Awaitable[None]]] = []
+        self._heartbeat_callbacks: List[Callable[[], Awaitable[object]]] = []
+        self._task: Optional[asyncio.Task] = None
+
+        meter = metrics.get_meter("sharding.meter", version="2.0.0")
+        meter.create_observable_gauge(
+            "shard_owned_slots", callbacks=[self._observe_slots], unit="1"
+        )
+        meter.create_observable_gauge(
+            "shard_workers", callbacks=[self._observe_workers], unit="1"
+        )
+
+    def _observe_slots(self, options: CallbackOptions):
+        if self._task is not None:
+            yield Observation(len(self.slots))
+
+    def _observe_workers(self, options: CallbackOptions):
+        if self._task is not None and self.is_leader:
+            yield Observation(len(self.ring.workers))
+
+    def owned_slots(self) -> FrozenSet[int]:
+        return self.slots
+
+    def owns_chat(self, chat_id: int) -> bool:
+        return self.ring.owner(chat_id) == self.worker_id
+
+    def on_leadership(self, callback: Callable[[bool], Awaitable[None]]) -> None:
+        """
+        Register a callback run with True when the worker becomes the leader,
+        and with False when it stops being one.
+        """
+        self._leadership_callbacks.append(callback)
+
+    def on_heartbeat(self, callback: Callable[[], Awaitable[object]]) -> None:
+        """
+        Register a callback run after each heartbeat, e.g. to poll for the changes
+        made by the other workers.
+        """
+        self._heartbeat_callbacks.append(callback)
+
+    async def heartbeat(self) -> None:
+        """
+        Refresh the row of the worker, the ring and the leadership.
+        """
+        now = time.time()
+        async with session_scope() as sess:
+            await upsert(
+                sess, ShardWorker(id=self.worker_id, url=self.url, heartbeat_at=now)
+            )
+        workers = await live_workers(self.ttl_s)
+        # the worker is alive even if its clock is behind
+        workers.setdefault(self.worker_id, self.url)
+        if set(workers) != self.ring.workers:
+            self.ring = HashRing(workers)
+            self.slots = self.ring.slots_of(self.worker_id)
+            tg_logger.info(
+                f"{self.worker_id}: {len(workers)} workers, "
+                f"{len(self.slots)} slots owned"
+            )
+
+        is_leader = await self._elect()
+        if is_leader:
+            # the rows of the workers gone long ago
+            async with session_scope() as sess:
+                await sess.execute(
+                    delete(ShardWorker)
+                    .where(ShardWorker.heartbeat_at < now - 10 * self.ttl_s)
+                    .execution_options(synchronize_session=False)
+                )
+        await self._set_leader(is_leader)
+
+        for callback in self._heartbeat_callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                tg_logger.exception("heartbeat callback failed", exc_info=e)
+
+    async def _set_leader(self, is_leader: bool) -> None:
+        if is_leader == self.is_leader:
+            return
+        self.is_leader = is_leader
+        tg_logger.info(f"{self.worker_id}: leader {is_leader}")
+        for callback in self._leadership_callbacks:
+            try:
+                await callback(is_leader)
+            except Exception as e:
+                tg_logger.exception("leadership callback failed", exc_info=e)
+
+    async def _elect(self) -> bool:
+        if engine.dialect.name == "postgresql":
+            return await self._elect_advisory_lock()
+        return await self._elect_lease()
+
+    async def _elect_advisory_lock(self) -> bool:
+        if self._lock_connection is not None:
+            try:
+                await self._lock_connection.execute(text("SELECT 1"))
+                await self._lock_connection.commit()
+                return True
+            except Exception:
+                # the lock went away with the connection
+                await self._release_lock_connection()
+                return False
+        connection = await engine.connect()
+        try:
+            result = await connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": LEADER_LOCK_KEY}
+            )
+            locked = result.scalar()
+            # the lock is held by the session, not the transaction
+            await connection.commit()
+        except Exception:
+            await connection.close()
+            raise
+        if locked:
+            self._lock_connection = connection
+            return True
+        await connection.close()
+        return False
+
+    async def _release_lock_connection(self) -> None:
+        connection, self._lock_connection = self._lock_connection, None
+        if connection is not None:
+            try:
+                await connection.close()
+            except Exception:
+                pass
+
+    async def _elect_lease(self) -> bool:
+        now = time.time()
+        async with session_scope() as sess:
+            result = await sess.execute(
+                update(ShardLease)
+                .where(
+                    ShardLease.name == LEADER,
+                    or_(
+                        ShardLease.holder == self.worker_id,
+                        ShardLease.expires_at < now,
+                    ),
+                )
+                .values(holder=self.worker_id, expires_at=now + self.ttl_s)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                return True
+            lease = ShardLease(
+                name=LEADER, holder=self.worker_id, expires_at=now + self.ttl_s
+            )
+            return await upsert(sess, lease, update_columns=[])
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                tg_logger.exception("shard heartbeat failed", exc_info=e)
+            await asyncio.sleep(self.heartbeat_s)
+
+    async def start(self) -> None:
+        if not self.url:
+            # the router would send the updates of its chats to the other workers
+            raise ValueError("SHARD_WORKER_URL must be set for a worker")
+        # the slots are known before the first update is handled
+        await self.heartbeat()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop heartbeating and leave, so the other workers take over right away.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._set_leader(False)
+        await self._release_lock_connection()
+        async with session_scope() as sess:
+            await sess.execute(
+                delete(ShardWorker).where(ShardWorker.id == self.worker_id)
+            )
+            await sess.execute(
+                delete(ShardLease).where(
+                    ShardLease.name == LEADER, ShardLease.holder == self.worker_id
+                )
+            )
+
+
+shard_coordinator = ShardCoordinator()
@@ -0,0 +1,164 @@
+from typing import Dict, Optional
+
+from opentelemetry import metrics
+from opentelemetry.metrics import CallbackOptions, Observation
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from telegram.ext import ContextTypes
+
+from src.model import Chat, ShardWorker, User, session_scope
+
+
+CHATS = "chats"
+USERS = "users"
+UNIQUE_USERS = "unique_users"
+
+# the columns of shard_workers the inserts of each worker are published in
+INSERTED_COLUMNS = {
+    CHATS: ShardWorker.chats_inserted,
+    USERS: ShardWorker.users_inserted,
+    UNIQUE_USERS: ShardWorker.unique_users_inserted,
+}
+
+
+class DBStats:
+    """
+    Counts of chats, users and unique users, published as observable gauges.
+
+    The counts are loaded once by `reconcile` and then kept up to date by the code
+    writing the rows, so the full recount only needs to run occasionally to correct
+    the drift, e.g. from rows deleted by hand.
+
+    With several workers only the leader exports them, see leader_duties in app.py.
+    Each worker, with `worker_id` set, counts its own inserts and publishes them in
+    its shard_workers row on `sync`, and the leader adds up what the workers
+    inserted since its previous sync.
+    """
+
+    def __init__(self):
+        self.exported = True
+        self.worker_id: Optional[str] = None
+        self._counts: Dict[str, Optional[int]] = {
+            CHATS: None,
+            USERS: None,
+            UNIQUE_USERS: None,
+        }
+        # the inserts of this worker since it started
+        self._inserted: Dict[str, int] = {name: 0 for name in self._counts}
+        # the inserts of each worker as of the leader's previous sync
+        self._synced: Dict[str, Dict[str, int]] = {}
+        for name in self._counts:
+            meter = metrics.get_meter(f"{name}.meter", version="2.0.0")
+            meter.create_observable_gauge(
+                f"{name}_counter", callbacks=[self._observer(name)], unit="1"
+            )
+
+    def _observer(self, name: str):
+        def observe(options: CallbackOptions):
+            count = self._counts[name]
+            if count is not None and self.exported:
+                yield Observation(count)
+
+        return observe
+
+    def get(self, name: str) -> Optional[int]:
+        return self._counts[name]
+
+    def add(self, name: str, value: int = 1) -> None:
+        if self.worker_id is not None:
+            self._inserted[name] += value
+        # until the first reconciliation there is nothing to add to
+        elif self._counts[name] is not None:
+            self._counts[name] += value
+
+    def chat_inserted(self) -> None:
+        self.add(CHATS)
+
+    async def user_inserted(
+        self, sess: AsyncSession, user_id: int, chat_id: int
+    ) -> None:
+        """
+        Count a new users row, and a new unique user if the user is in no other chat.
+
+        Args:
+        sess (AsyncSession): The session the row was inserted in.
+        user_id (int): The ID of the user.
+        chat_id (int): The ID of the chat.
+
+        Returns:
+        None
+        """
+        self.add(USERS)
+        if self.worker_id is None and self._counts[UNIQUE_USERS] is None:
+            return
+        result = await sess.execute(
+            select(User.chat_id)
+            .where(User.user_id == user_id, User.chat_id != chat_id)
+            .limit(1)
+        )
+        if result.first() is None:
+            self.add(UNIQUE_USERS)
+
+    async def _publish(self, sess: AsyncSession) -> None:
+        await sess.execute(
+            update(ShardWorker)
+            .where(ShardWorker.id == self.worker_id)
+            .values(
+                {
+                    INSERTED_COLUMNS[name]: count
+                    for name, count in self._inserted.items()
+                }
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    async def _read_inserted(sess: AsyncSession) -> Dict[str, Dict[str, int]]:
+        result = await sess.execute(select(ShardWorker.id, *INSERTED_COLUMNS.values()))
+        return {
+            worker_id: dict(zip(INSERTED_COLUMNS, counts))
+            for worker_id, *counts in result.all()
+        }
+
+    async def sync(self) -> None:
+        """
+        Publish the inserts of this worker and, on the leader, add those of all the
+        workers made since the previous sync to the counts.
+        """
+        async with session_scope() as sess:
+            await self._publish(sess)
+            if not self.exported or self._counts[CHATS] is None:
+                return
+            inserted = await self._read_inserted(sess)
+        for worker_id, counts in inserted.items():
+            synced = self._synced.get(worker_id, {})
+            for name, count in counts.items():
+                previous = synced.get(name, 0)
+                # a worker restarted with the same ID counts from 0 again
+                self._counts[name] += count - previous if count >= previous else count
+        self._synced = inserted
+
+    async def reconcile(self) -> None:
+        """
+        Recount all the rows.
+        """
+        async with session_scope() as sess:
+            if self.worker_id is not None:
+                # the inserts published until now are in the recount
+                await self._publish(sess)
+                self._synced = await self._read_inserted(sess)
+            result = await sess.execute(select(func.count(Chat.id)))
+            chats = result.scalar()
+            result = await sess.execute(select(func.count()).select_from(User))
+            users = result.scalar()
+            result = await sess.execute(select(func.count(func.distinct(User.user_id))))
+            unique_users = result.scalar()
+        self._counts.update({CHATS: chats, USERS: users, UNIQUE_USERS: unique_users})
+
+
+db_stats = DBStats()
+
+
+async def reconcile_db_stats(context: ContextTypes.DEFAULT_TYPE) -> None:
+    if db_stats.exported:
+        await db_stats.reconcile()
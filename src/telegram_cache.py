@@ -0,0 +1,14 @@
+from src import constants
+from src.cache import AsyncTTLCache
+
+
+# chat titles shown in the admin menu, by chat_id
+chat_title_cache: AsyncTTLCache[str] = AsyncTTLCache(
+    "chat_title", constants.CHAT_TITLE_CACHE_SIZE, constants.CHAT_TITLE_CACHE_TTL_S
+)
+# whether a user is an admin of a chat, by (chat_id, user_id)
+admin_status_cache: AsyncTTLCache[bool] = AsyncTTLCache(
+    "admin_status",
+    constants.ADMIN_STATUS_CACHE_SIZE,
+    constants.ADMIN_STATUS_CACHE_TTL_S,
+)
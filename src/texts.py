@@ -26,6 +26,8 @@ _texts = {
     "msg__sucess_whois_length": "Обновил необходимую длину #whois.",
     "msg__failed_whois_response": "Длина должна быть целым положительным числом.",
     "msg__need_hashtag_update_response": "Сообщение должно содержать #update.",
+    "msg__sucess_join_burst_window": "Обновил окно объединения приветствий.",
+    "msg__failed_join_burst_window_response": "Окно должно быть целым неотрицательным числом.",
     "btn__intro": "Приветствия",
     "btn__kicks": "Удаление и блокировка",
     "btn__back_to_chats": "Назад к списку чатов",
@@ -37,6 +39,7 @@ _texts = {
     "btn__change_notify_timeout": "Изменить время напоминания",
     "btn__change_whois_length": "Изменить необходимую длину #whois",
     "btn__change_whois_message": "Изменить сообщение для обновления #whois",
+    "btn__change_join_burst_window": "Изменить окно объединения приветствий",
     "btn__back": "Назад",
     "btn__change_kick_timeout": "Изменить время до удаления",
     "btn__change_kick_message": "Изменить сообщение после удаления",
@@ -48,6 +51,7 @@ _texts = {
     "msg__set_new_whois_length": "Отправьте новую необходимую длину #whois (количество символов).",
     "msg__set_new_kick_message": "Отправьте новый текст сообщения после удаления. Используйте `%USER_MENTION%`, чтобы тегнуть адресата.",
     "msg__set_new_notify_timeout": "Отправьте новое время до напоминания в минутах.",
+    "msg__set_new_join_burst_window": "Отправьте новое окно объединения приветствий в секундах. Все, кто зайдет в чат за это время, получат одно общее приветствие, напоминание и сообщение об удалении. 0 — не объединять.",
     "msg__set_new_whois_message": "Отправьте новый текст сообщения для обновления #whois (должно содержать хэштег #update). Используйте `%USER_MENTION%`, чтобы тегнуть адресата.",
     "msg__get_intro_settings": """
 Выбран чат {chat_name}.
@@ -65,6 +69,8 @@ _texts = {
 Время до напоминания в минутах (целое положительное число): {notify_timeout}
 ---
 Сообщение для обновления информации в #whois: `{on_introduce_message_update}`
+---
+Окно объединения приветствий в секундах (0 — не объединять): {join_burst_window}
 """,
     "msg__get_kick_settings": """
 Выбран чат {chat_name}.
@@ -77,17 +83,19 @@ _texts = {
     "msg__skip_new_chat_member": "%SKIP%",
 }
 
+
 def escape_markdown(text):
     """
     Escapes special characters in a Markdown string to prevent Markdown rendering issues,
     excluding text within curly brackets.
-    
+
     Args:
         text (str): The input string that may contain special Markdown characters.
-        
+
     Returns:
         str: A string with special Markdown characters escaped, excluding text within curly brackets.
     """
+
     # Regex to find text outside curly brackets
     def escape_outside_braces(match):
         text_outside = match.group(1)
@@ -96,18 +104,21 @@ def escape_markdown(text):
             special_characters = r"([\\`*_{}\[\]()#+\-.!|>~^])"
             return re.sub(special_characters, r"\\\1", text_outside)
         return match.group(0)
-    
+
     # Match and process text outside curly brackets
-    escaped_text = re.sub(r"([^{}]+(?=\{)|(?<=\})([^{}]+)|^[^{]+|[^}]+$)", escape_outside_braces, text)
+    escaped_text = re.sub(
+        r"([^{}]+(?=\{)|(?<=\})([^{}]+)|^[^{]+|[^}]+$)", escape_outside_braces, text
+    )
     return escaped_text
 
+
 def _(text):
     """
     Retrieve and escape a predefined message text based on a unique key.
-    
+
     Args:
         text (str): A unique key representing the desired message.
-        
+
     Returns:
         str: The escaped message text associated with the input key, or None if not found.
     """
@@ -0,0 +1,73 @@
+from typing import Iterable, List, Optional
+
+from opentelemetry import trace
+from opentelemetry.propagate import extract, inject
+from opentelemetry.trace import Link, SpanKind
+from telegram import Update
+from telegram.ext import Application
+
+
+tracer = trace.get_tracer("wachter", "1.1.0")
+
+TRACEPARENT = "traceparent"
+
+
+def current_traceparent() -> Optional[str]:
+    """
+    The W3C traceparent of the current span, if it is sampled, to link later work to it.
+
+    Returns:
+    Optional[str]: The traceparent header value, or None.
+    """
+    if not trace.get_current_span().get_span_context().trace_flags.sampled:
+        return None
+    carrier = {}
+    inject(carrier)
+    return carrier.get(TRACEPARENT)
+
+
+def links_from(traceparents: Iterable[Optional[str]]) -> List[Link]:
+    """
+    Links to the spans the given traceparents were taken from.
+
+    Args:
+    traceparents (Iterable[Optional[str]]): Values returned by current_traceparent.
+
+    Returns:
+    List[Link]: One link per valid traceparent.
+    """
+    links = []
+    for traceparent in traceparents:
+        if not traceparent:
+            continue
+        span_context = trace.get_current_span(
+            extract({TRACEPARENT: traceparent})
+        ).get_span_context()
+        if span_context.is_valid:
+            links.append(Link(span_context))
+    return links
+
+
+def update_kind(update: object) -> str:
+    if not isinstance(update, Update):
+        return type(update).__name__
+    for kind in Update.ALL_TYPES:
+        if getattr(update, kind, None) is not None:
+            return kind
+    return "unknown"
+
+
+class TracedApplication(Application):
+    """
+    Application which wraps the handling of each update in a root span, so the
+    handlers, sessions and Bot API calls of the update become its children.
+    """
+
+    async def process_update(self, update: object) -> None:
+        attributes = {"update.kind": update_kind(update)}
+        if isinstance(update, Update) and update.effective_chat is not None:
+            attributes["chat.type"] = update.effective_chat.type
+        with tracer.start_as_current_span(
+            "update", kind=SpanKind.CONSUMER, attributes=attributes
+        ):
+            await super().process_update(update)
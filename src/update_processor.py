@@ -0,0 +1,131 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from opentelemetry import metrics
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from src import constants
+
+
+def ordering_key(update: object) -> Optional[Hashable]:
+    """
+    The key of the updates which must be handled one at a time, in order: the chat,
+    or the user for the updates without one. In a private chat both are the same.
+
+    Args:
+    update (object): The update.
+
+    Returns:
+    Optional[Hashable]: The key, None if the update can run at any time.
+    """
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes the updates of different chats concurrently, at most
+    `max_concurrent_updates` at a time, and the updates of one chat one by one in
+    the order they came in, so the handlers reading and then writing a chat's or
+    a user's rows don't race with each other.
+
+    An update first waits for the previous updates of its chat and only then for a
+    free slot, so the updates of one busy chat can't occupy all the slots while
+    waiting for each other. PTB's own limit is set to `max_pending_updates`, and
+    bounds the updates waiting here.
+
+    The updates `accept` returns False for are dropped before waiting for anything,
+    see update_routing.accept_update.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates: int = constants.UPDATE_CONCURRENCY,
+        max_pending_updates: int = constants.UPDATE_MAX_PENDING,
+        accept: Optional[Callable[[object], bool]] = None,
+    ):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.accept = accept
+        self.concurrency = max_concurrent_updates
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        # number of updates holding or waiting for each lock
+        self._lock_users: Dict[Hashable, int] = {}
+
+        meter = metrics.get_meter("update_processor.meter", version="2.0.0")
+        self._in_flight_counter = meter.create_up_down_counter(
+            "updates_in_flight", unit="1"
+        )
+        self._waiting_counter = meter.create_up_down_counter(
+            "updates_waiting", unit="1"
+        )
+        self._wait_time = meter.create_histogram("update_wait_time", unit="s")
+
+    async def initialize(self) -> None:
+        # created here, in the event loop of the application
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self) -> None:
+        pass
+
+    @asynccontextmanager
+    async def _ordered(self, key: Optional[Hashable]):
+        if key is None:
+            yield
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+            self._lock_users[key] = 0
+        self._lock_users[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._locks[key]
+                del self._lock_users[key]
+
+    async def do_process_update(
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        if self.accept is not None and not self.accept(update):
+            if hasattr(coroutine, "close"):
+                coroutine.close()
+            return
+        time_start = time.monotonic()
+        self.waiting += 1
+        self._waiting_counter.add(1)
+        waiting = True
+        try:
+            async with self._ordered(ordering_key(update)):
+                async with self._slots:
+                    waiting = False
+                    self.waiting -= 1
+                    self._waiting_counter.add(-1)
+                    self._wait_time.record(time.monotonic() - time_start)
+                    self.in_flight += 1
+                    self._in_flight_counter.add(1)
+                    try:
+                        await coroutine
+                    finally:
+                        self.in_flight -= 1
+                        self._in_flight_counter.add(-1)
+        finally:
+            if waiting:
+                self.waiting -= 1
+                self._waiting_counter.add(-1)
+                # cancelled before it could run
+                if hasattr(coroutine, "close"):
+                    coroutine.close()
@@ -0,0 +1,126 @@
+from typing import List
+
+from opentelemetry import metrics
+from telegram import Chat, MessageEntity, Update
+from telegram.ext import (
+    Application,
+    CallbackQueryHandler,
+    ChatMemberHandler,
+    CommandHandler,
+    MessageHandler,
+    TypeHandler,
+)
+
+
+# the routes of an update, see route
+ADMIN_INPUT = "admin_input"
+COMMAND = "command"
+HASHTAG = "hashtag"
+STATUS = "status"
+IGNORED = "ignored"
+OTHER = "other"
+
+GROUP_TYPES = (Chat.GROUP, Chat.SUPERGROUP)
+
+meter = metrics.get_meter("update_routing.meter", version="2.0.0")
+routed_counter = meter.create_counter("updates_routed", unit="1")
+dropped_counter = meter.create_counter("updates_dropped", unit="1")
+# created once, the counters are hit on every update
+_ROUTE_ATTRIBUTES = {
+    name: {"route": name}
+    for name in (ADMIN_INPUT, COMMAND, HASHTAG, STATUS, IGNORED, OTHER)
+}
+_DROPPED_ATTRIBUTES = {"reason": "group_chatter"}
+
+
+def _has_entity(message, entity_type: str) -> bool:
+    for entity in message.entities:
+        if entity.type == entity_type:
+            return True
+    return False
+
+
+def route(update: object) -> str:
+    """
+    Classify an update by what the bot does with it, looking only at the fields
+    already parsed: text in a private chat is admin menu input, and in a group
+    only commands, hashtags (#whois, #update) and the joins and title changes are
+    handled. Everything else written in a group is chatter the bot ignores.
+
+    Args:
+    update (object): The update.
+
+    Returns:
+    str: One of ADMIN_INPUT, COMMAND, HASHTAG, STATUS, IGNORED and OTHER.
+    """
+    message = update.effective_message if isinstance(update, Update) else None
+    if message is None:
+        return OTHER
+    if message.entities and _has_entity(message, MessageEntity.BOT_COMMAND):
+        return COMMAND
+    chat_type = message.chat.type
+    if chat_type == Chat.PRIVATE:
+        return ADMIN_INPUT if message.text is not None else OTHER
+    if chat_type not in GROUP_TYPES:
+        return OTHER
+    if message.text is not None:
+        if message.entities and _has_entity(message, MessageEntity.HASHTAG):
+            return HASHTAG
+        return IGNORED
+    if message.new_chat_members or message.new_chat_title:
+        return STATUS
+    return IGNORED
+
+
+def accept_update(update: object) -> bool:
+    """
+    Whether an update should be dispatched to the handlers at all. The group
+    chatter is counted as dropped and goes no further.
+
+    Args:
+    update (object): The update.
+
+    Returns:
+    bool: False for the updates nothing handles.
+    """
+    name = route(update)
+    routed_counter.add(1, _ROUTE_ATTRIBUTES[name])
+    if name == IGNORED:
+        dropped_counter.add(1, _DROPPED_ATTRIBUTES)
+        return False
+    return True
+
+
+def allowed_updates(application: Application) -> List[str]:
+    """
+    The update types the registered handlers can handle, to ask Telegram for only
+    those. TypeHandlers don't add any: they see whatever else comes.
+
+    Args:
+    application (Application): The application with all its handlers added.
+
+    Returns:
+    List[str]: The update types, all of them if some handler is not known here.
+    """
+    types = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, (CommandHandler, MessageHandler)):
+                # the bot isn't used in channels, so no channel posts
+                types.update((Update.MESSAGE, Update.EDITED_MESSAGE))
+            elif isinstance(handler, CallbackQueryHandler):
+                types.add(Update.CALLBACK_QUERY)
+            elif isinstance(handler, ChatMemberHandler):
+                if handler.chat_member_types in (
+                    ChatMemberHandler.MY_CHAT_MEMBER,
+                    ChatMemberHandler.ANY_CHAT_MEMBER,
+                ):
+                    types.add(Update.MY_CHAT_MEMBER)
+                if handler.chat_member_types in (
+                    ChatMemberHandler.CHAT_MEMBER,
+                    ChatMemberHandler.ANY_CHAT_MEMBER,
+                ):
+                    types.add(Update.CHAT_MEMBER)
+            elif not isinstance(handler, TypeHandler):
+                return list(Update.ALL_TYPES)
+    return sorted(types)
@@ -0,0 +1,37 @@
+from typing import Optional
+
+from telegram import Bot, User
+
+from src import constants
+from src.cache import TTLCache
+
+
+# user profiles seen in incoming updates, so mentions can be rendered without the API
+user_profile_cache: TTLCache[User] = TTLCache(
+    constants.USER_PROFILE_CACHE_SIZE, constants.USER_PROFILE_CACHE_TTL_S
+)
+
+
+def remember_user(user: Optional[User]) -> None:
+    if user is not None:
+        user_profile_cache.set(user.id, user)
+
+
+async def get_user(bot: Bot, chat_id: int, user_id: int) -> User:
+    """
+    Get a user profile, calling get_chat_member only if it is not cached.
+
+    Args:
+    bot (Bot): The Telegram bot instance.
+    chat_id (int): The ID of the chat the user is a member of.
+    user_id (int): The ID of the user.
+
+    Returns:
+    User: The user profile.
+    """
+    user = user_profile_cache.get(user_id)
+    if user is None:
+        chat_member = await bot.get_chat_member(chat_id, user_id)
+        user = chat_member.user
+        remember_user(user)
+    return user
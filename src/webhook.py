@@ -0,0 +1,303 @@
+import abc
+import asyncio
+import hmac
+import json
+import signal
+from typing import List, Optional, Sequence, Tuple
+
+from opentelemetry import metrics
+from opentelemetry.metrics import CallbackOptions, Observation
+from telegram import Update
+from telegram.ext import Application
+
+from src import constants
+from src.logging import tg_logger
+from src.update_processor import ChatOrderedUpdateProcessor
+
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY_SIZE = 1 << 20
+MAX_HEADERS = 100
+
+STATUS_TEXTS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+class BaseWebhookServer(abc.ABC):
+    """
+    HTTP server for the updates Telegram pushes to a webhook, over connections
+    Telegram keeps open. Requests to other paths, or without the secret token, are
+    refused; subclasses decide what happens to the updates in `respond`.
+    """
+
+    def __init__(
+        self,
+        secret_token: str,
+        host: str = constants.WEBHOOK_LISTEN,
+        port: int = constants.WEBHOOK_PORT,
+        path: str = constants.WEBHOOK_PATH,
+    ):
+        if not secret_token:
+            raise ValueError("the webhook needs a secret token")
+        self.secret_token = secret_token.encode()
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def sockets(self) -> list:
+        return self._server.sockets if self._server is not None else []
+
+    def check_request(self, method: str, path: str, headers: dict) -> Optional[int]:
+        """
+        Check the path, method and secret token of a request.
+
+        Args:
+        method (str): The HTTP method.
+        path (str): The request path.
+        headers (dict): The request headers, with lowercase names.
+
+        Returns:
+        Optional[int]: The HTTP status to refuse the request with, None if it's fine.
+        """
+        if path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        token = headers.get(SECRET_TOKEN_HEADER, "").encode()
+        if not hmac.compare_digest(token, self.secret_token):
+            return 403
+        return None
+
+    @abc.abstractmethod
+    async def respond(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        """
+        Handle a request which passed check_request.
+
+        Args:
+        method (str): The HTTP method.
+        path (str): The request path.
+        headers (dict): The request headers, with lowercase names.
+        body (bytes): The request body.
+
+        Returns:
+        int: The HTTP status to answer with.
+        """
+
+    async def _read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Optional[Tuple[str, str, dict, bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise ValueError("too many headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_SIZE:
+            return method, path, headers, None
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # Telegram keeps the connections open and sends one update after another
+        try:
+            while True:
+                request = await asyncio.wait_for(
+                    self._read_request(reader), constants.WEBHOOK_IDLE_TIMEOUT_S
+                )
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if body is None:
+                    status = 413
+                else:
+                    status = await self.respond(method, path, headers, body)
+                close = (
+                    status == 413 or headers.get("connection", "").lower() == "close"
+                )
+                response = (
+                    f"HTTP/1.1 {status} {STATUS_TEXTS[status]}\r\n"
+                    "Content-Length: 0\r\n"
+                    + ("Retry-After: 1\r\n" if status == 503 else "")
+                    + ("Connection: close\r\n" if close else "")
+                    + "\r\n"
+                )
+                writer.write(response.encode())
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError:
+            writer.write(
+                b"HTTP/1.1 400 Bad Request\r\n"
+                b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+            )
+        finally:
+            writer.close()
+
+
+class WebhookServer(BaseWebhookServer):
+    """
+    Webhook server putting the updates into the update queue of the application.
+
+    An update is accepted only while fewer than `max_pending` updates are queued or
+    being handled; otherwise the server answers 503, and Telegram keeps the update
+    and retries later, so a backlog builds up on Telegram's side rather than in
+    memory.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        secret_token: str,
+        host: str = constants.WEBHOOK_LISTEN,
+        port: int = constants.WEBHOOK_PORT,
+        path: str = constants.WEBHOOK_PATH,
+        max_pending: int = constants.WEBHOOK_MAX_PENDING,
+    ):
+        super().__init__(secret_token, host, port, path)
+        self.application = application
+        self.max_pending = max_pending
+
+        meter = metrics.get_meter("webhook.meter", version="2.0.0")
+        self._requests_counter = meter.create_counter("webhook_requests", unit="1")
+        meter.create_observable_gauge(
+            "webhook_backlog", callbacks=[self._observe_backlog], unit="1"
+        )
+
+    @property
+    def backlog(self) -> int:
+        """
+        The number of accepted updates not handled yet.
+        """
+        backlog = self.application.update_queue.qsize()
+        processor = self.application.update_processor
+        if isinstance(processor, ChatOrderedUpdateProcessor):
+            backlog += processor.waiting + processor.in_flight
+        return backlog
+
+    def _observe_backlog(self, options: CallbackOptions):
+        if self._server is not None:
+            yield Observation(self.backlog)
+
+    def handle_request(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        """
+        Check a webhook request and queue its update.
+
+        Args:
+        method (str): The HTTP method.
+        path (str): The request path.
+        headers (dict): The request headers, with lowercase names.
+        body (bytes): The request body.
+
+        Returns:
+        int: The HTTP status to answer with.
+        """
+        status = self.check_request(method, path, headers)
+        if status is not None:
+            if status == 403:
+                self._requests_counter.add(1, {"outcome": "forbidden"})
+            return status
+        if self.backlog >= self.max_pending:
+            self._requests_counter.add(1, {"outcome": "rejected"})
+            return 503
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception:
+            self._requests_counter.add(1, {"outcome": "invalid"})
+            return 400
+        self.application.update_queue.put_nowait(update)
+        self._requests_counter.add(1, {"outcome": "accepted"})
+        return 200
+
+    async def respond(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        return self.handle_request(method, path, headers, body)
+
+
+def run_webhook(
+    application: Application,
+    url: Optional[str],
+    secret_token: str,
+    allowed_updates: Optional[List[str]] = None,
+    stop_signals: Sequence[int] = (signal.SIGINT, signal.SIGTERM),
+) -> None:
+    """
+    Run the application on updates pushed to a webhook, with the same lifecycle
+    as `Application.run_polling`: initialize, post_init, start, and on a stop
+    signal stop, post_stop, shutdown, post_shutdown.
+
+    Args:
+    application (Application): The application to run.
+    url (Optional[str]): The public URL Telegram sends the updates to, ending with
+        WEBHOOK_PATH; None for a worker behind a router, which sets the webhook.
+    secret_token (str): The token Telegram sends along with each update.
+    allowed_updates (Optional[List[str]]): The update types to subscribe to.
+    stop_signals (Sequence[int]): The signals which stop the application.
+
+    Returns:
+    None
+    """
+    server = WebhookServer(application, secret_token)
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in stop_signals:
+            loop.add_signal_handler(sig, stop.set)
+
+        await application.initialize()
+        try:
+            if application.post_init:
+                await application.post_init(application)
+            if url:
+                await application.bot.set_webhook(
+                    url,
+                    secret_token=secret_token,
+                    allowed_updates=allowed_updates,
+                    max_connections=constants.WEBHOOK_MAX_CONNECTIONS,
+                )
+            await server.start()
+            await application.start()
+            tg_logger.info(f"Listening for updates on {server.host}:{server.port}")
+            await stop.wait()
+        finally:
+            await server.stop()
+            if application.running:
+                await application.stop()
+                if application.post_stop:
+                    await application.post_stop(application)
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+    asyncio.run(run())
@@ -0,0 +1,68 @@
+from unittest.mock import MagicMock
+
+from src.bounded_metrics import (
+    JOIN,
+    KICK,
+    OTHER,
+    BoundedCounter,
+    ChatEventCounters,
+    TopK,
+)
+
+
+def test_bounded_counter_drops_attributes():
+    counter = MagicMock()
+    bounded = BoundedCounter(counter, allowed_attributes=["priority"])
+
+    bounded.add(1, {"chat_id": -1, "priority": "kick"})
+    bounded.add(1, {"chat_id": -1})
+
+    assert counter.add.call_args_list[0].args == (1, {"priority": "kick"})
+    assert counter.add.call_args_list[1].args == (1, None)
+
+
+def test_top_k(mocker):
+    clock = mocker.patch("src.bounded_metrics.time.monotonic", return_value=0)
+    top = TopK(k=2, capacity=3, refresh_s=60)
+    for chat_id, amount in [(-1, 10), (-2, 5), (-3, 1), (-4, 1)]:
+        top.add(chat_id, amount)
+    # nothing is labelled before the first refresh
+    assert top.label(-1) == OTHER
+
+    clock.return_value = 60
+    top.add(-2, 10)
+    assert top.top == {-1, -2}
+    assert top.label(-1) == "-1"
+    assert top.label(-3) == OTHER
+
+
+def test_chat_event_counters(mocker):
+    clock = mocker.patch("src.bounded_metrics.time.monotonic", return_value=0)
+    events = ChatEventCounters(name="test_chat_events", k=1, refresh_s=60)
+
+    events.add(JOIN, -1, 5)
+    events.add(JOIN, -2)
+    clock.return_value = 60
+    events.add(KICK, -1)
+    events.add(JOIN, -2)
+
+    assert events.get(JOIN, OTHER) == 7
+    assert events.get(KICK, "-1") == 1
+    assert events.get(JOIN, "-2") == 0
+
+    # -2 takes over the top, -1 keeps its series
+    events.add(JOIN, -2, 100)
+    clock.return_value = 120
+    events.add(JOIN, -2)
+    assert events.get(JOIN, "-2") == 1
+    assert events.get(KICK, "-1") == 1
+
+    # only k retired series are kept
+    events.add(JOIN, -3, 1000)
+    clock.return_value = 180
+    events.add(JOIN, -3)
+    assert events.get(JOIN, "-3") == 1
+    assert events.get(JOIN, "-2") == 1
+    assert events.get(KICK, "-1") == 0
+    # its counts are moved to "other"
+    assert events.get(KICK, OTHER) == 1
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.burst import BurstCoalescer
+
+
+@pytest.mark.asyncio
+async def test_items_within_window_are_flushed_together():
+    coalescer = BurstCoalescer()
+    flushed = []
+
+    async def flush(items):
+        flushed.append(items)
+
+    for user_id in range(3):
+        coalescer.add((-1, "welcome"), user_id, 0.05, flush)
+    coalescer.add((-2, "welcome"), 10, 0.05, flush)
+    assert flushed == []
+
+    await asyncio.sleep(0.1)
+    assert sorted(flushed) == [[0, 1, 2], [10]]
+    assert (-1, "welcome") not in coalescer
+
+    # a new window is opened after the previous one is flushed
+    coalescer.add((-1, "welcome"), 3, 0.01, flush)
+    await asyncio.sleep(0.05)
+    assert flushed[-1] == [3]
+
+
+@pytest.mark.asyncio
+async def test_flush_all():
+    coalescer = BurstCoalescer()
+    flushed = []
+
+    async def flush(items):
+        flushed.append(items)
+
+    coalescer.add((-1, "kick"), 1, 3600, flush)
+    coalescer.add((-1, "kick"), 2, 3600, flush)
+    await coalescer.flush_all()
+    assert flushed == [[1, 2]]
@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+
+from src.cache import AsyncTTLCache
+
+
+@pytest.mark.asyncio
+async def test_concurrent_gets_are_coalesced():
+    cache = AsyncTTLCache("test", maxsize=10, ttl=60)
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "title"
+
+    assert (
+        await asyncio.gather(*(cache.get(-1, load) for _ in range(5))) == ["title"] * 5
+    )
+    assert await cache.get(-1, load) == "title"
+    assert len(calls) == 1
+    assert cache.stats() == {
+        "size": 1,
+        "hits": 1,
+        "misses": 1,
+        "coalesced": 4,
+        "invalidations": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_failures_are_not_cached():
+    cache = AsyncTTLCache("test", maxsize=10, ttl=60)
+
+    async def fail():
+        raise ValueError()
+
+    async def load():
+        return True
+
+    with pytest.raises(ValueError):
+        await cache.get(-1, fail)
+    assert await cache.get(-1, load) is True
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_load():
+    cache = AsyncTTLCache("test", maxsize=10, ttl=60)
+
+    async def load_old():
+        await asyncio.sleep(0.01)
+        return "old title"
+
+    async def load_new():
+        return "new title"
+
+    loading = asyncio.create_task(cache.get(-1, load_old))
+    await asyncio.sleep(0)
+    cache.invalidate(-1)
+    assert await loading == "old title"
+    # the value loaded before the invalidation is not kept
+    assert await cache.get(-1, load_new) == "new title"
@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy import select, update
+
+from src.cache import LRUCache
+from src.chat_settings import ChatSettingsCache
+from src.model import Chat, upsert_chat
+from src import constants
+
+
+@pytest.mark.asyncio
+async def test_read_through_and_invalidate(async_session, populate_db):
+    cache = ChatSettingsCache(maxsize=10)
+    settings = await cache.get(1)
+    assert settings.kick_timeout == 30
+
+    await async_session.execute(update(Chat).where(Chat.id == 1).values(kick_timeout=5))
+    await async_session.commit()
+
+    # served from the cache until invalidated
+    assert (await cache.get(1)).kick_timeout == 30
+    cache.invalidate(1)
+    assert (await cache.get(1)).kick_timeout == 5
+
+
+@pytest.mark.asyncio
+async def test_unknown_chat(async_session, populate_db):
+    cache = ChatSettingsCache(maxsize=10)
+    assert await cache.get(-100) is None
+
+    settings = await cache.get(-100, create=True)
+    assert settings.kick_timeout == constants.default_kick_timeout_m
+    result = await async_session.execute(select(Chat).where(Chat.id == -100))
+    assert result.scalars().first() is not None
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+    assert 1 in cache and 3 in cache
+    assert 2 not in cache
+
+
+@pytest.mark.asyncio
+async def test_changes_made_elsewhere_are_polled(async_session, populate_db):
+    cache = ChatSettingsCache(maxsize=10)
+    assert (await cache.get(1)).kick_timeout == 30
+    assert (await cache.get(2)).kick_timeout == 30
+
+    # another worker, with its own cache, changes the settings
+    await upsert_chat(async_session, Chat(id=1, kick_timeout=5))
+    await async_session.commit()
+
+    assert await cache.poll_changes() == 1
+    assert (await cache.get(1)).kick_timeout == 5
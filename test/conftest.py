@@ -14,10 +14,22 @@ with pytest.MonkeyPatch().context() as ctx:
     ctx.setattr("src.constants.get_uri", mock_get_uri)
     from src import constants
     from src.model import engine, User, Chat
+    from src.chat_settings import chat_settings_cache
+    from src.user_profiles import user_profile_cache
+    from src.telegram_cache import admin_status_cache, chat_title_cache
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
 
 
+@pytest.fixture(autouse=True)
+def reset_caches():
+    chat_settings_cache.clear()
+    user_profile_cache.clear()
+    admin_status_cache.clear()
+    chat_title_cache.clear()
+    yield
+
+
 @pytest.fixture
 def mock_update():
     callback_query = AsyncMock()
@@ -26,7 +38,7 @@ def mock_update():
     message_mock = MagicMock()
     message_mock.chat_id = 12345
     message_mock.message_id = 67890
-    message_mock.reply_text = AsyncMock()
+    message_mock.reply_text = AsyncMock(return_value=MagicMock(message_id=67891))
 
     update = AsyncMock()
     update.callback_query = callback_query
@@ -50,6 +62,11 @@ async def async_engine():
     async with engine.begin() as conn:
         await conn.execute(text("DROP TABLE IF EXISTS users;"))
         await conn.execute(text("DROP TABLE IF EXISTS chats;"))
+        await conn.execute(text("DROP TABLE IF EXISTS deadlines;"))
+        await conn.execute(text("DROP TABLE IF EXISTS chat_admins;"))
+        await conn.execute(text("DROP TABLE IF EXISTS persistence;"))
+        await conn.execute(text("DROP TABLE IF EXISTS shard_workers;"))
+        await conn.execute(text("DROP TABLE IF EXISTS shard_leases;"))
         await conn.execute(
             text(
                 """
@@ -65,7 +82,9 @@ async def async_engine():
                 kick_timeout INTEGER NOT NULL,
                 notify_timeout INTEGER NOT NULL,
                 whois_length INTEGER NOT NULL,
-                on_introduce_message_update TEXT NOT NULL
+                on_introduce_message_update TEXT NOT NULL,
+                join_burst_window INTEGER NOT NULL DEFAULT 0,
+                settings_updated_at FLOAT
             );
         """
             )
@@ -82,6 +101,74 @@ async def async_engine():
         """
             )
         )
+        await conn.execute(
+            text(
+                """
+            CREATE TABLE deadlines (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                due_at FLOAT NOT NULL,
+                created_at FLOAT NOT NULL,
+                claimed_until FLOAT,
+                payload JSON
+            );
+        """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+            CREATE TABLE chat_admins (
+                user_id INTEGER,
+                chat_id INTEGER,
+                is_admin BOOLEAN NOT NULL,
+                title TEXT,
+                verified_at FLOAT NOT NULL,
+                PRIMARY KEY (user_id, chat_id)
+            );
+        """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+            CREATE TABLE persistence (
+                kind TEXT,
+                key TEXT,
+                data JSON NOT NULL,
+                updated_at FLOAT NOT NULL,
+                PRIMARY KEY (kind, key)
+            );
+        """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+            CREATE TABLE shard_workers (
+                id TEXT PRIMARY KEY,
+                url TEXT,
+                heartbeat_at FLOAT NOT NULL,
+                chats_inserted INTEGER NOT NULL DEFAULT 0,
+                users_inserted INTEGER NOT NULL DEFAULT 0,
+                unique_users_inserted INTEGER NOT NULL DEFAULT 0
+            );
+        """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+            CREATE TABLE shard_leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at FLOAT NOT NULL
+            );
+        """
+            )
+        )
     return engine
 
 
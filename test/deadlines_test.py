@@ -0,0 +1,183 @@
+import time
+import pytest
+from unittest.mock import patch
+
+from sqlalchemy import select
+from telegram.ext import ApplicationBuilder
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.deadlines import (
+        DELETE_MESSAGE,
+        KICK,
+        NOTIFY,
+        DeadlineSweeper,
+        cancel_user_deadlines,
+        new_deadline,
+        reschedule_chat_deadlines,
+    )
+    from src.model import Deadline
+
+
+async def all_deadlines(async_session):
+    result = await async_session.execute(select(Deadline).order_by(Deadline.id))
+    return result.scalars().all()
+
+
+@pytest.mark.asyncio
+async def test_cancel_user_deadlines(async_session):
+    async_session.add_all(
+        [
+            new_deadline(-1, 1, KICK, 60),
+            new_deadline(-1, 1, DELETE_MESSAGE, 60, {"message_id": 10}),
+            new_deadline(-1, 2, KICK, 60),
+        ]
+    )
+    await async_session.commit()
+
+    removed = await cancel_user_deadlines(-1, 1)
+    assert sorted(row.kind for row in removed) == [DELETE_MESSAGE, KICK]
+    assert [d.user_id for d in await all_deadlines(async_session)] == [2]
+
+
+@pytest.mark.asyncio
+async def test_reschedule_chat_deadlines(async_session):
+    now = time.time()
+    async_session.add_all(
+        [
+            new_deadline(-1, 1, KICK, 60, created_at=now - 3600),
+            new_deadline(-1, 2, KICK, 60, created_at=now),
+            new_deadline(-1, 2, NOTIFY, 30, created_at=now),
+            new_deadline(-2, 3, KICK, 60, created_at=now),
+        ]
+    )
+    await async_session.commit()
+
+    await reschedule_chat_deadlines(-1, KICK, 600)
+
+    async_session.expire_all()
+    deadlines = await all_deadlines(async_session)
+    # already overdue with the new timeout, so it is due now
+    assert now <= deadlines[0].due_at <= time.time()
+    assert deadlines[1].due_at == pytest.approx(now + 600)
+    # other kinds and chats are left alone
+    assert deadlines[2].due_at == pytest.approx(now + 30)
+    assert deadlines[3].due_at == pytest.approx(now + 60)
+
+
+@pytest.mark.asyncio
+async def test_sweep_runs_due_deadlines(async_session):
+    calls = []
+
+    async def on_kick(context):
+        calls.append(context.job.data)
+
+    now = time.time()
+    async_session.add_all(
+        [
+            new_deadline(-1, 1, KICK, -10, created_at=now),
+            new_deadline(-1, 2, KICK, -5, created_at=now),
+            new_deadline(-1, 3, KICK, 600, created_at=now),
+        ]
+    )
+    await async_session.commit()
+
+    application = ApplicationBuilder().token("123:dummy").build()
+    sweeper = DeadlineSweeper({KICK: on_kick}, batch_size=1)
+
+    assert await sweeper.sweep(application) == 1
+    assert await sweeper.sweep(application) == 1
+    assert await sweeper.sweep(application) == 0
+
+    assert [call["user_id"] for call in calls] == [1, 2]
+    assert calls[0]["chat_id"] == -1
+    assert calls[0]["creation_time"] == pytest.approx(now)
+    assert [d.user_id for d in await all_deadlines(async_session)] == [3]
+
+
+@pytest.mark.asyncio
+async def test_claimed_deadlines_are_skipped_until_lease_expires(async_session):
+    async_session.add(new_deadline(-1, 1, KICK, -10))
+    await async_session.commit()
+
+    sweeper = DeadlineSweeper({}, lease_s=300)
+    assert len(await sweeper.claim()) == 1
+    assert await sweeper.claim() == []
+
+    async_session.expire_all()
+    (deadline,) = await all_deadlines(async_session)
+    deadline.claimed_until = time.time() - 1
+    await async_session.commit()
+    assert len(await sweeper.claim()) == 1
+
+
+@pytest.mark.asyncio
+async def test_sweep_groups_batch_deadlines_per_chat(async_session):
+    batches = []
+
+    async def on_delete(application, chat_id, deadlines):
+        batches.append((chat_id, sorted(d.payload["message_id"] for d in deadlines)))
+
+    async_session.add_all(
+        [
+            new_deadline(-1, 1, DELETE_MESSAGE, -10, {"message_id": 1}),
+            new_deadline(-1, 2, DELETE_MESSAGE, -10, {"message_id": 2}),
+            new_deadline(-2, 1, DELETE_MESSAGE, -10, {"message_id": 3}),
+        ]
+    )
+    await async_session.commit()
+
+    application = ApplicationBuilder().token("123:dummy").build()
+    sweeper = DeadlineSweeper({}, batch_callbacks={DELETE_MESSAGE: on_delete})
+    assert await sweeper.sweep(application) == 3
+    assert sorted(batches) == [(-2, [3]), (-1, [1, 2])]
+
+
+@pytest.mark.asyncio
+async def test_deadline_cancelled_after_claim_does_not_run(async_session):
+    calls = []
+
+    async def on_kick(context):
+        calls.append(context.job.data["user_id"])
+
+    async def on_delete(application, chat_id, deadlines):
+        calls.extend(d.payload["message_id"] for d in deadlines)
+
+    async_session.add_all(
+        [
+            new_deadline(-1, 1, KICK, -10),
+            new_deadline(-1, 2, KICK, -10),
+            new_deadline(-1, 1, DELETE_MESSAGE, -10, {"message_id": 10}),
+            new_deadline(-1, 2, DELETE_MESSAGE, -10, {"message_id": 20}),
+        ]
+    )
+    await async_session.commit()
+
+    application = ApplicationBuilder().token("123:dummy").build()
+    sweeper = DeadlineSweeper(
+        {KICK: on_kick}, batch_callbacks={DELETE_MESSAGE: on_delete}
+    )
+    claimed = await sweeper.claim()
+    # user 1 introduces themselves while the kick is pending
+    await cancel_user_deadlines(-1, 1)
+
+    for deadline in claimed:
+        if deadline.kind == KICK:
+            await sweeper.dispatch(application, deadline)
+    await sweeper.dispatch_batch(
+        application, DELETE_MESSAGE, -1, [d for d in claimed if d.kind != KICK]
+    )
+    assert calls == [2, 20]
+    assert await all_deadlines(async_session) == []
+
+
+def test_bucketed_due_time():
+    deadline = new_deadline(-1, 1, DELETE_MESSAGE, 100, created_at=1010, bucket_s=60)
+    assert deadline.due_at == 1140
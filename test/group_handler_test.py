@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from sqlalchemy import select
 from unittest.mock import patch
@@ -12,14 +13,20 @@ with patch.dict(
         "DEPLOYMENT_ENVIRONMENT": "testing",
     },
 ):
-    from src.handlers.group.group_handler import on_hashtag_message
-    from src.model import User, Chat
+    from src.handlers.group.group_handler import (
+        on_hashtag_message,
+        on_new_chat_members,
+        delete_messages,
+        wait_pending_sends,
+        _send_markdown_with_deletion,
+    )
+    from src.model import User, Chat, Deadline
 from src.texts import _
 
 from telegram.constants import ParseMode
 
 
-async def mock_mention_markdown(bot, chat_id, user_id, message):
+async def mock_mention_markdown(bot, chat_id, user_id, message, user=None):
     # Replace %USER_MENTION% with a default string
     return message.replace("%USER_MENTION%", "@example_user")
 
@@ -50,6 +57,7 @@ async def test_on_hashtag_message_new_user(
     )
 
     await on_hashtag_message(mock_update, mock_context)
+    await wait_pending_sends()
 
     # Check if the reply message was sent
     assert mock_update.effective_message.reply_text.await_count == 1
@@ -85,6 +93,7 @@ async def test_on_hashtag_message_short_whois(
     )
 
     await on_hashtag_message(mock_update, mock_context)
+    await wait_pending_sends()
 
     async with async_session as session:
         try:
@@ -106,3 +115,142 @@ async def test_on_hashtag_message_short_whois(
     assert (
         actual_reply == expected_reply
     ), f"Assertion failed: Expected reply text '{expected_reply}' but got '{actual_reply}'."
+
+
+@pytest.mark.asyncio
+async def test_delete_messages_batches_and_falls_back(mock_context):
+    bot = mock_context.bot
+    bot.delete_messages.side_effect = [True, Exception("can't delete")]
+
+    await delete_messages(bot, -1, list(range(150)))
+
+    assert [call.args[1] for call in bot.delete_messages.await_args_list] == [
+        list(range(100)),
+        list(range(100, 150)),
+    ]
+    # only the failed batch is retried message by message
+    assert bot.delete_message.await_count == 50
+
+
+@pytest.mark.asyncio
+async def test_update_not_held_by_queued_message(mock_context, async_session, mocker):
+    sent = asyncio.Event()
+
+    async def submit(chat_id, priority, call):
+        # e.g. behind the greetings of a join raid
+        await sent.wait()
+        return await call()
+
+    mocker.patch("src.handlers.group.group_handler.outbound.submit", side_effect=submit)
+    mock_context.bot.send_message.return_value = mocker.MagicMock(message_id=7)
+
+    await _send_markdown_with_deletion(mock_context.bot, -1, 1, "hi")
+    assert mock_context.bot.send_message.await_count == 0
+
+    sent.set()
+    await wait_pending_sends()
+    assert mock_context.bot.send_message.await_count == 1
+    result = await async_session.execute(
+        select(Deadline.user_id, Deadline.payload).where(
+            Deadline.kind == "delete_message"
+        )
+    )
+    ((user_id, payload),) = result.all()
+    assert (user_id, payload["message_id"]) == (1, 7)
+
+
+@pytest.mark.asyncio
+async def test_messages_within_burst_window_are_merged(mock_context, mocker):
+    from src.chat_settings import ChatSettings
+    from src.handlers.group.group_handler import _send_or_coalesce, burst_coalescer
+
+    chat = ChatSettings(
+        id=-1,
+        on_new_chat_member_message="hi %USER_MENTION%",
+        on_known_new_chat_member_message="",
+        on_introduce_message="",
+        on_kick_message="",
+        notify_message="",
+        kick_timeout=0,
+        notify_timeout=0,
+        whois_length=0,
+        on_introduce_message_update="",
+        join_burst_window=3600,
+    )
+    mocker.patch(
+        "src.handlers.group.group_handler.constants.MAX_MENTIONS_PER_MESSAGE", 2
+    )
+    schedule_deadline = mocker.patch(
+        "src.handlers.group.group_handler.schedule_deadline"
+    )
+    users = []
+    for user_id in range(3):
+        user = mocker.MagicMock()
+        user.mention_markdown_v2.return_value = f"@user{user_id}"
+        users.append(user)
+        await _send_or_coalesce(
+            mock_context, chat, user_id, chat.on_new_chat_member_message, user=user
+        )
+    assert mock_context.bot.send_message.await_count == 0
+
+    await burst_coalescer.flush_all()
+    await wait_pending_sends()
+    assert [
+        call.kwargs["text"] for call in mock_context.bot.send_message.await_args_list
+    ] == ["hi @user0, @user1", "hi @user2"]
+    # shared messages are not deleted by a single user's #whois
+    assert [call.args[1] for call in schedule_deadline.await_args_list] == [0, 0]
+
+
+@pytest.mark.asyncio
+async def test_on_new_chat_members(
+    mock_update, mock_context, async_session, populate_db, mocker
+):
+    # chat 2 knows user 1 but not user 5
+    chat_id = 2
+    mock_update.message.chat_id = chat_id
+    mock_update.message.reply_text.return_value = mocker.MagicMock(message_id=1)
+    mock_update.message.new_chat_members = [
+        mocker.MagicMock(id=1),
+        mocker.MagicMock(id=5),
+    ]
+    mocker.patch(
+        "src.handlers.group.group_handler._mention_markdown",
+        side_effect=mock_mention_markdown,
+    )
+
+    await on_new_chat_members(mock_update, mock_context)
+    await wait_pending_sends()
+
+    replies = sorted(
+        call.kwargs["text"] for call in mock_update.message.reply_text.await_args_list
+    )
+    assert replies == ["Message for known members in Chat 2", "Welcome to Chat 2"]
+    result = await async_session.execute(
+        select(Deadline.user_id, Deadline.kind).where(Deadline.kind != "delete_message")
+    )
+    assert sorted(result.all()) == [(5, "kick"), (5, "notify")]
+    result = await async_session.execute(
+        select(Deadline.user_id).where(Deadline.kind == "delete_message")
+    )
+    assert sorted(result.scalars()) == [1, 5]
+
+
+@pytest.mark.asyncio
+async def test_on_new_chat_members_creates_chat(
+    mock_update, mock_context, async_session, mocker
+):
+    mock_update.message.chat_id = -42
+    mock_update.message.reply_text.return_value = mocker.MagicMock(message_id=1)
+    mock_update.message.new_chat_members = [mocker.MagicMock(id=5)]
+    mocker.patch(
+        "src.handlers.group.group_handler._mention_markdown",
+        side_effect=mock_mention_markdown,
+    )
+
+    await on_new_chat_members(mock_update, mock_context)
+    await wait_pending_sends()
+
+    result = await async_session.execute(select(Chat).where(Chat.id == -42))
+    chat = result.scalars().one()
+    assert chat.on_new_chat_member_message == _("msg__new_chat_member")
@@ -79,3 +79,52 @@ async def test_make_bot_admin(mock_context, async_session):
         ],
         any_order=True,
     )
+
+
+@pytest.mark.asyncio
+async def test_chat_member_promotion(mock_context, async_session):
+    from sqlalchemy import select
+    from src.handlers.group.chat_member_handler import chat_member_handler
+    from src.model import ChatAdmin
+
+    mock_update = AsyncMock()
+    mock_update.effective_chat.id = -1000
+    mock_update.effective_chat.title = "title"
+    mock_update.chat_member.new_chat_member.user.id = 1001
+    for old_status, new_status in [
+        (ChatMember.MEMBER, ChatMember.ADMINISTRATOR),
+        (ChatMember.ADMINISTRATOR, ChatMember.MEMBER),
+    ]:
+        mock_update.chat_member.old_chat_member.status = old_status
+        mock_update.chat_member.new_chat_member.status = new_status
+        await chat_member_handler(mock_update, mock_context)
+        result = await async_session.execute(
+            select(ChatAdmin.is_admin, ChatAdmin.title).where(ChatAdmin.user_id == 1001)
+        )
+        assert result.one() == (new_status == ChatMember.ADMINISTRATOR, "title")
+
+
+@pytest.mark.asyncio
+async def test_bot_removed_invalidates_caches(mock_context, async_session):
+    from src.telegram_cache import admin_status_cache, chat_title_cache
+
+    chat_title_cache.set(-1000, "title")
+    chat_title_cache.set(-2000, "other")
+    admin_status_cache.set((-1000, 1001), True)
+    admin_status_cache.set((-2000, 1001), True)
+
+    mock_update = AsyncMock()
+    mock_update.effective_chat.id = -1000
+    mock_update.my_chat_member.difference = lambda: {
+        "status": (ChatMember.ADMINISTRATOR, ChatMember.LEFT)
+    }
+    await my_chat_member_handler(mock_update, mock_context)
+
+    async def load():
+        return None
+
+    assert await chat_title_cache.get(-1000, load) is None
+    assert await admin_status_cache.get((-1000, 1001), load) is None
+    # the other chats are left alone
+    assert await chat_title_cache.get(-2000, load) == "other"
+    assert await admin_status_cache.get((-2000, 1001), load) is True
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.health import GAUGES, HealthMonitor
+    from src.update_processor import ChatOrderedUpdateProcessor
+from src.model import Deadline, session_scope
+
+
+def make_application(pending_updates=0):
+    application = MagicMock()
+    application.update_queue = asyncio.Queue()
+    for update_id in range(pending_updates):
+        application.update_queue.put_nowait(update_id)
+    application.job_queue.jobs.return_value = []
+    return application
+
+
+async def get(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    response = (await reader.read()).decode()
+    writer.close()
+    head, body = response.split("\r\n\r\n", 1)
+    return head.split("\r\n")[0], body
+
+
+@pytest.mark.asyncio
+async def test_sample_and_endpoints(async_engine):
+    async with session_scope() as sess:
+        sess.add(
+            Deadline(
+                chat_id=-1, user_id=1, kind="kick", due_at=time.time() - 1, created_at=0
+            )
+        )
+    monitor = HealthMonitor(port=0)
+    server = await asyncio.start_server(monitor._handle_connection, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    status, body = await get(port, "/healthz")
+    assert status == "HTTP/1.1 503 Service Unavailable"
+    assert json.loads(body)["problems"] == ["not sampled yet"]
+
+    await monitor.sample(make_application(pending_updates=3))
+    status, body = await get(port, "/healthz")
+    assert status == "HTTP/1.1 200 OK"
+    health = json.loads(body)
+    assert health["pending_updates"] == 3
+    assert health["deadlines_due"] == 1
+    assert health["db_up"] == 1
+
+    status, body = await get(port, "/metrics")
+    assert status == "HTTP/1.1 200 OK"
+    assert "# TYPE wachter_pending_updates gauge\nwachter_pending_updates 3\n" in body
+
+    status, _ = await get(port, "/other")
+    assert status == "HTTP/1.1 404 Not Found"
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_update_processor_gauges_named_apart(async_engine):
+    application = make_application()
+    application.update_processor = ChatOrderedUpdateProcessor()
+    monitor = HealthMonitor(port=0)
+    await monitor.sample(application)
+    assert monitor.values["health_updates_in_flight"] == 0
+    # the processor exports updates_in_flight and updates_waiting itself
+    assert not {"updates_in_flight", "updates_waiting"} & set(GAUGES)
+
+
+@pytest.mark.asyncio
+async def test_unhealthy_on_loop_lag(async_engine):
+    monitor = HealthMonitor(port=0, probe_interval_s=0.01, max_lag_s=0.05)
+    await monitor.start(make_application())
+    await asyncio.sleep(0.05)
+    # blocks the event loop
+    time.sleep(0.1)
+    await asyncio.sleep(0.05)
+
+    assert monitor.problems() == [f"event loop lag {monitor._max_lag:.2f}s"]
+    await monitor.stop()
@@ -0,0 +1,120 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from sqlalchemy import text
+from telegram.request import HTTPXRequest
+
+from src.instrumentation import (
+    InstrumentedHTTPXRequest,
+    instrument_engine,
+    instrumented,
+)
+from src.model import engine, session_scope
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.outbound import OutboundDispatcher, Priority
+
+
+@pytest.fixture(scope="module", autouse=True)
+def instrument_test_engine():
+    instrument_engine(engine)
+
+
+@pytest.fixture
+def histograms(mocker):
+    return {
+        name: mocker.patch(f"src.instrumentation.{name}")
+        for name in (
+            "handler_latency",
+            "handler_sql_statements",
+            "handler_sql_time",
+            "handler_api_calls",
+            "handler_api_time",
+            "bot_api_latency",
+        )
+    }
+
+
+@pytest.mark.asyncio
+async def test_handler_stats(histograms, mocker):
+    mocker.patch.object(HTTPXRequest, "do_request", AsyncMock(return_value=(200, b"")))
+    request = InstrumentedHTTPXRequest()
+
+    async def some_handler(update, context):
+        async with session_scope() as sess:
+            await sess.execute(text("SELECT 1"))
+            await sess.execute(text("SELECT 2"))
+        await request.do_request(
+            "https://api.telegram.org/bot123:abc/sendMessage", "POST"
+        )
+        return "result"
+
+    assert await instrumented(some_handler)(MagicMock(), MagicMock()) == "result"
+
+    attributes = {"handler": "some_handler", "outcome": "ok"}
+    histograms["handler_latency"].record.assert_called_once()
+    histograms["handler_sql_statements"].record.assert_called_once_with(2, attributes)
+    histograms["handler_api_calls"].record.assert_called_once_with(1, attributes)
+    assert histograms["bot_api_latency"].record.call_args.args[1] == {
+        "method": "sendMessage",
+        "outcome": "ok",
+    }
+
+
+@pytest.mark.asyncio
+async def test_queued_api_calls_count_towards_handler(histograms, mocker):
+    mocker.patch.object(HTTPXRequest, "do_request", AsyncMock(return_value=(200, b"")))
+    request = InstrumentedHTTPXRequest()
+    dispatcher = OutboundDispatcher(workers=1)
+    dispatcher.start()
+
+    async def some_handler(update, context):
+        for _ in range(2):
+            await dispatcher.submit(
+                -1,
+                Priority.message,
+                lambda: request.do_request(
+                    "https://api.telegram.org/bot123:abc/sendMessage", "POST"
+                ),
+                per_chat_limit=False,
+            )
+
+    try:
+        await instrumented(some_handler)(MagicMock(), MagicMock())
+    finally:
+        await dispatcher.stop()
+
+    histograms["handler_api_calls"].record.assert_called_once_with(
+        2, {"handler": "some_handler", "outcome": "ok"}
+    )
+
+
+@pytest.mark.asyncio
+async def test_handler_error(histograms):
+    def sync_handler(update, context):
+        async def fail():
+            raise ValueError()
+
+        return fail()
+
+    with pytest.raises(ValueError):
+        await instrumented(sync_handler)(MagicMock(), MagicMock())
+
+    histograms["handler_sql_statements"].record.assert_called_once_with(
+        0, {"handler": "sync_handler", "outcome": "error"}
+    )
+
+
+@pytest.mark.asyncio
+async def test_statements_outside_handlers_are_not_counted(histograms):
+    async with session_scope() as sess:
+        await sess.execute(text("SELECT 1"))
+
+    histograms["handler_sql_statements"].record.assert_not_called()
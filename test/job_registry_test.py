@@ -0,0 +1,77 @@
+import pytest
+from telegram.ext import ApplicationBuilder
+
+from src.job_registry import JobRegistry
+
+
+async def dummy_callback(context):
+    pass
+
+
+@pytest.fixture
+def job_queue():
+    application = ApplicationBuilder().token("123:dummy").build()
+    return application.job_queue
+
+
+def schedule(job_queue, chat_id, user_id, callback=dummy_callback):
+    return job_queue.run_once(
+        callback,
+        3600,
+        data={"chat_id": chat_id, "user_id": user_id},
+    )
+
+
+@pytest.mark.asyncio
+async def test_lookups(job_queue):
+    registry = JobRegistry()
+    registry.attach(job_queue)
+    job_1 = registry.add(schedule(job_queue, -1, 1))
+    job_2 = registry.add(schedule(job_queue, -1, 2))
+    job_3 = registry.add(schedule(job_queue, -2, 1))
+
+    assert registry.get_user_jobs(-1, 1) == [job_1]
+    assert registry.get_chat_jobs(-1) == [job_1, job_2]
+    assert registry.get_chat_jobs(-2, "dummy_callback") == [job_3]
+    assert registry.get_chat_jobs(-2, "on_kick_timeout") == []
+    assert registry.get_jobs_by_name("dummy_callback") == [job_1, job_2, job_3]
+    assert registry.get_user_jobs(-3, 1) == []
+
+
+@pytest.mark.asyncio
+async def test_removal_is_tracked_through_scheduler_events(job_queue):
+    registry = JobRegistry()
+    registry.attach(job_queue)
+    await job_queue.start()
+    try:
+        job_1 = registry.add(schedule(job_queue, -1, 1))
+        job_2 = registry.add(schedule(job_queue, -1, 2))
+
+        # removed directly, bypassing the registry
+        job_1.schedule_removal()
+        assert registry.get_user_jobs(-1, 1) == []
+        assert registry.get_chat_jobs(-1) == [job_2]
+
+        registry.remove(job_2)
+        assert len(registry) == 0
+        assert job_queue.jobs() == ()
+    finally:
+        await job_queue.stop(wait=False)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_on_scheduler_start(job_queue):
+    # jobs scheduled before the registry knows about them, e.g. loaded from a job store
+    schedule(job_queue, -1, 1)
+    schedule(job_queue, -1, 2)
+
+    registry = JobRegistry()
+    registry.attach(job_queue)
+    assert len(registry) == 0
+
+    await job_queue.start()
+    try:
+        assert len(registry) == 2
+        assert [job.data["user_id"] for job in registry.get_chat_jobs(-1)] == [1, 2]
+    finally:
+        await job_queue.stop(wait=False)
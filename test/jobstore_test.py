@@ -0,0 +1,121 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+
+from sqlalchemy import func, select
+from telegram.ext import ApplicationBuilder
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.jobstore import WriteBehindJobStore
+
+
+async def dummy_callback(context):
+    pass
+
+
+async def start_job_queue(url, **kwargs):
+    application = ApplicationBuilder().token("123:dummy").build()
+    store = WriteBehindJobStore(application=application, url=url, **kwargs)
+    application.job_queue.scheduler.add_jobstore(store)
+    await application.job_queue.start()
+    return application.job_queue, store
+
+
+def count_rows(store):
+    with store.engine.begin() as connection:
+        return connection.execute(
+            select(func.count()).select_from(store.jobs_t)
+        ).scalar()
+
+
+@pytest.mark.asyncio
+async def test_jobs_survive_restart(tmp_path):
+    url = f"sqlite:///{tmp_path}/jobs.sqlite"
+    job_queue, _ = await start_job_queue(url)
+    job_queue.run_once(
+        dummy_callback, 3600, data={"chat_id": -1, "user_id": 1}, name="kick"
+    )
+    removed = job_queue.run_once(dummy_callback, 3600, name="removed")
+    removed.schedule_removal()
+    await job_queue.stop()
+
+    job_queue, _ = await start_job_queue(url)
+    jobs = job_queue.jobs()
+    assert [job.name for job in jobs] == ["kick"]
+    assert jobs[0].callback is dummy_callback
+    assert jobs[0].data == {"chat_id": -1, "user_id": 1}
+    assert jobs[0].job.args[0] is job_queue
+    await job_queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_changes_are_batched(tmp_path, mocker):
+    job_queue, store = await start_job_queue(
+        f"sqlite:///{tmp_path}/jobs.sqlite", linger_s=0.1
+    )
+    write = mocker.spy(store, "_write")
+
+    # what one update does, with awaits in between
+    for user_id in range(5):
+        job = job_queue.run_once(dummy_callback, 3600, data={"user_id": user_id})
+        await asyncio.sleep(0)
+        job.schedule_removal()
+        job_queue.run_once(dummy_callback, 7200, data={"user_id": user_id})
+    await asyncio.sleep(0.3)
+
+    assert write.call_count == 1
+    _, changes = write.call_args.args
+    assert len(changes) == 10
+    assert count_rows(store) == 5
+    await job_queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_write_is_retried(tmp_path, mocker):
+    job_queue, store = await start_job_queue(
+        f"sqlite:///{tmp_path}/jobs.sqlite", linger_s=0, retry_interval_s=0.1
+    )
+    original_write = store._write
+    failures = [Exception("db is down")]
+
+    def write(*args):
+        if failures:
+            raise failures.pop()
+        original_write(*args)
+
+    mocker.patch.object(store, "_write", side_effect=write)
+    mocker.patch("src.jobstore.tg_logger")
+
+    job_queue.run_once(dummy_callback, 3600)
+    await asyncio.sleep(0.3)
+
+    assert store._write.call_count == 2
+    assert count_rows(store) == 1
+    await job_queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_drop_jobs_before_start(tmp_path):
+    url = f"sqlite:///{tmp_path}/jobs.sqlite"
+    job_queue, _ = await start_job_queue(url)
+    for _ in range(3):
+        job_queue.run_repeating(dummy_callback, 60, name="metrics_exporter")
+    job_queue.run_once(dummy_callback, 3600, name="kick")
+    await job_queue.stop()
+
+    application = ApplicationBuilder().token("123:dummy").build()
+    store = WriteBehindJobStore(application=application, url=url)
+    assert store.drop_jobs(["metrics_exporter"]) == 3
+    application.job_queue.scheduler.add_jobstore(store)
+    await application.job_queue.start()
+    assert [job.name for job in application.job_queue.jobs()] == ["kick"]
+    await application.job_queue.stop()
+    assert count_rows(store) == 1
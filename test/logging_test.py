@@ -0,0 +1,112 @@
+import logging
+import queue
+from unittest.mock import MagicMock, patch
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.logging import (
+        AlertHandler,
+        DedupFilter,
+        NonBlockingQueueHandler,
+        RateLimitFilter,
+        SamplingFilter,
+        parse_sample_rates,
+        setup_logger,
+    )
+
+
+def make_record(msg="something failed", lineno=1, level=logging.WARNING):
+    return logging.LogRecord("test", level, "src/test.py", lineno, msg, None, None)
+
+
+def test_dedup_filter(mocker):
+    clock = mocker.patch("src.logging.time.monotonic", return_value=0)
+    dedup = DedupFilter(window_s=60)
+
+    assert dedup.filter(make_record())
+    assert not dedup.filter(make_record())
+    assert not dedup.filter(make_record())
+    # another call site
+    assert dedup.filter(make_record(lineno=2))
+
+    clock.return_value = 61
+    record = make_record()
+    assert dedup.filter(record)
+    assert record.msg == "something failed\n(2 similar records suppressed)"
+
+
+def test_rate_limit_filter(mocker):
+    clock = mocker.patch("src.logging.time.monotonic", return_value=0)
+    rate_limit = RateLimitFilter(rate_per_min=6, burst=2)
+
+    assert rate_limit.filter(make_record())
+    assert rate_limit.filter(make_record())
+    assert not rate_limit.filter(make_record())
+
+    # one token every 10 seconds
+    clock.return_value = 10
+    record = make_record()
+    assert rate_limit.filter(record)
+    assert record.msg == "something failed\n(1 records dropped by the rate limit)"
+    assert not rate_limit.filter(make_record())
+
+
+def test_alert_handler_annotates_a_copy(mocker):
+    mocker.patch("src.logging.time.monotonic", return_value=0)
+    handler = AlertHandler(token="dummy_token", chat_id="dummy_chat_id")
+    emitted = []
+    handler.emit = emitted.append
+    handler.addFilter(RateLimitFilter(rate_per_min=0, burst=1))
+
+    handler.handle(make_record())
+    handler.handle(make_record())
+    handler.filters[0]._tokens = 1
+    record = make_record()
+    handler.handle(record)
+
+    assert emitted[-1].msg == "something failed\n(1 records dropped by the rate limit)"
+    # as the other handlers get it
+    assert record.msg == "something failed"
+
+
+def test_sampling_filter(mocker):
+    mocker.patch("src.logging.random.random", return_value=0.5)
+    rates = parse_sample_rates("debug=0.1, INFO=0.9")
+    assert rates == {logging.DEBUG: 0.1, logging.INFO: 0.9}
+    sampling = SamplingFilter(rates)
+
+    assert not sampling.filter(make_record(level=logging.DEBUG))
+    assert sampling.filter(make_record(level=logging.INFO))
+    assert sampling.filter(make_record(level=logging.ERROR))
+
+
+def test_queue_handler_does_not_block():
+    records = queue.Queue(maxsize=1)
+    handler = NonBlockingQueueHandler(records)
+
+    handler.handle(logging.LogRecord("test", logging.ERROR, "", 1, "%s", ("a",), None))
+    handler.handle(make_record())
+
+    assert records.qsize() == 1
+    record = records.get_nowait()
+    assert record.msg == "a" and record.args is None
+
+
+def test_setup_logger_hands_records_to_listener():
+    handler = MagicMock(level=logging.NOTSET)
+    listener = setup_logger("test_logger", [handler], level="INFO")
+
+    logger = logging.getLogger("test_logger")
+    logger.debug("dropped before the queue")
+    logger.info("handled in %s", "the listener")
+    listener.stop()
+
+    handler.handle.assert_called_once()
+    assert handler.handle.call_args.args[0].getMessage() == "handled in the listener"
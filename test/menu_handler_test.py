@@ -3,12 +3,13 @@ import pytest, pytest_asyncio, asyncio
 
 # from conftest import function_scoped_event_loop, session_scoped_event_loop
 
-from src.handlers.admin.menu_handler import button_handler
+from src.handlers.admin.menu_handler import button_handler, _job_rescheduling_helper
+from src.handlers.group.group_handler import on_kick_timeout, on_notify_timeout
 from src.texts import _
 from src import constants
 
 
-from unittest.mock import patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
@@ -395,3 +396,37 @@ async def test_set_on_introduce_message_update(mock_update, mock_context, mocker
         message_id=mock_update.callback_query.message.message_id,
         parse_mode=ParseMode.MARKDOWN,
     )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "job_func, timeout, kick_timeout, rescheduled",
+    [
+        (on_kick_timeout, 0, 0, False),
+        (on_kick_timeout, 5, 0, True),
+        (on_notify_timeout, 0, 10, False),
+        (on_notify_timeout, 5, 10, True),
+        (on_notify_timeout, 10, 5, False),
+    ],
+)
+async def test_legacy_jobs_rescheduled_like_deadlines(
+    mock_context, mocker, job_func, timeout, kick_timeout, rescheduled
+):
+    job = MagicMock(data={"chat_id": 1, "user_id": 2, "creation_time": 1000.0})
+    registry = mocker.patch("src.handlers.admin.menu_handler.job_registry")
+    registry.get_chat_jobs.return_value = [job]
+    mocker.patch(
+        "src.handlers.admin.menu_handler.chat_settings_cache.get",
+        AsyncMock(return_value=MagicMock(kick_timeout=kick_timeout)),
+    )
+    cancel = mocker.patch("src.handlers.admin.menu_handler.cancel_chat_deadlines")
+    reschedule = mocker.patch(
+        "src.handlers.admin.menu_handler.reschedule_chat_deadlines"
+    )
+
+    await _job_rescheduling_helper(job_func, timeout, mock_context, 1)
+
+    registry.remove.assert_called_once_with(job)
+    assert mock_context.job_queue.run_once.called == rescheduled
+    assert reschedule.called == rescheduled
+    assert cancel.called != rescheduled
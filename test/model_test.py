@@ -0,0 +1,68 @@
+import pytest
+from sqlalchemy import event, select
+
+from src.model import Chat, User, engine, insert_if_missing, upsert, upsert_chat
+from src.texts import _
+
+
+@pytest.mark.asyncio
+async def test_upsert_user(async_session, populate_db):
+    await upsert(async_session, User(chat_id=2, user_id=1, whois="#whois updated"))
+    await upsert(async_session, User(chat_id=2, user_id=7, whois="#whois new"))
+    await async_session.commit()
+
+    async_session.expire_all()
+    result = await async_session.execute(
+        select(User.user_id, User.whois).where(User.chat_id == 2).order_by(User.user_id)
+    )
+    assert result.all() == [
+        (1, "#whois updated"),
+        (2, "User 2 in Chat 2"),
+        (7, "#whois new"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_upsert_checks_for_insert_only_if_asked(async_session, populate_db):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement.split()[0])
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        assert await upsert(
+            async_session,
+            User(chat_id=2, user_id=8, whois="#whois"),
+            return_inserted=True,
+        )
+        assert (
+            await upsert(async_session, User(chat_id=2, user_id=9, whois="#whois"))
+            is None
+        )
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    assert statements == ["SELECT", "INSERT", "INSERT"]
+
+
+@pytest.mark.asyncio
+async def test_upsert_chat_updates_only_given_settings(async_session, populate_db):
+    await upsert_chat(async_session, Chat(id=1, kick_timeout=5))
+    await upsert_chat(async_session, Chat(id=-100, notify_timeout=7))
+    await async_session.commit()
+
+    async_session.expire_all()
+    chat = await async_session.get(Chat, 1)
+    assert chat.kick_timeout == 5
+    assert chat.notify_timeout == 60
+    assert chat.on_new_chat_member_message == "Welcome to Chat 1"
+
+    new_chat = await async_session.get(Chat, -100)
+    assert new_chat.notify_timeout == 7
+    assert new_chat.on_new_chat_member_message == _("msg__new_chat_member")
+
+
+@pytest.mark.asyncio
+async def test_insert_if_missing(async_session, populate_db):
+    assert not await insert_if_missing(async_session, Chat.get_new_chat(1))
+    assert await insert_if_missing(async_session, Chat.get_new_chat(-100))
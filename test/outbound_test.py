@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+
+from telegram.error import RetryAfter
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.outbound import OutboundDispatcher, Priority
+
+
+def new_dispatcher(**kwargs):
+    params = dict(
+        global_rate=1000, group_rate_per_min=60000, private_rate=1000, workers=1
+    )
+    params.update(kwargs)
+    return OutboundDispatcher(**params)
+
+
+@pytest.mark.asyncio
+async def test_direct_call_when_not_started():
+    dispatcher = new_dispatcher()
+
+    async def call():
+        return "sent"
+
+    assert await dispatcher.submit(-1, Priority.message, call) == "sent"
+
+
+@pytest.mark.asyncio
+async def test_kicks_go_first():
+    dispatcher = new_dispatcher()
+    order = []
+
+    def request(name):
+        async def call():
+            order.append(name)
+
+        return call
+
+    # keep the only worker busy until all the requests are queued
+    gate = asyncio.Event()
+    dispatcher.start()
+    try:
+        blocker = asyncio.create_task(
+            dispatcher.submit(-1, Priority.message, gate.wait)
+        )
+        await asyncio.sleep(0)
+        requests = [
+            dispatcher.submit(-2, Priority.delete, request("delete")),
+            dispatcher.submit(-3, Priority.message, request("welcome")),
+            dispatcher.submit(-4, Priority.kick, request("kick")),
+        ]
+        tasks = [asyncio.create_task(r) for r in requests]
+        await asyncio.sleep(0)
+        assert dispatcher.pending == 3
+        gate.set()
+        await asyncio.gather(blocker, *tasks)
+    finally:
+        await dispatcher.stop()
+    assert order == ["kick", "welcome", "delete"]
+    assert dispatcher.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_retry_after():
+    dispatcher = new_dispatcher()
+    attempts = []
+
+    async def call():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) == 1:
+            raise RetryAfter(0.05)
+        return "sent"
+
+    dispatcher.start()
+    try:
+        assert await dispatcher.submit(-1, Priority.message, call) == "sent"
+    finally:
+        await dispatcher.stop()
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_per_chat_limit_does_not_block_other_chats():
+    dispatcher = new_dispatcher(group_rate_per_min=60)  # one message per second
+    sent = []
+
+    def request(name):
+        async def call():
+            sent.append(name)
+
+        return call
+
+    dispatcher.start()
+    try:
+        await dispatcher.submit(-1, Priority.message, request("first"))
+        second = asyncio.create_task(
+            dispatcher.submit(-1, Priority.message, request("second"))
+        )
+        await asyncio.wait_for(
+            dispatcher.submit(-2, Priority.message, request("other chat")), 0.5
+        )
+        assert sent == ["first", "other chat"]
+        second.cancel()
+    finally:
+        await dispatcher.stop()
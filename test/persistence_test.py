@@ -0,0 +1,91 @@
+import pytest
+from unittest.mock import MagicMock
+
+from sqlalchemy import select
+
+import src.persistence
+from src.model import PersistenceEntry
+from src.persistence import SQLPersistence
+
+
+async def stored(async_session):
+    async_session.expire_all()
+    result = await async_session.execute(
+        select(PersistenceEntry.kind, PersistenceEntry.key, PersistenceEntry.data)
+    )
+    return sorted(result.all())
+
+
+@pytest.mark.asyncio
+async def test_only_changed_data_is_written(async_session, mocker):
+    persistence = SQLPersistence()
+    assert await persistence.get_user_data() == {}
+    upsert = mocker.spy(src.persistence, "upsert")
+
+    for user_id in range(3):
+        await persistence.refresh_user_data(user_id, {})
+    # users who never had any data aren't written
+    await persistence.update_user_data(0, {})
+    await persistence.update_user_data(1, {"action": 5, "chat_id": -1})
+    assert upsert.call_count == 1
+    await persistence.update_user_data(1, {"chat_id": -1, "action": 5})
+    assert upsert.call_count == 1
+
+    assert await stored(async_session) == [("user", "1", {"action": 5, "chat_id": -1})]
+
+
+@pytest.mark.asyncio
+async def test_data_is_loaded_lazily(async_session):
+    persistence = SQLPersistence()
+    await persistence.get_user_data()
+    await persistence.refresh_user_data(1, {})
+    await persistence.update_user_data(1, {"action": 5})
+
+    restarted = SQLPersistence()
+    assert await restarted.get_user_data() == {}
+    user_data = {}
+    await restarted.refresh_user_data(1, user_data)
+    assert user_data == {"action": 5}
+
+    await restarted.update_user_data(1, {})
+    assert await stored(async_session) == []
+
+
+@pytest.mark.asyncio
+async def test_entries_written_by_another_worker_are_reloaded(async_session):
+    worker, other = SQLPersistence(), SQLPersistence()
+    await worker.get_user_data()
+    await other.get_user_data()
+    user_data = {}
+    await worker.refresh_user_data(1, user_data)
+    await worker.update_user_data(1, {"action": 5})
+    user_data.update(action=5)
+
+    # user 1 moves to the other worker, then back
+    await other.refresh_user_data(1, {})
+    await other.update_user_data(1, {"action": 6})
+    await other.refresh_user_data(2, {})
+    await other.update_user_data(2, {"action": 7})
+    assert await worker.poll_changes() == 2
+
+    await worker.refresh_user_data(1, user_data)
+    assert user_data == {"action": 6}
+    new_user_data = {}
+    await worker.refresh_user_data(2, new_user_data)
+    assert new_user_data == {"action": 7}
+    # its own writes are not read again
+    assert await other.poll_changes() == 0
+
+
+@pytest.mark.asyncio
+async def test_evict(async_session):
+    persistence = SQLPersistence(ttl_s=60)
+    await persistence.get_user_data()
+    for user_id in (1, 2):
+        await persistence.refresh_user_data(user_id, {})
+        await persistence.update_user_data(user_id, {"action": user_id})
+    persistence._last_access[("user", "1")] -= 3600
+
+    application = MagicMock()
+    await persistence.evict(application)
+    application.drop_user_data.assert_called_once_with(1)
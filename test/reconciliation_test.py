@@ -0,0 +1,206 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import delete, select, update
+from telegram.ext import ApplicationBuilder
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.deadlines import (
+        DELETE_MESSAGE,
+        KICK,
+        NOTIFY,
+        DeadlineSweeper,
+        new_deadline,
+    )
+    from src.jobstore import WriteBehindJobStore
+    from src.model import Deadline, User
+    from src.reconciliation import StartupReconciler
+
+
+async def legacy_callback(context):
+    pass
+
+
+def reconciler(**kwargs):
+    sweeper = DeadlineSweeper(
+        {KICK: AsyncMock(), NOTIFY: AsyncMock()},
+        batch_callbacks={DELETE_MESSAGE: AsyncMock()},
+    )
+    return StartupReconciler(sweeper, **kwargs)
+
+
+async def deadline_ids(async_session):
+    result = await async_session.execute(select(Deadline.id).order_by(Deadline.id))
+    return result.scalars().all()
+
+
+@pytest.mark.asyncio
+async def test_obsolete_dropped_and_chats_interleaved(async_session):
+    async_session.add_all(
+        [
+            new_deadline(-1, 1, KICK, -50),
+            new_deadline(-1, 2, NOTIFY, -40),
+            new_deadline(-1, 2, DELETE_MESSAGE, -30, {"message_id": 10}),
+            new_deadline(-1, 3, DELETE_MESSAGE, -20, {"message_id": 11}),
+            new_deadline(-1, 4, KICK, -10),
+            new_deadline(-2, 5, KICK, -45),
+            new_deadline(-2, 6, KICK, -35),
+            # not due yet
+            new_deadline(-2, 7, KICK, 60),
+            User(chat_id=-1, user_id=1, whois="hi"),
+        ]
+    )
+    await async_session.commit()
+
+    r = reconciler()
+    rows = await r.claim_overdue()
+    assert len(rows) == 7
+    # claimed, the sweeper leaves them alone
+    assert await r.sweeper.claim() == []
+
+    rows = await r.drop_obsolete(rows)
+    assert r.dropped == 1
+    assert len(await deadline_ids(async_session)) == 7
+
+    units = r.interleave(rows)
+    users = [
+        (kind, chat_id, [row.user_id for row in rows]) for kind, chat_id, rows in units
+    ]
+    # the chats take turns, the deletions of a chat are batched
+    assert users == [
+        (KICK, -2, [5]),
+        (NOTIFY, -1, [2]),
+        (KICK, -2, [6]),
+        (DELETE_MESSAGE, -1, [2, 3]),
+        (KICK, -1, [4]),
+    ]
+    assert [r.api_calls(unit) for unit in units] == [3, 2, 3, 1, 3]
+
+
+@pytest.mark.asyncio
+async def test_replay_within_budget(async_session, mocker):
+    async_session.add_all(
+        [new_deadline(-chat_id, chat_id, KICK, -60) for chat_id in range(1, 5)]
+    )
+    await async_session.commit()
+    clock = mocker.patch("src.reconciliation.time.monotonic", return_value=100.0)
+    slept = []
+
+    async def sleep(delay):
+        slept.append(delay)
+        clock.return_value += delay
+
+    mocker.patch("src.reconciliation.asyncio.sleep", sleep)
+
+    r = reconciler(api_budget_per_s=1.5)
+    rows = await r.claim_overdue()
+    # cancelled after the claim, e.g. by a #whois
+    await async_session.execute(delete(Deadline).where(Deadline.chat_id == -3))
+    await async_session.commit()
+    r.total = len(rows)
+    application = ApplicationBuilder().token("123:dummy").build()
+    await r.replay(application, r.interleave(rows))
+
+    callback = r.sweeper.callbacks[KICK]
+    chats = [call.args[0].job.data["chat_id"] for call in callback.call_args_list]
+    assert sorted(chats) == [-4, -2, -1]
+    # 3 API calls each, 2 seconds apart
+    assert slept == [2, 2]
+    assert (r.replayed, r.dropped, r.pending) == (3, 1, 0)
+    assert await deadline_ids(async_session) == []
+
+
+@pytest.mark.asyncio
+async def test_legacy_jobs_imported(async_engine, async_session, tmp_path):
+    url = f"sqlite:///{tmp_path}/jobs.sqlite"
+    application = ApplicationBuilder().token("123:dummy").build()
+    store = WriteBehindJobStore(application=application, url=url)
+    application.job_queue.scheduler.add_jobstore(store)
+    await application.job_queue.start()
+    data = {"chat_id": -1, "user_id": 1, "creation_time": 1000.0}
+    application.job_queue.run_once(
+        legacy_callback, 3600, data=data, name="on_kick_timeout"
+    )
+    application.job_queue.run_once(
+        legacy_callback,
+        3600,
+        data={**data, "message_id": 10},
+        name="delete_message",
+    )
+    application.job_queue.run_once(legacy_callback, 3600, data=data, name="other")
+    application.job_queue.run_once(
+        legacy_callback, 7200, data=data, name="on_notify_timeout"
+    )
+    await application.job_queue.stop()
+
+    store = WriteBehindJobStore(application=application, url=url)
+    with store.engine.begin() as connection:
+        connection.execute(
+            update(store.jobs_t)
+            .where(store.jobs_t.c.next_run_time < time.time() + 5000)
+            .values(next_run_time=time.time() - 10)
+        )
+
+    r = reconciler()
+    imported = await r.import_legacy_jobs(store)
+    assert len(imported) == 2
+    # claimed for the replay, the sweeper leaves them alone
+    assert await r.sweeper.claim() == []
+    result = await async_session.execute(
+        select(Deadline.kind, Deadline.created_at, Deadline.payload).order_by(
+            Deadline.kind
+        )
+    )
+    assert result.all() == [
+        (DELETE_MESSAGE, 1000.0, {"message_id": 10}),
+        (KICK, 1000.0, None),
+    ]
+    with store.engine.begin() as connection:
+        assert len(connection.execute(select(store.jobs_t.c.id)).all()) == 2
+
+
+@pytest.mark.asyncio
+async def test_legacy_jobs_replayed_within_budget(async_session, tmp_path, mocker):
+    url = f"sqlite:///{tmp_path}/jobs.sqlite"
+    application = ApplicationBuilder().token("123:dummy").build()
+    store = WriteBehindJobStore(application=application, url=url)
+    application.job_queue.scheduler.add_jobstore(store)
+    await application.job_queue.start()
+    for chat_id in range(1, 4):
+        application.job_queue.run_once(
+            legacy_callback,
+            -60,
+            data={"chat_id": -chat_id, "user_id": chat_id},
+            name="on_kick_timeout",
+        )
+    application.job_queue.scheduler.pause()
+    await application.job_queue.stop()
+    clock = mocker.patch("src.reconciliation.time.monotonic", return_value=100.0)
+    slept = []
+
+    async def sleep(delay):
+        slept.append(delay)
+        clock.return_value += delay
+
+    mocker.patch("src.reconciliation.asyncio.sleep", sleep)
+
+    # e.g. on becoming the leader
+    r = reconciler(api_budget_per_s=1.5, delay_s=0)
+    await r.replay_legacy_jobs(application, WriteBehindJobStore(application, url=url))
+    await asyncio.gather(*r._tasks)
+
+    callback = r.sweeper.callbacks[KICK]
+    chats = [call.args[0].job.data["chat_id"] for call in callback.call_args_list]
+    assert sorted(chats) == [-3, -2, -1]
+    assert slept == [0, 2, 2]
+    assert (r.replayed, r.pending) == (3, 0)
@@ -0,0 +1,109 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.deadlines import KICK, DeadlineSweeper, new_deadline
+    from src.router import UpdateRouter, update_chat_id
+    from src.sharding import HashRing, ShardCoordinator, chat_slot, live_workers
+from src import constants
+
+
+def test_ring_moves_only_the_slots_of_a_gone_worker():
+    ring = HashRing(["a", "b", "c"])
+    slots = {worker: ring.slots_of(worker) for worker in "abc"}
+    assert set().union(*slots.values()) == set(range(constants.SHARD_SLOTS))
+    # roughly balanced
+    assert all(len(s) > constants.SHARD_SLOTS / 6 for s in slots.values())
+
+    smaller = HashRing(["a", "b"])
+    assert slots["a"] <= smaller.slots_of("a")
+    assert slots["b"] <= smaller.slots_of("b")
+    assert ring.owner(-1001) == ring.slot_owners[chat_slot(-1001)]
+
+
+@pytest.mark.asyncio
+async def test_membership_and_failover(async_engine, mocker):
+    clock = mocker.patch("src.sharding.time.time", return_value=1000)
+    workers = [
+        ShardCoordinator(worker_id, url=f"http://{worker_id}/telegram", ttl_s=20)
+        for worker_id in ("a", "b", "c")
+    ]
+    for worker in workers:
+        await worker.heartbeat()
+    for worker in workers:
+        await worker.heartbeat()
+
+    a, b, c = workers
+    assert a.slots | b.slots | c.slots == set(range(constants.SHARD_SLOTS))
+    assert not a.slots & b.slots and not b.slots & c.slots
+    assert [w.is_leader for w in workers] == [True, False, False]
+
+    # a dies, its row and lease expire
+    clock.return_value = 1030
+    await b.heartbeat()
+    await c.heartbeat()
+    assert b.slots | c.slots == set(range(constants.SHARD_SLOTS))
+    assert b.is_leader and not c.is_leader
+
+    # c leaves on shutdown, b takes over right away
+    await c.stop()
+    await b.heartbeat()
+    assert b.slots == set(range(constants.SHARD_SLOTS))
+
+    # the router couldn't reach a worker without a URL
+    with pytest.raises(ValueError):
+        await ShardCoordinator("d").start()
+    assert set(await live_workers()) == {"b"}
+
+
+@pytest.mark.asyncio
+async def test_sweeper_claims_owned_slots_only(async_session):
+    async_session.add_all(
+        [new_deadline(-chat_id, 1, KICK, -1) for chat_id in (1, 2, 3, 4)]
+    )
+    await async_session.commit()
+
+    sweeper = DeadlineSweeper({KICK: AsyncMock()}, owned_slots=lambda: {1, 3})
+    claimed = await sweeper.claim()
+    assert sorted(row.chat_id for row in claimed) == [-3, -1]
+
+    sweeper.owned_slots = frozenset
+    assert await sweeper.claim() == []
+
+
+def test_update_chat_id():
+    assert update_chat_id({"update_id": 1, "message": {"chat": {"id": -5}}}) == -5
+    callback_query = {"from": {"id": 7}, "message": {"chat": {"id": 7}}}
+    assert update_chat_id({"callback_query": callback_query}) == 7
+    assert update_chat_id({"inline_query": {"from": {"id": 9}}}) == 9
+    assert update_chat_id({"update_id": 1}) is None
+
+
+@pytest.mark.asyncio
+async def test_router_forwards_to_owner():
+    router = UpdateRouter("secret")
+    router.ring = HashRing(["a", "b"])
+    router.urls = {"a": "http://a/telegram", "b": "http://b/telegram"}
+    router._client = MagicMock(post=AsyncMock(return_value=MagicMock(status_code=200)))
+    body = json.dumps({"update_id": 1, "message": {"chat": {"id": -5}}}).encode()
+    headers = {"x-telegram-bot-api-secret-token": "secret"}
+
+    assert await router.respond("POST", "/telegram", {}, body) == 403
+    assert await router.respond("POST", "/telegram", headers, body) == 200
+    url = router._client.post.call_args.args[0]
+    assert url == router.urls[router.ring.owner(-5)]
+    assert router._client.post.call_args.kwargs["content"] == body
+
+    router._client.post.return_value = MagicMock(status_code=503)
+    assert await router.respond("POST", "/telegram", headers, body) == 503
+    router.urls = {}
+    assert await router.respond("POST", "/telegram", headers, body) == 503
@@ -41,3 +41,79 @@ async def test_start_handler_basic(mock_update, mock_context, mocker):
             )
         ),
     )
+
+
+@pytest.mark.asyncio
+async def test_start_handler_uses_admin_index(
+    mock_update, mock_context, async_session, mocker
+):
+    import time
+    from sqlalchemy import select
+    from src.model import ChatAdmin
+
+    now = time.time()
+    async_session.add_all(
+        [
+            ChatAdmin(
+                user_id=7, chat_id=-1, is_admin=True, title="Fresh", verified_at=now
+            ),
+            ChatAdmin(
+                user_id=7, chat_id=-2, is_admin=False, title="Member", verified_at=now
+            ),
+            ChatAdmin(
+                user_id=7, chat_id=-3, is_admin=True, title="Stale", verified_at=0
+            ),
+        ]
+    )
+    await async_session.commit()
+    authorize_user = mocker.patch(
+        "src.handlers.admin.utils.authorize_user", return_value=False
+    )
+
+    mock_update.message.chat_id = 7
+    await start_handler(mock_update, mock_context)
+
+    # only the stale entry is checked, and it's no longer an admin's chat
+    authorize_user.assert_awaited_once_with(mock_context.bot, -3, 7)
+    keyboard = mock_update.message.reply_text.call_args.kwargs["reply_markup"]
+    assert [row[0].text for row in keyboard.inline_keyboard] == ["Fresh"]
+    async_session.expire_all()
+    result = await async_session.execute(
+        select(ChatAdmin.is_admin).where(ChatAdmin.chat_id == -3)
+    )
+    assert result.scalar() is False
+
+
+@pytest.mark.asyncio
+async def test_start_handler_lookup_timeout(
+    mock_update, mock_context, async_session, mocker
+):
+    import asyncio
+    from src.model import ChatAdmin
+
+    async_session.add_all(
+        [
+            ChatAdmin(
+                user_id=8, chat_id=-1, is_admin=True, title="Slow", verified_at=0
+            ),
+            ChatAdmin(
+                user_id=8, chat_id=-2, is_admin=False, title="Slow", verified_at=0
+            ),
+        ]
+    )
+    await async_session.commit()
+
+    async def hang(*args):
+        await asyncio.sleep(10)
+
+    mocker.patch("src.handlers.admin.utils.authorize_user", side_effect=hang)
+    mocker.patch("src.constants.ADMIN_LOOKUP_TIMEOUT_S", 0.01)
+
+    mock_update.message.chat_id = 8
+    await start_handler(mock_update, mock_context)
+
+    # the last known status is used when Telegram doesn't answer in time
+    keyboard = mock_update.message.reply_text.call_args.kwargs["reply_markup"]
+    assert [row[0].callback_data for row in keyboard.inline_keyboard] == [
+        json.dumps({"chat_id": -1, "action": constants.Actions.select_chat})
+    ]
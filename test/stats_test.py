@@ -0,0 +1,69 @@
+import time
+import pytest
+
+from src.model import ShardWorker, User, upsert
+from src.stats import CHATS, UNIQUE_USERS, USERS, DBStats
+
+
+@pytest.mark.asyncio
+async def test_incremental_counts(async_session, populate_db):
+    stats = DBStats()
+    stats.chat_inserted()
+    assert stats.get(CHATS) is None
+
+    await stats.reconcile()
+    assert (stats.get(CHATS), stats.get(USERS), stats.get(UNIQUE_USERS)) == (3, 5, 3)
+
+    stats.chat_inserted()
+    # user 1 is already in chats 1 and 2
+    for user_id, chat_id in [(1, 3), (9, 3)]:
+        assert await upsert(
+            async_session,
+            User(user_id=user_id, chat_id=chat_id, whois="#whois"),
+            return_inserted=True,
+        )
+        await stats.user_inserted(async_session, user_id, chat_id)
+    # an update is not counted
+    assert not await upsert(
+        async_session,
+        User(user_id=9, chat_id=3, whois="#whois 2"),
+        return_inserted=True,
+    )
+    await async_session.commit()
+    assert (stats.get(CHATS), stats.get(USERS), stats.get(UNIQUE_USERS)) == (4, 7, 4)
+
+    await stats.reconcile()
+    assert (stats.get(USERS), stats.get(UNIQUE_USERS)) == (7, 4)
+
+
+@pytest.mark.asyncio
+async def test_workers_inserts_added_up_by_leader(async_session, populate_db):
+    async_session.add_all(
+        [
+            ShardWorker(id="a", url="http://a", heartbeat_at=time.time()),
+            ShardWorker(id="b", url="http://b", heartbeat_at=time.time()),
+        ]
+    )
+    await async_session.commit()
+    leader, worker = DBStats(), DBStats()
+    leader.worker_id, worker.worker_id = "a", "b"
+    worker.exported = False
+    await leader.reconcile()
+
+    assert await upsert(
+        async_session, User(user_id=9, chat_id=3, whois="#whois"), return_inserted=True
+    )
+    await worker.user_inserted(async_session, 9, 3)
+    worker.chat_inserted()
+    await async_session.commit()
+    await leader.sync()
+    # not published yet
+    assert (leader.get(CHATS), leader.get(USERS), leader.get(UNIQUE_USERS)) == (3, 5, 3)
+
+    await worker.sync()
+    await leader.sync()
+    assert (leader.get(CHATS), leader.get(USERS), leader.get(UNIQUE_USERS)) == (4, 6, 4)
+    # only the inserts since the previous sync are added
+    await leader.sync()
+    assert leader.get(USERS) == 6
+    assert worker.get(USERS) is None
@@ -0,0 +1,143 @@
+import datetime
+import json
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from sqlalchemy import text
+from telegram import Chat, Message, Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+from telegram.request import HTTPXRequest
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.deadlines import KICK, DeadlineSweeper, new_deadline
+    from src.outbound import OutboundDispatcher, Priority
+from src.instrumentation import InstrumentedHTTPXRequest
+from src.model import session_scope
+from src.tracing import TracedApplication, tracer
+
+exporter = InMemorySpanExporter()
+provider = TracerProvider()
+provider.add_span_processor(SimpleSpanProcessor(exporter))
+trace.set_tracer_provider(provider)
+
+
+@pytest.fixture(autouse=True)
+def clear_spans():
+    exporter.clear()
+    yield
+
+
+@pytest.mark.asyncio
+async def test_update_is_root_span(mocker):
+    mocker.patch("telegram.ext.ExtBot.initialize")
+    application = (
+        ApplicationBuilder()
+        .application_class(TracedApplication)
+        .token("123:dummy")
+        .build()
+    )
+
+    async def handler(update, context):
+        async with session_scope() as sess:
+            await sess.execute(text("SELECT 1"))
+
+    application.add_handler(TypeHandler(Update, handler))
+    await application.initialize()
+    message = Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=-1, type=Chat.SUPERGROUP),
+        text="hello",
+    )
+    await application.process_update(Update(update_id=1, message=message))
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    root = spans["update"]
+    assert root.parent is None
+    assert root.attributes == {"update.kind": "message", "chat.type": "supergroup"}
+    assert spans["session_scope"].parent.span_id == root.context.span_id
+
+
+@pytest.mark.asyncio
+async def test_deadline_span_is_linked_to_scheduling_span(async_session):
+    with tracer.start_as_current_span("update") as span:
+        deadline = new_deadline(-1, 1, KICK, 60)
+    assert deadline.payload["traceparent"]
+    async_session.add(deadline)
+    await async_session.commit()
+
+    callback = AsyncMock(__name__="on_kick_timeout")
+    sweeper = DeadlineSweeper({KICK: callback})
+    row = SimpleNamespace(
+        id=deadline.id,
+        chat_id=-1,
+        user_id=1,
+        kind=KICK,
+        created_at=deadline.created_at,
+        payload=deadline.payload,
+    )
+    await sweeper.dispatch(MagicMock(), row)
+
+    deadline_span = next(
+        s for s in exporter.get_finished_spans() if s.name == "deadline kick"
+    )
+    assert deadline_span.parent is None
+    assert [link.context.span_id for link in deadline_span.links] == [
+        span.get_span_context().span_id
+    ]
+
+
+@pytest.mark.asyncio
+async def test_queued_api_call_is_child_of_update(mocker):
+    mocker.patch("telegram.ext.ExtBot.initialize")
+    result = {"message_id": 2, "date": 0, "chat": {"id": -1, "type": "supergroup"}}
+    sent = json.dumps({"ok": True, "result": result}).encode()
+    mocker.patch.object(HTTPXRequest, "do_request", AsyncMock(return_value=(200, sent)))
+    application = (
+        ApplicationBuilder()
+        .application_class(TracedApplication)
+        .token("123:dummy")
+        .request(InstrumentedHTTPXRequest())
+        .build()
+    )
+    dispatcher = OutboundDispatcher(workers=1)
+
+    async def handler(update, context):
+        await dispatcher.submit(
+            -1, Priority.message, lambda: context.bot.send_message(-1, "hi")
+        )
+
+    application.add_handler(TypeHandler(Update, handler))
+    await application.initialize()
+    dispatcher.start()
+    message = Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=-1, type=Chat.SUPERGROUP),
+        text="hello",
+    )
+    try:
+        await application.process_update(Update(update_id=1, message=message))
+    finally:
+        await dispatcher.stop()
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    root = spans["update"]
+    assert spans["telegram sendMessage"].parent.span_id == root.context.span_id
+
+
+def test_no_traceparent_outside_sampled_spans():
+    assert new_deadline(-1, 1, KICK, 60).payload is None
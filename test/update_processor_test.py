@@ -0,0 +1,93 @@
+import asyncio
+import datetime
+import pytest
+import pytest_asyncio
+
+from telegram import Chat, Message, Update
+
+from src.update_processor import ChatOrderedUpdateProcessor, ordering_key
+
+
+def make_update(update_id, chat_id):
+    message = Message(
+        message_id=update_id,
+        date=datetime.datetime.now(),
+        chat=Chat(id=chat_id, type=Chat.SUPERGROUP),
+        text="#whois",
+    )
+    return Update(update_id=update_id, message=message)
+
+
+@pytest_asyncio.fixture
+async def processor():
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+    await processor.initialize()
+    return processor
+
+
+def test_ordering_key():
+    assert ordering_key(make_update(1, -100)) == -100
+    assert ordering_key(Update(update_id=1)) is None
+    assert ordering_key("not an update") is None
+
+
+@pytest.mark.asyncio
+async def test_updates_of_a_chat_run_in_order(processor):
+    log = []
+
+    async def handle(update_id, delay):
+        log.append(("start", update_id))
+        await asyncio.sleep(delay)
+        log.append(("end", update_id))
+
+    await asyncio.gather(
+        processor.process_update(make_update(1, -1), handle(1, 0.03)),
+        processor.process_update(make_update(2, -1), handle(2, 0)),
+        processor.process_update(make_update(3, -2), handle(3, 0)),
+    )
+
+    # the other chat didn't wait for the slow update
+    assert log.index(("end", 3)) < log.index(("end", 1))
+    # the second update of the chat started after the first one ended
+    assert log.index(("end", 1)) < log.index(("start", 2))
+    assert processor._locks == {}
+
+
+@pytest.mark.asyncio
+async def test_concurrency_cap(processor):
+    running = 0
+    max_running = 0
+
+    async def handle():
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    tasks = [
+        asyncio.create_task(processor.process_update(make_update(i, -i), handle()))
+        for i in range(1, 6)
+    ]
+    await asyncio.sleep(0)
+    assert processor.in_flight == 2
+    assert processor.waiting == 3
+
+    await asyncio.gather(*tasks)
+    assert max_running == 2
+    assert processor.in_flight == processor.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_while_waiting(processor):
+    async def handle():
+        await asyncio.sleep(0.05)
+
+    first = asyncio.create_task(processor.process_update(make_update(1, -1), handle()))
+    second = asyncio.create_task(processor.process_update(make_update(2, -1), handle()))
+    await asyncio.sleep(0)
+    second.cancel()
+    await first
+
+    assert processor.waiting == 0
+    assert processor._locks == {}
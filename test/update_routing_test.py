@@ -0,0 +1,101 @@
+import datetime
+import pytest
+
+from telegram import Chat, Message, MessageEntity, Update, User
+from telegram.ext import (
+    ApplicationBuilder,
+    CallbackQueryHandler,
+    ChatMemberHandler,
+    CommandHandler,
+    MessageHandler,
+    TypeHandler,
+    filters,
+)
+
+from src.update_processor import ChatOrderedUpdateProcessor
+from src.update_routing import (
+    ADMIN_INPUT,
+    COMMAND,
+    HASHTAG,
+    IGNORED,
+    OTHER,
+    STATUS,
+    accept_update,
+    allowed_updates,
+    route,
+)
+
+
+def make_update(chat_type=Chat.SUPERGROUP, text="hello", entities=(), **kwargs):
+    message = Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=1 if chat_type == Chat.PRIVATE else -1, type=chat_type),
+        text=text,
+        entities=[MessageEntity(type, 0, length) for type, length in entities],
+        **kwargs,
+    )
+    return Update(update_id=1, message=message)
+
+
+def test_route():
+    user = User(id=1, first_name="user", is_bot=False)
+
+    assert route(make_update(Chat.PRIVATE, "60")) == ADMIN_INPUT
+    assert route(make_update(Chat.PRIVATE, "/start", [("bot_command", 6)])) == COMMAND
+    assert route(make_update(text="/help", entities=[("bot_command", 5)])) == COMMAND
+    assert route(make_update(text="#whois hi", entities=[("hashtag", 6)])) == HASHTAG
+    assert route(make_update(text=None, new_chat_members=[user])) == STATUS
+    assert route(make_update(text="hello")) == IGNORED
+    assert route(make_update(text="hi", entities=[("bold", 2)])) == IGNORED
+    assert route(make_update(text=None, sticker=None)) == IGNORED
+    assert route(Update(update_id=1)) == OTHER
+    assert route("not an update") == OTHER
+
+    assert accept_update(make_update(text="#whois hi", entities=[("hashtag", 6)]))
+    assert not accept_update(make_update(text="hello"))
+
+
+def test_allowed_updates():
+    async def callback(update, context):
+        pass
+
+    application = ApplicationBuilder().token("123:dummy").build()
+    application.add_handler(TypeHandler(Update, callback), group=-1)
+    application.add_handler(CommandHandler("help", callback))
+    application.add_handler(ChatMemberHandler(callback, ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(CallbackQueryHandler(callback))
+    assert allowed_updates(application) == [
+        Update.CALLBACK_QUERY,
+        Update.CHAT_MEMBER,
+        Update.EDITED_MESSAGE,
+        Update.MESSAGE,
+    ]
+
+    application.add_handler(MessageHandler(filters.TEXT, callback))
+    application.add_handler(
+        ChatMemberHandler(callback, ChatMemberHandler.MY_CHAT_MEMBER)
+    )
+    assert Update.MY_CHAT_MEMBER in allowed_updates(application)
+    assert Update.INLINE_QUERY not in allowed_updates(application)
+
+
+@pytest.mark.asyncio
+async def test_processor_drops_chatter():
+    processor = ChatOrderedUpdateProcessor(accept=accept_update)
+    await processor.initialize()
+    handled = []
+
+    async def handle(update_id):
+        handled.append(update_id)
+
+    chatter = handle(1)
+    await processor.process_update(make_update(text="hello"), chatter)
+    await processor.process_update(
+        make_update(text="#whois hi", entities=[("hashtag", 6)]), handle(2)
+    )
+
+    assert handled == [2]
+    # closed, so no "never awaited" warning
+    assert chatter.cr_frame is None
+    assert processor.waiting == processor.in_flight == 0
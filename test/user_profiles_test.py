@@ -0,0 +1,36 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from telegram import User
+
+from src.cache import TTLCache
+from src.user_profiles import get_user, remember_user
+
+
+@pytest.mark.asyncio
+async def test_get_user_uses_remembered_profile():
+    bot = AsyncMock()
+    user = User(id=1, first_name="Alice", is_bot=False)
+    remember_user(user)
+    assert await get_user(bot, -1, 1) is user
+    bot.get_chat_member.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_get_user_falls_back_to_api_once():
+    user = User(id=2, first_name="Bob", is_bot=False)
+    bot = AsyncMock()
+    bot.get_chat_member.return_value = MagicMock(user=user)
+    assert await get_user(bot, -1, 2) is user
+    assert await get_user(bot, -1, 2) is user
+    bot.get_chat_member.assert_awaited_once_with(-1, 2)
+
+
+def test_ttl_expiry(mocker):
+    monotonic = mocker.patch("src.cache.time.monotonic", return_value=100.0)
+    cache = TTLCache(maxsize=10, ttl=5)
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    monotonic.return_value = 105.0
+    assert cache.get("key") is None
+    assert len(cache) == 0
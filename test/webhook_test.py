@@ -0,0 +1,127 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import MagicMock, PropertyMock, patch
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+with patch.dict(
+    "os.environ",
+    {
+        "TELEGRAM_TOKEN": "dummy_token",
+        "TELEGRAM_ERROR_CHAT_ID": "dummy_chat_id",
+        "UPTRACE_DSN": "dummy_dsn",
+        "DEPLOYMENT_ENVIRONMENT": "testing",
+    },
+):
+    from src.webhook import WebhookServer
+from src.update_processor import ChatOrderedUpdateProcessor
+
+
+def update_body(update_id, chat_id=-1):
+    return json.dumps(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": chat_id, "type": "supergroup"},
+                "text": "hello",
+            },
+        }
+    ).encode()
+
+
+def post(body, token="secret", path="/telegram"):
+    return (
+        f"POST {path} HTTP/1.1\r\n"
+        "Host: localhost\r\n"
+        "Content-Type: application/json\r\n"
+        f"X-Telegram-Bot-Api-Secret-Token: {token}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n"
+    ).encode() + body
+
+
+async def read_status(reader):
+    status = (await reader.readline()).decode().split(" ")[1]
+    while (await reader.readline()) != b"\r\n":
+        pass
+    return int(status)
+
+
+def test_secret_token_and_backpressure():
+    application = MagicMock()
+    application.update_queue = asyncio.Queue()
+    server = WebhookServer(application, "secret", max_pending=2)
+    headers = {"x-telegram-bot-api-secret-token": "secret"}
+
+    assert server.handle_request("POST", "/telegram", {}, update_body(1)) == 403
+    assert (
+        server.handle_request(
+            "POST",
+            "/telegram",
+            {"x-telegram-bot-api-secret-token": "wrong"},
+            update_body(1),
+        )
+        == 403
+    )
+    assert server.handle_request("GET", "/telegram", headers, b"") == 405
+    assert server.handle_request("POST", "/other", headers, update_body(1)) == 404
+    assert server.handle_request("POST", "/telegram", headers, b"{") == 400
+
+    assert server.handle_request("POST", "/telegram", headers, update_body(1)) == 200
+    assert server.handle_request("POST", "/telegram", headers, update_body(2)) == 200
+    # Telegram retries it later
+    assert server.handle_request("POST", "/telegram", headers, update_body(3)) == 503
+    assert application.update_queue.qsize() == 2
+
+    application.update_queue.get_nowait()
+    assert server.handle_request("POST", "/telegram", headers, update_body(3)) == 200
+
+
+@pytest.mark.asyncio
+async def test_updates_are_handled(mocker):
+    mocker.patch("telegram.ext.ExtBot.initialize")
+    mocker.patch("telegram.ext.ExtBot.id", new_callable=PropertyMock, return_value=123)
+    application = (
+        ApplicationBuilder()
+        .token("123:dummy")
+        .concurrent_updates(ChatOrderedUpdateProcessor(max_concurrent_updates=4))
+        .build()
+    )
+    handled = []
+
+    async def handler(update, context):
+        handled.append(update.update_id)
+
+    application.add_handler(TypeHandler(Update, handler))
+    server = WebhookServer(application, "secret", host="127.0.0.1", port=0)
+    await application.initialize()
+    await application.start()
+    await server.start()
+    try:
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        # one connection, kept alive between the updates
+        statuses = []
+        for update_id in range(1, 11):
+            writer.write(post(update_body(update_id, chat_id=-(update_id % 3))))
+            await writer.drain()
+            statuses.append(await read_status(reader))
+        writer.write(post(update_body(11), token="wrong"))
+        await writer.drain()
+        statuses.append(await read_status(reader))
+        writer.close()
+
+        for _ in range(100):
+            if len(handled) == 10:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await server.stop()
+        await application.stop()
+        await application.shutdown()
+
+    assert statuses == [200] * 10 + [403]
+    assert sorted(handled) == list(range(1, 11))